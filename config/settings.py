@@ -27,6 +27,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "mailing.tracing.TracingMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -66,19 +67,33 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+REDIS_URL = os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/1')
+
 # Настройки кеширования
 CACHES = {
     "default": {
         "BACKEND": "django_redis.cache.RedisCache",
-        "LOCATION": os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/1'),
+        "LOCATION": REDIS_URL,
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
         }
     }
 }
 
+# Превышение бюджета SQL запросов представлением (mailing.querybudget): True - ошибка, False - предупреждение в лог
+QUERY_BUDGET_STRICT = os.getenv('QUERY_BUDGET_STRICT', 'False') == 'True'
+
+# Выборочная трассировка запросов (mailing.tracing): доля замеряемых запросов (0 - выключена),
+# размер кольцевого буфера трасс процесса и сколько самых медленных SQL запросов хранить
+TRACING_SAMPLE_RATE = float(os.getenv('TRACING_SAMPLE_RATE', 0))
+TRACING_BUFFER_SIZE = int(os.getenv('TRACING_BUFFER_SIZE', 200))
+TRACING_SLOW_QUERIES = int(os.getenv('TRACING_SLOW_QUERIES', 5))
+TRACING_EXCLUDE_PATHS = ('/traces/', '/metrics/', '/static/', '/media/')
+
 # Время жизни кеша по умолчанию (в секундах)
 CACHE_TTL = 60 * 15  # 15 минут
+# Время жизни версионированного кеша: он сбрасывается сигналами при изменениях, поэтому может жить долго
+CACHE_VERSIONED_TTL = int(os.getenv('CACHE_VERSIONED_TTL', 60 * 60 * 6))
 
 # Настройки шаблонов
 TEMPLATES = [
@@ -135,8 +150,74 @@ LOGOUT_REDIRECT_URL = 'mailing:home'
 APSCHEDULER_DATETIME_FORMAT = "N j, Y, f:s a"
 APSCHEDULER_RUN_NOW_TIMEOUT = 25  # Секунды
 
-CELERY_BROKER_URL = os.getenv('REDIS_URL')
-CELERY_RESULT_BACKEND = os.getenv('REDIS_URL')
+# Доставка рассылок: sequential, thread, process или async
+MAILING_DELIVERY_MODE = os.getenv('MAILING_DELIVERY_MODE', 'sequential')
+MAILING_DELIVERY_WORKERS = int(os.getenv('MAILING_DELIVERY_WORKERS', 4))
+MAILING_DELIVERY_CHUNK_SIZE = int(os.getenv('MAILING_DELIVERY_CHUNK_SIZE', 500))
+# Асинхронная доставка: число SMTP сессий по умолчанию и окно одновременно отправляемых писем
+MAILING_ASYNC_SESSIONS = int(os.getenv('MAILING_ASYNC_SESSIONS', 4))
+MAILING_ASYNC_CONCURRENCY = int(os.getenv('MAILING_ASYNC_CONCURRENCY', 200))
+# Ограничения SMTP сервера: писем в секунду (0 - без ограничения), максимум соединений,
+# задержка ответа, выше которой снижается параллельность, и число повторов при 4xx.
+# Для отдельных серверов можно задать MAILING_RELAY_LIMITS = {'host:port': {'rate': 20, ...}}
+MAILING_RELAY_RATE = float(os.getenv('MAILING_RELAY_RATE', 0))
+MAILING_RELAY_MAX_CONNECTIONS = int(os.getenv('MAILING_RELAY_MAX_CONNECTIONS', 10))
+MAILING_RELAY_TARGET_LATENCY = float(os.getenv('MAILING_RELAY_TARGET_LATENCY', 5)) or None
+MAILING_RELAY_RETRIES = int(os.getenv('MAILING_RELAY_RETRIES', 2))
+MAILING_RELAY_LIMITS = {}
+# Сколько собранных писем (Message) держать в кеше процесса
+MAILING_MESSAGE_CACHE_SIZE = int(os.getenv('MAILING_MESSAGE_CACHE_SIZE', 256))
+# Сколько получателей читать из БД за один запрос
+MAILING_RECIPIENTS_CHUNK_SIZE = int(os.getenv('MAILING_RECIPIENTS_CHUNK_SIZE', 2000))
+# Сколько адресов при импорте клиентов проверять на дубликаты в памяти, больше - во временной базе на диске
+MAILING_DEDUP_MEMORY_LIMIT = int(os.getenv('MAILING_DEDUP_MEMORY_LIMIT', 1000000))
+# Сколько клиентов сохранять за один запрос при импорте из CSV
+MAILING_IMPORT_BATCH_SIZE = int(os.getenv('MAILING_IMPORT_BATCH_SIZE', 2000))
+# Срок аренды пачки получателей воркером (секунды), после него пачку заберет другой воркер
+MAILING_LEASE_SECONDS = int(os.getenv('MAILING_LEASE_SECONDS', 300))
+
+# DKIM подпись писем: ключи по доменам отправителя
+# MAILING_DKIM_DOMAINS = {'example.com': {'selector': 'mail', 'key_file': '/path/to/key.pem'}},
+# для домена MAILING_DKIM_DOMAIN (по умолчанию домен DEFAULT_FROM_EMAIL) - MAILING_DKIM_SELECTOR
+# и MAILING_DKIM_KEY_FILE. MAILING_DKIM_WORKERS - процессов для RSA подписи (0 - в потоке отправки)
+MAILING_DKIM_DOMAIN = os.getenv('MAILING_DKIM_DOMAIN', '')
+MAILING_DKIM_SELECTOR = os.getenv('MAILING_DKIM_SELECTOR', 'mail')
+MAILING_DKIM_KEY_FILE = os.getenv('MAILING_DKIM_KEY_FILE', '')
+MAILING_DKIM_DOMAINS = {}
+MAILING_DKIM_WORKERS = int(os.getenv('MAILING_DKIM_WORKERS', 0))
+
+# Планировщик: канал Redis для уведомлений об изменении рассылок
+# и период полной сверки расписания с БД (секунды)
+MAILING_SCHEDULER_CHANNEL = 'mailing:schedule'
+MAILING_SCHEDULER_RESYNC_SECONDS = int(os.getenv('MAILING_SCHEDULER_RESYNC_SECONDS', 300))
+
+# Пакетная запись MailingLog: размер пачки и максимальная задержка сброса (секунды)
+MAILING_LOG_BATCH_SIZE = int(os.getenv('MAILING_LOG_BATCH_SIZE', 500))
+MAILING_LOG_FLUSH_INTERVAL = float(os.getenv('MAILING_LOG_FLUSH_INTERVAL', 2))
+
+# Метрики доставки: хеш Redis с суммой по процессам и период отправки в него (секунды).
+# Если задан METRICS_TOKEN, /metrics/ отдается по заголовку Authorization: Bearer <токен>,
+# иначе только сотрудникам
+MAILING_METRICS_KEY = 'mailing:metrics'
+MAILING_METRICS_PUSH_INTERVAL = float(os.getenv('MAILING_METRICS_PUSH_INTERVAL', 10))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Фоновые задачи (mailing.jobs): process - пул локальных процессов на MAILING_JOB_WORKERS,
+# redis - список Redis MAILING_JOB_QUEUE, его читает команда run_job_worker,
+# inline - в том же потоке, только для разработки и тестов (запрос ждет окончания задачи).
+# redis включается явно: без запущенного run_job_worker задачи из очереди никто не выполнит
+MAILING_JOB_BACKEND = os.getenv('MAILING_JOB_BACKEND', 'process')
+MAILING_JOB_WORKERS = int(os.getenv('MAILING_JOB_WORKERS', 2))
+MAILING_JOB_QUEUE = 'mailing:jobs'
+
+# Логи: в файл пишет фоновый поток (LOG_ASYNC), файл ротируется по размеру,
+# записи в JSON (LOG_FORMAT=json) или текстом (text). Поштучные записи о получателях
+# пишутся для доли MAILING_LOG_RECIPIENT_SAMPLE_RATE писем
+LOG_ASYNC = os.getenv('LOG_ASYNC', 'True') == 'True'
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 50 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 5))
+MAILING_LOG_RECIPIENT_SAMPLE_RATE = float(os.getenv('MAILING_LOG_RECIPIENT_SAMPLE_RATE', 0.001))
 
 LOGGING = {
     'version': 1,
@@ -146,13 +227,19 @@ LOGGING = {
             'format': '{levelname} {asctime} {module} {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'mailing.loghandlers.JSONFormatter',
+        },
     },
     'handlers': {
         'file': {
             'level': 'DEBUG',
-            'class': 'logging.FileHandler',
+            'class': 'mailing.loghandlers.QueueFileHandler' if LOG_ASYNC else 'logging.handlers.RotatingFileHandler',
             'filename': 'debug.log',
-            'formatter': 'verbose',
+            'maxBytes': LOG_MAX_BYTES,
+            'backupCount': LOG_BACKUP_COUNT,
+            'encoding': 'utf-8',
+            'formatter': 'json' if LOG_FORMAT == 'json' else 'verbose',
         },
         'console': {
             'level': 'INFO',
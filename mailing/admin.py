@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Client, Message, Mailing, MailingLog
+from .models import Client, Message, Mailing, MailingLog, MailingRecipient, MailingStatistics
 
 
 @admin.register(Client)
@@ -18,7 +18,7 @@ class MessageAdmin(admin.ModelAdmin):
 
 @admin.register(Mailing)
 class MailingAdmin(admin.ModelAdmin):
-    list_display = ('id', 'status', 'start_time', 'end_time', 'owner')
+    list_display = ('id', 'status', 'start_time', 'end_time', 'checkpoint', 'owner')
     list_filter = ('status', 'owner')
     filter_horizontal = ('clients',)
 
@@ -27,3 +27,23 @@ class MailingAdmin(admin.ModelAdmin):
 class MailingLogAdmin(admin.ModelAdmin):
     list_display = ('id', 'status', 'mailing')
     list_filter = ('status', 'mailing__owner')
+
+
+@admin.register(MailingRecipient)
+class MailingRecipientAdmin(admin.ModelAdmin):
+    list_display = ('mailing', 'client', 'status', 'attempt_time')
+    list_filter = ('status',)
+    raw_id_fields = ('mailing', 'client')
+
+
+@admin.register(MailingStatistics)
+class MailingStatisticsAdmin(admin.ModelAdmin):
+    list_display = (
+        'owner',
+        'created_mailings',
+        'started_mailings',
+        'completed_mailings',
+        'success_attempts',
+        'failure_attempts',
+    )
+    raw_id_fields = ('owner',)
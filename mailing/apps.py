@@ -3,3 +3,9 @@ from django.apps import AppConfig
 class MailingvConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "mailing"
+
+    def ready(self):
+        from mailing import metrics, signals  # noqa: F401
+        from mailing.throttle import add_send_observer
+
+        add_send_observer(metrics.observe_send)
@@ -0,0 +1,303 @@
+import asyncio
+import base64
+import logging
+import os
+import smtplib
+import ssl
+import threading
+import time
+from django.conf import settings
+from django.core.mail.message import sanitize_address
+from mailing import metrics
+from mailing.loghandlers import sampled
+from mailing.throttle import get_relay_controller, is_congestion, reply_code, reply_text
+
+logger = logging.getLogger(__name__)
+
+
+class SMTPResponseError(Exception):
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+        self.message = message
+
+
+def envelope_address(address):
+    """
+    Адрес для MAIL FROM и RCPT TO, как у SMTP бэкенда Django: sanitize_address
+    (отказ на переводах строк, домен в IDNA), затем из "Имя <адрес>"
+    остается только <адрес> (smtplib.quoteaddr). Неверный адрес - ValueError.
+    """
+    return smtplib.quoteaddr(sanitize_address(address, settings.DEFAULT_CHARSET))
+
+
+class AsyncSMTPSession:
+    """
+    Минимальный асинхронный SMTP клиент поверх asyncio streams.
+    Одна сессия отправляет письма по очереди; если сервер поддерживает
+    PIPELINING, команды MAIL/RCPT/DATA уходят одним пакетом.
+    """
+
+    def __init__(self, name, host=None, port=None, username=None, password=None,
+                 use_ssl=None, use_tls=None, timeout=None):
+        self.name = name
+        self.host = host or settings.EMAIL_HOST
+        self.port = int(port or settings.EMAIL_PORT)
+        self.username = settings.EMAIL_HOST_USER if username is None else username
+        self.password = settings.EMAIL_HOST_PASSWORD if password is None else password
+        self.use_ssl = settings.EMAIL_USE_SSL if use_ssl is None else use_ssl
+        self.use_tls = getattr(settings, 'EMAIL_USE_TLS', False) if use_tls is None else use_tls
+        self.timeout = timeout or getattr(settings, 'EMAIL_TIMEOUT', None) or 30
+        self.pipelining = False
+        self._reader = None
+        self._writer = None
+
+    @property
+    def connected(self):
+        return self._writer is not None
+
+    async def connect(self):
+        ssl_context = ssl.create_default_context() if self.use_ssl else None
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=ssl_context),
+            self.timeout
+        )
+        await self._expect(220)
+        await self._ehlo()
+        if self.use_tls:
+            await self._command(b'STARTTLS', 220)
+            await self._writer.start_tls(ssl.create_default_context())
+            await self._ehlo()
+        if self.username:
+            credentials = f"\0{self.username}\0{self.password}".encode()
+            await self._command(b'AUTH PLAIN ' + base64.b64encode(credentials), 235)
+
+    async def _ehlo(self):
+        code, text = await self._command(b'EHLO localhost', 250)
+        self.pipelining = 'PIPELINING' in text.upper()
+
+    async def _read_response(self):
+        lines = []
+        while True:
+            line = await asyncio.wait_for(self._reader.readline(), self.timeout)
+            if not line:
+                raise ConnectionError("SMTP сервер закрыл соединение")
+            lines.append(line[4:].decode(errors='replace').strip())
+            if line[3:4] != b'-':
+                return int(line[:3]), '\n'.join(lines)
+
+    async def _expect(self, expected):
+        code, text = await self._read_response()
+        if code != expected:
+            raise SMTPResponseError(code, text)
+        return code, text
+
+    async def _command(self, line, expected):
+        self._writer.write(line + b'\r\n')
+        await self._writer.drain()
+        return await self._expect(expected)
+
+    async def send(self, from_email, to_email, message_bytes):
+        """Отправляет одно письмо и возвращает ответ сервера на DATA"""
+        envelope = [
+            f"MAIL FROM:{envelope_address(from_email)}".encode(),
+            f"RCPT TO:{envelope_address(to_email)}".encode(),
+            b'DATA',
+        ]
+        if self.pipelining:
+            self._writer.write(b'\r\n'.join(envelope) + b'\r\n')
+            await self._writer.drain()
+            replies = [await self._read_response() for _ in envelope]
+        else:
+            replies = []
+            for line, expected in zip(envelope, (250, 250, 354)):
+                self._writer.write(line + b'\r\n')
+                await self._writer.drain()
+                replies.append(await self._read_response())
+                if replies[-1][0] != expected:
+                    break
+
+        failed = next(
+            (reply for reply, expected in zip(replies, (250, 250, 354)) if reply[0] != expected),
+            None
+        )
+        if failed is not None:
+            if replies[-1][0] == 354:
+                # Сервер ждет данные несмотря на ошибку - завершаем пустое письмо
+                self._writer.write(b'.\r\n')
+                await self._read_response()
+            await self._command(b'RSET', 250)
+            raise SMTPResponseError(*failed)
+
+        self._writer.write(_dot_stuff(message_bytes) + b'.\r\n')
+        await self._writer.drain()
+        code, text = await self._expect(250)
+        return f"{code} {text}"
+
+    async def close(self):
+        if self._writer is None:
+            return
+        try:
+            self._writer.write(b'QUIT\r\n')
+            await self._writer.drain()
+            self._writer.close()
+            await self._writer.wait_closed()
+        except (ConnectionError, OSError, asyncio.TimeoutError):
+            pass
+        finally:
+            self._reader = self._writer = None
+
+    def abort(self):
+        """Бросает соединение после сетевой ошибки, при следующей отправке оно откроется заново"""
+        if self._writer is not None:
+            self._writer.transport.abort()
+        self._reader = self._writer = None
+
+
+def _dot_stuff(message_bytes):
+    message_bytes = message_bytes.replace(b'\r\n.', b'\r\n..')
+    if message_bytes.startswith(b'.'):
+        message_bytes = b'.' + message_bytes
+    # Как smtplib: перевод строки перед точкой добавляется, только если его нет
+    if not message_bytes.endswith(b'\r\n'):
+        message_bytes += b'\r\n'
+    return message_bytes
+
+
+class AsyncDeliveryPool:
+    """
+    Пул асинхронных SMTP сессий в отдельном потоке с собственным event loop.
+    Число одновременно обрабатываемых писем ограничено семафором (окно),
+    сессии выдаются письмам из очереди и переиспользуются. Скорость и число
+    одновременных отправок дополнительно ограничивает контроллер SMTP сервера.
+    """
+
+    def __init__(self, sessions=None, concurrency=None):
+        self._relay = get_relay_controller()
+        self.sessions_count = min(sessions or settings.MAILING_ASYNC_SESSIONS, self._relay.max_connections)
+        self.concurrency = concurrency or settings.MAILING_ASYNC_CONCURRENCY
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='async-delivery', daemon=True)
+        self._sessions = []
+        self._idle = None
+        self._window = None
+
+    def __enter__(self):
+        self._thread.start()
+        self._run(self._setup())
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self._run(self._shutdown())
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _setup(self):
+        self._window = asyncio.Semaphore(self.concurrency)
+        self._idle = asyncio.Queue()
+        for number in range(self.sessions_count):
+            session = AsyncSMTPSession(f"{os.getpid()}/smtp-{number}")
+            self._sessions.append(session)
+            self._idle.put_nowait(session)
+
+    async def _shutdown(self):
+        await asyncio.gather(*(session.close() for session in self._sessions))
+
+    def submit(self, prepared, recipients):
+        """Отправляет пачку получателей, возвращает concurrent.futures.Future со списком результатов по сессиям"""
+        return asyncio.run_coroutine_threadsafe(self._send_chunk(prepared, recipients), self._loop)
+
+    async def _send_chunk(self, prepared, recipients):
+        message = prepared.personalize(recipients)
+        outcomes = await asyncio.gather(*(
+            self._send_one(message, client_id, email) for client_id, email, full_name in recipients
+        ))
+
+        # Целиком пишется первая ошибка пачки, остальные - итогом (исходы есть в MailingLog)
+        failures = [outcome for session_name, elapsed, outcome in outcomes if not outcome[2]]
+        if failures:
+            client_id, email, success, error_msg, code = failures[0]
+            logger.warning(error_msg, extra={'client_id': client_id})
+        if len(failures) > 1:
+            logger.warning(f"Ошибок отправки в пачке: {len(failures)}, в лог записана первая")
+
+        # Группируем исходы по сессиям, чтобы видеть производительность каждой
+        results = {}
+        for session_name, elapsed, outcome in outcomes:
+            result = results.setdefault(session_name, {
+                'worker': session_name,
+                'elapsed': 0.0,
+                'outcomes': [],
+            })
+            result['elapsed'] += elapsed
+            result['outcomes'].append(outcome)
+        return list(results.values())
+
+    async def _send_one(self, prepared, client_id, email):
+        async with self._window:
+            attempt = 0
+            while True:
+                await self._relay.acquire_async()
+                session = await self._idle.get()
+                started = time.monotonic()
+                error = None
+                connecting = not session.connected
+                try:
+                    if connecting:
+                        with metrics.smtp_connect():
+                            await session.connect()
+                    await session.send(prepared.from_email, email, prepared.render(email))
+                except Exception as e:
+                    error = e
+                    if not isinstance(e, SMTPResponseError) or e.code == 421:
+                        # Сетевая ошибка или 421: состояние сессии неизвестно, переподключимся
+                        session.abort()
+                finally:
+                    elapsed = time.monotonic() - started
+                    self._idle.put_nowait(session)
+                    self._relay.release(elapsed, error=error)
+
+                if error is None:
+                    if sampled():
+                        logger.debug(f"Письмо клиенту {email} отправлено", extra={'client_id': client_id})
+                    return session.name, elapsed, (client_id, email, True, "Успешно отправлено", 250)
+                if attempt < self._relay.retries and is_congestion(error):
+                    attempt += 1
+                    continue
+                if connecting:
+                    error_msg = f"Ошибка подключения к SMTP: {str(error)}"
+                else:
+                    error_msg = f"Ошибка отправки: {reply_text(error)}"
+                return session.name, elapsed, (client_id, email, False, error_msg, reply_code(error))
+
+
+def deliver_async(batches, handle, sessions=None, concurrency=None):
+    """
+    Асинхронная доставка: пачки (письмо, получатели) отправляются в пул сессий,
+    в работе держится не больше двух пачек (обратное давление на чтение из БД).
+    handle вызывается в текущем потоке для результата каждой сессии по пачке.
+    """
+    with AsyncDeliveryPool(sessions=sessions, concurrency=concurrency) as pool:
+        in_flight = []
+        try:
+            for prepared, chunk in batches:
+                in_flight.append(pool.submit(prepared, chunk))
+                if len(in_flight) >= 2:
+                    for result in in_flight.pop(0).result():
+                        handle(result)
+            while in_flight:
+                for result in in_flight.pop(0).result():
+                    handle(result)
+        except BaseException:
+            # Дожидаемся уже отправляемых пачек и учитываем их результаты
+            for future in in_flight:
+                if not future.cancelled() and not future.exception():
+                    for result in future.result():
+                        handle(result)
+            raise
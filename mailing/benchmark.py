@@ -0,0 +1,265 @@
+import array
+import logging
+import os
+import platform
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+import django
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import override_settings
+from django.utils import timezone
+from mailing import statistics
+from mailing.models import Client, Mailing, MailingLog, MailingRecipient, Message
+from mailing.querybudget import query_budget
+from mailing.recipients import sync_recipients
+from mailing.smtp_sink import SMTPSink
+from mailing.tasks import check_mailings, send_mailing
+from mailing.throttle import add_send_observer, remove_send_observer
+from users.models import User
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK_DOMAIN = 'benchmark.invalid'
+
+SEND_MAILING = 'send_mailing'
+CHECK_MAILINGS = 'check_mailings'
+ENTRY_POINTS = (SEND_MAILING, CHECK_MAILINGS)
+
+
+class BenchmarkData:
+    """
+    Синтетические данные замера: пользователь-владелец, сообщение и рассылки
+    """
+
+    def __init__(self, owner, message, mailings, recipients):
+        self.owner = owner
+        self.message = message
+        self.mailings = mailings
+        self.recipients = recipients
+
+    @property
+    def mailing_ids(self):
+        return [mailing.id for mailing in self.mailings]
+
+
+def seed(recipients, mailings=1, batch_size=5000):
+    """
+    Создает владельца с адресом в домене benchmark.invalid, сообщение,
+    recipients клиентов и mailings рассылок, между которыми клиенты делятся поровну.
+    Клиенты и связи с рассылками вставляются пачками через bulk_create.
+    Рассылки создаются в статусе "Создана", запускает их start().
+    """
+    token = uuid.uuid4().hex[:12]
+    owner = User.objects.create_user(f'benchmark-{token}@{BENCHMARK_DOMAIN}', is_active=False)
+    message = Message.objects.create(
+        owner=owner,
+        subject='Benchmark',
+        body='Синтетическое письмо для замера скорости доставки.\n' * 20
+    )
+    now = timezone.now()
+    created = [
+        Mailing.objects.create(
+            owner=owner,
+            message=message,
+            start_time=now - timedelta(minutes=1),
+            end_time=now + timedelta(days=1),
+        )
+        for _ in range(mailings)
+    ]
+
+    through = Mailing.clients.through
+    for first in range(0, recipients, batch_size):
+        numbers = range(first, min(first + batch_size, recipients))
+        with transaction.atomic():
+            clients = Client.objects.bulk_create([
+                Client(email=f'client-{token}-{number}@{BENCHMARK_DOMAIN}', full_name=f'Клиент {number}', owner=owner)
+                for number in numbers
+            ])
+            through.objects.bulk_create([
+                through(mailing_id=created[number % mailings].id, client_id=client.pk)
+                for number, client in zip(numbers, clients)
+            ])
+    logger.info(f"Замер: создано {recipients} клиентов и {mailings} рассылок владельца {owner}")
+    return BenchmarkData(owner, message, created, recipients)
+
+
+def start(data):
+    """
+    Запускает рассылки замера и заполняет их журналы получателей.
+    Статус меняется массово, без уведомления планировщика: рабочий
+    планировщик не должен подхватить синтетические рассылки.
+    """
+    statistics.update_mailing_status(Mailing.objects.filter(id__in=data.mailing_ids), Mailing.STARTED)
+    for mailing in data.mailings:
+        mailing.refresh_from_db()
+        sync_recipients(mailing)
+
+
+def reset(data):
+    """Возвращает рассылки замера в исходное состояние перед следующим прогоном"""
+    for mailing in data.mailings:
+        statistics.mailing_attempts_deleted(mailing)
+    MailingLog.objects.filter(mailing_id__in=data.mailing_ids).delete()
+    MailingRecipient.objects.filter(mailing_id__in=data.mailing_ids).delete()
+    Mailing.objects.filter(id__in=data.mailing_ids).update(checkpoint=0)
+
+
+def cleanup(data):
+    """
+    Удаляет данные замера. Клиентов удаляем одним запросом: через ORM
+    каждый удаленный клиент прислал бы сигнал и сбросил версию кеша.
+    """
+    for mailing in data.mailings:
+        mailing.clients.clear()
+        mailing.delete()
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {Client._meta.db_table} WHERE owner_id = %s', [data.owner.id])
+    data.owner.delete()
+    logger.info(f"Замер: данные владельца {data.owner} удалены")
+
+
+class LatencyRecorder:
+    """
+    Собирает задержки попыток отправки (секунды) через наблюдатель mailing.throttle.
+    Видит только отправки текущего процесса, в режиме process пуст.
+    """
+
+    def __init__(self):
+        self.values = array.array('d')
+
+    def __enter__(self):
+        add_send_observer(self._observe)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        remove_send_observer(self._observe)
+
+    def _observe(self, relay, latency, error):
+        self.values.append(latency)
+
+    def percentiles(self, *fractions):
+        """Процентили в миллисекундах (по ближайшему рангу), None без замеров"""
+        if not self.values:
+            return {fraction: None for fraction in fractions}
+        values = sorted(self.values)
+        return {
+            fraction: round(values[min(len(values) - 1, int(fraction * len(values)))] * 1000, 3)
+            for fraction in fractions
+        }
+
+
+def peak_rss_mb(who='self'):
+    """
+    Пиковый RSS процесса (или завершившихся дочерних процессов) в мегабайтах
+    с начала работы, None если платформа его не сообщает
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+    # Linux сообщает килобайты, macOS - байты
+    divisor = 1024 * 1024 if platform.system() == 'Darwin' else 1024
+    return round(usage.ru_maxrss / divisor, 1)
+
+
+@contextmanager
+def sink_settings(sink, mode, workers):
+    """
+    Направляет отправку в SMTPSink. Дочерние процессы режима process
+    читают настройки заново, поэтому адрес сервера передается и через окружение.
+    """
+    environment = {
+        'EMAIL_HOST': sink.host,
+        'EMAIL_PORT': str(sink.port),
+        'EMAIL_HOST_USER': '',
+        'EMAIL_HOST_PASSWORD': '',
+        'EMAIL_USE_SSL': 'False',
+    }
+    saved = {name: os.environ.get(name) for name in environment}
+    os.environ.update(environment)
+    try:
+        with override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST=sink.host,
+            EMAIL_PORT=sink.port,
+            EMAIL_HOST_USER='',
+            EMAIL_HOST_PASSWORD='',
+            EMAIL_USE_SSL=False,
+            EMAIL_USE_TLS=False,
+            MAILING_DELIVERY_MODE=mode,
+            MAILING_DELIVERY_WORKERS=workers,
+        ):
+            yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def run(data, mode, workers, entry=SEND_MAILING, smtp_latency=0.0):
+    """
+    Один прогон доставки рассылок замера через локальный SMTPSink.
+    entry выбирает точку входа: send_mailing для каждой рассылки
+    или check_mailings, как это делает планировщик.
+    Возвращает словарь с результатами прогона.
+    """
+    start(data)
+    with SMTPSink(latency=smtp_latency) as sink, sink_settings(sink, mode, workers):
+        with LatencyRecorder() as latencies, query_budget(None) as queries:
+            started = time.monotonic()
+            if entry == CHECK_MAILINGS:
+                check_mailings()
+            else:
+                for mailing_id in data.mailing_ids:
+                    send_mailing(mailing_id)
+            elapsed = time.monotonic() - started
+
+    counts = dict(
+        MailingRecipient.objects.filter(mailing_id__in=data.mailing_ids)
+        .values_list('status')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+    emails = counts.get(MailingRecipient.SENT, 0) + counts.get(MailingRecipient.FAILED, 0)
+    p50, p99 = latencies.percentiles(0.5, 0.99).values()
+    return {
+        'entry': entry,
+        'mode': mode,
+        'workers': workers,
+        'smtp_latency': smtp_latency,
+        'emails': emails,
+        'sent': counts.get(MailingRecipient.SENT, 0),
+        'failed': counts.get(MailingRecipient.FAILED, 0),
+        'pending': counts.get(MailingRecipient.PENDING, 0),
+        'accepted_by_sink': sink.messages,
+        'smtp_connections': sink.connections,
+        'seconds': round(elapsed, 3),
+        'emails_per_second': round(emails / elapsed, 1) if elapsed else None,
+        'latency_p50_ms': p50,
+        'latency_p99_ms': p99,
+        'latency_samples': len(latencies.values),
+        'db_queries': len(queries.queries),
+        'db_queries_per_email': round(len(queries.queries) / emails, 4) if emails else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_children_rss_mb': peak_rss_mb('children'),
+    }
+
+
+def environment():
+    """Описание окружения для сравнения результатов между релизами"""
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
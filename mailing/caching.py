@@ -0,0 +1,131 @@
+import logging
+import math
+import random
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+
+def get_or_compute(key, compute, timeout=None, beta=1.0, lock_timeout=10):
+    """
+    Возвращает значение из кеша, при промахе вычисляет его через compute().
+
+    - Значение хранится вместе со временем вычисления и сроком годности,
+      поэтому 0, пустой список и None кешируются как обычные значения.
+    - Незадолго до истечения срока значение пересчитывается заранее с
+      вероятностью, растущей к концу срока (XFetch, beta задает охотность).
+    - Пересчитывает один запрос (блокировка через cache.add), остальные
+      отдают прежнее значение, а при пустом кеше ждут его до lock_timeout секунд.
+    - Если кеш недоступен, значение просто вычисляется.
+    """
+    timeout = settings.CACHE_TTL if timeout is None else timeout
+
+    entry = _get(key)
+    if entry is not None:
+        value, delta, expires_at = entry
+        # 1 - random() лежит в (0, 1], логарифм определен
+        if time.time() - delta * beta * math.log(1 - random.random()) < expires_at:
+            return value
+        if not _lock(key, lock_timeout):
+            # Пересчетом уже занят другой запрос
+            return value
+        return _compute(key, compute, timeout, lock_timeout)
+
+    if _lock(key, lock_timeout):
+        return _compute(key, compute, timeout, lock_timeout)
+
+    deadline = time.monotonic() + lock_timeout
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        entry = _get(key)
+        if entry is not None:
+            return entry[0]
+    logger.warning(f"Не дождались значения кеша {key}, вычисляем сами")
+    return _compute(key, compute, timeout, lock_timeout, locked=False)
+
+
+def owner_key(name, owner_id):
+    """
+    Ключ данных владельца: в него входит версия владельца, поэтому после
+    изменения его рассылок, клиентов или сообщений ключ меняется сам
+    """
+    return f'{name}:owner:{owner_id}:v{get_version(f"owner:{owner_id}")}'
+
+
+def global_key(name):
+    """Ключ данных по всем владельцам, меняется при любом изменении"""
+    return f'{name}:all:v{get_version("all")}'
+
+
+def get_version(scope):
+    key = f'cache_version:{scope}'
+    try:
+        version = cache.get(key)
+        if version is None:
+            # Начальная версия от текущего времени: если ключ вытеснят,
+            # новая версия не совпадет с версиями старых записей
+            cache.add(key, time.time_ns(), None)
+            version = cache.get(key)
+        return version
+    except Exception as e:
+        logger.warning(f"Кеш недоступен, версия {scope}: {str(e)}")
+        return 0
+
+
+def bump_owner_versions(*owner_ids):
+    """
+    Устаревает кеш владельцев и общий кеш после коммита транзакции:
+    до коммита читатель мог бы закешировать старые данные под новой версией
+    """
+    scopes = [f'owner:{owner_id}' for owner_id in set(owner_ids)] + ['all']
+    transaction.on_commit(lambda: _bump(scopes))
+
+
+def _bump(scopes):
+    for scope in scopes:
+        key = f'cache_version:{scope}'
+        try:
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, time.time_ns(), None)
+        except Exception as e:
+            logger.warning(f"Не удалось обновить версию кеша {scope}: {str(e)}")
+
+
+def _compute(key, compute, timeout, lock_timeout, locked=True):
+    try:
+        started = time.monotonic()
+        value = compute()
+        delta = time.monotonic() - started
+        try:
+            # Запись живет дольше срока годности, чтобы на время пересчета было что отдать
+            cache.set(key, (value, delta, time.time() + timeout), timeout + lock_timeout)
+        except Exception as e:
+            logger.warning(f"Не удалось записать ключ кеша {key}: {str(e)}")
+        return value
+    finally:
+        if locked:
+            try:
+                cache.delete(f'{key}:lock')
+            except Exception:
+                pass
+
+
+def _get(key):
+    try:
+        return cache.get(key)
+    except Exception as e:
+        logger.warning(f"Кеш недоступен, ключ {key}: {str(e)}")
+        return None
+
+
+def _lock(key, lock_timeout):
+    try:
+        return cache.add(f'{key}:lock', 1, lock_timeout)
+    except Exception:
+        # Без кеша блокировку не взять - считаем сами
+        return True
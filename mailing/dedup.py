@@ -0,0 +1,150 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from mailing.models import MailingRecipient
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_email(email):
+    """
+    Адрес в виде для сравнения: без пробелов по краям и без учета регистра
+    """
+    return email.strip().lower()
+
+
+def email_key(email):
+    """
+    Ключ адреса для сравнения: 8 байт blake2b нормализованного адреса вместо
+    самой строки - в разы меньше памяти, коллизии на миллионах адресов
+    практически исключены. Хранится в MailingRecipient.email_key.
+    """
+    return int.from_bytes(
+        hashlib.blake2b(normalize_email(email).encode(), digest_size=8).digest(),
+        'big',
+        signed=True
+    )
+
+
+class RecipientDeduplicator:
+    """
+    Множество уже встреченных адресов. Пока адресов меньше memory_limit,
+    хранит хеши в памяти; дальше переносит их во временную SQLite базу
+    на диске, где проверка идет по индексу первичного ключа.
+    """
+
+    def __init__(self, memory_limit=None):
+        self.memory_limit = memory_limit or settings.MAILING_DEDUP_MEMORY_LIMIT
+        self.skipped = 0
+        self._seen = set()
+        self._db = None
+        self._path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        if self._db is not None:
+            return self._db.execute('SELECT COUNT(*) FROM seen').fetchone()[0]
+        return len(self._seen)
+
+    def add(self, email):
+        """Запоминает адрес, возвращает False если он уже встречался"""
+        digest = email_key(email)
+        if self._db is not None:
+            return self._db.execute('INSERT OR IGNORE INTO seen VALUES (?)', (digest,)).rowcount == 1
+        if digest in self._seen:
+            return False
+        self._seen.add(digest)
+        if len(self._seen) > self.memory_limit:
+            self._spill()
+        return True
+
+    def _spill(self):
+        fd, self._path = tempfile.mkstemp(prefix='mailing-dedup-', suffix='.sqlite3')
+        os.close(fd)
+        self._db = sqlite3.connect(self._path, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=OFF')
+        self._db.execute('PRAGMA synchronous=OFF')
+        self._db.execute('CREATE TABLE seen (digest INTEGER PRIMARY KEY)')
+        self._db.execute('BEGIN')
+        self._db.executemany('INSERT INTO seen VALUES (?)', ((digest,) for digest in self._seen))
+        self._db.execute('COMMIT')
+        logger.info(f"Адресов больше {self.memory_limit}, проверка дубликатов перенесена на диск")
+        self._seen = set()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+            os.unlink(self._path)
+        self._seen = set()
+
+
+class LedgerDeduplicator:
+    """
+    Пропуск дубликатов адресов по журналу получателей. Адрес получает письмо
+    только через запись с наименьшим client_id среди записей рассылки с тем же
+    email_key и только если рассылка не доставлена ему через другую запись
+    (в прошлом запуске). Решение зависит лишь от журнала, а не от того, какие
+    адреса встретились в этом процессе, поэтому воркеры с разными пачками
+    аренды не отправят одному адресу два письма.
+    """
+
+    def __init__(self, mailing, batch_size=None):
+        self.mailing = mailing
+        self.batch_size = batch_size or settings.MAILING_RECIPIENTS_CHUNK_SIZE
+        self.skipped = 0
+
+    def filter(self, recipients):
+        """
+        Отдает получателей (id клиента, email, ФИО) без дубликатов, проверяя
+        их пачками по batch_size. Дубликаты помечаются в журнале как пропущенные.
+        """
+        batch = []
+        for recipient in recipients:
+            batch.append(recipient)
+            if len(batch) >= self.batch_size:
+                yield from self._filter_batch(batch)
+                batch = []
+        if batch:
+            yield from self._filter_batch(batch)
+
+    def _filter_batch(self, batch):
+        duplicates = self.duplicates([client_id for client_id, email, full_name in batch])
+        if duplicates:
+            _mark_skipped(self.mailing, list(duplicates))
+            self.skipped += len(duplicates)
+        for recipient in batch:
+            if recipient[0] not in duplicates:
+                yield recipient
+
+    def duplicates(self, client_ids):
+        """Клиенты из client_ids, чей адрес достается другой записи журнала"""
+        earlier = MailingRecipient.objects.filter(
+            Q(client_id__lt=OuterRef('client_id')) | Q(status=MailingRecipient.SENT),
+            mailing_id=self.mailing.id,
+            email_key=OuterRef('email_key')
+        )
+        return set(
+            MailingRecipient.objects.filter(mailing=self.mailing, client_id__in=client_ids)
+            .filter(Exists(earlier))
+            .values_list('client_id', flat=True)
+        )
+
+
+def _mark_skipped(mailing, client_ids):
+    MailingRecipient.objects.filter(
+        mailing=mailing,
+        client_id__in=client_ids,
+        status=MailingRecipient.PENDING
+    ).update(status=MailingRecipient.SKIPPED, attempt_time=timezone.now(), leased_by='', lease_expires_at=None)
+    logger.debug(f"Рассылка ID {mailing.id}: пропущено дубликатов адресов: {len(client_ids)}")
@@ -0,0 +1,310 @@
+import logging
+import multiprocessing
+import os
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+import django
+from django.conf import settings
+from django.core.mail import get_connection
+from mailing import metrics
+from mailing.dkim import SigningPool
+from mailing.loghandlers import sampled
+from mailing.throttle import get_relay_controller, is_congestion, reply_code, reply_text
+
+logger = logging.getLogger(__name__)
+
+SEQUENTIAL = 'sequential'
+THREAD = 'thread'
+PROCESS = 'process'
+ASYNC = 'async'
+
+DELIVERY_MODES = (SEQUENTIAL, THREAD, PROCESS, ASYNC)
+
+
+class WorkerStats:
+    """
+    Счетчики одного воркера доставки
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.sent = 0
+        self.failed = 0
+        self.busy_time = 0.0
+
+    @property
+    def total(self):
+        return self.sent + self.failed
+
+    @property
+    def rate(self):
+        """Писем в секунду за время работы воркера"""
+        if not self.busy_time:
+            return 0.0
+        return self.total / self.busy_time
+
+    def __str__(self):
+        return (
+            f"{self.name}: {self.total} писем за {self.busy_time:.2f} с "
+            f"({self.rate:.1f} писем/с, ошибок: {self.failed})"
+        )
+
+
+class DeliveryReport:
+    """
+    Итог доставки рассылки: общие счетчики и статистика по воркерам
+    """
+
+    def __init__(self, mode, workers):
+        self.mode = mode
+        self.workers_count = workers
+        self.success_count = 0
+        self.failure_count = 0
+        self.duplicates = 0
+        self.workers = {}
+        self.started_at = time.monotonic()
+        self.elapsed = 0.0
+
+    @property
+    def total(self):
+        return self.success_count + self.failure_count
+
+    @property
+    def rate(self):
+        if not self.elapsed:
+            return 0.0
+        return self.total / self.elapsed
+
+    def add_chunk(self, result):
+        stats = self.workers.get(result['worker'])
+        if stats is None:
+            stats = self.workers[result['worker']] = WorkerStats(result['worker'])
+        stats.busy_time += result['elapsed']
+        sent = sum(1 for client_id, email, success, response, code in result['outcomes'] if success)
+        failed = len(result['outcomes']) - sent
+        stats.sent += sent
+        stats.failed += failed
+        self.success_count += sent
+        self.failure_count += failed
+        metrics.RECIPIENTS.inc(sent, status='sent')
+        metrics.RECIPIENTS.inc(failed, status='failed')
+        metrics.push()
+
+    def finish(self):
+        self.elapsed = time.monotonic() - self.started_at
+
+    def log(self, mailing_id):
+        logger.info(
+            f"Рассылка ID {mailing_id}: режим {self.mode}, воркеров {self.workers_count}, "
+            f"{self.total} писем за {self.elapsed:.2f} с ({self.rate:.1f} писем/с)"
+        )
+        if self.duplicates:
+            logger.info(f"Рассылка ID {mailing_id}: пропущено дубликатов адресов: {self.duplicates}")
+        for stats in self.workers.values():
+            logger.info(f"Рассылка ID {mailing_id}: воркер {stats}")
+
+
+def _worker_name():
+    return f"{os.getpid()}/{threading.current_thread().name}"
+
+
+def send_chunk(prepared, recipients, connection=None, outcomes=None, share=1):
+    """
+    Отправляет заранее собранное письмо (mailing.rendering.PreparedMessage)
+    пачке получателей (id клиента, email, ФИО) через одно SMTP соединение,
+    письмо с полями клиента отрисовывается для всей пачки сразу.
+    Если соединение не передано, воркер открывает собственное.
+    Скорость и параллельность ограничивает контроллер SMTP сервера (mailing.throttle),
+    share - на сколько процессов делится лимит скорости.
+    Возвращает словарь с именем воркера, временем работы и исходами в виде
+    списка (id клиента, email, успех, ответ сервера, код SMTP). Исходы дописываются
+    в переданный список outcomes, чтобы при прерывании они не потерялись.
+    """
+    started = time.monotonic()
+    outcomes = [] if outcomes is None else outcomes
+    own_connection = connection is None
+    relay = get_relay_controller(share=share)
+
+    try:
+        if own_connection:
+            connection = get_connection()
+            with metrics.smtp_connect():
+                connection.open()
+    except Exception as e:
+        error_msg = f"Ошибка подключения к SMTP: {str(e)}"
+        logger.warning(error_msg)
+        outcomes.extend((client_id, email, False, error_msg, reply_code(e)) for client_id, email, full_name in recipients)
+    else:
+        failures = 0
+        message = prepared.personalize(recipients)
+        try:
+            for client_id, email, full_name in recipients:
+                try:
+                    _send_throttled(relay, connection, message.email_for(email))
+                    outcomes.append((client_id, email, True, "Успешно отправлено", 250))
+                    if sampled():
+                        logger.debug(f"Письмо клиенту {email} отправлено", extra={'client_id': client_id})
+                except Exception as e:
+                    error_msg = f"Ошибка отправки: {reply_text(e)}"
+                    failures += 1
+                    # Целиком пишется первая ошибка пачки, остальные - итогом (исходы есть в MailingLog)
+                    if failures == 1:
+                        logger.warning(f"Ошибка отправки для {email}: {str(e)}", extra={'client_id': client_id})
+                    outcomes.append((client_id, email, False, error_msg, reply_code(e)))
+        finally:
+            if own_connection:
+                connection.close()
+            if failures > 1:
+                logger.warning(f"Ошибок отправки в пачке: {failures}, в лог записана первая")
+    metrics.push_from_worker()
+
+    return {
+        'worker': _worker_name(),
+        'elapsed': time.monotonic() - started,
+        'outcomes': outcomes,
+    }
+
+
+def _send_throttled(relay, connection, message):
+    """
+    Отправка с учетом ограничений сервера. Временные ошибки (4xx, обрыв)
+    повторяются до relay.retries раз, после обрыва соединение открывается заново.
+    """
+    attempt = 0
+    while True:
+        relay.acquire()
+        started = time.monotonic()
+        try:
+            connection.send_messages([message])
+        except Exception as e:
+            relay.release(time.monotonic() - started, error=e)
+            if attempt >= relay.retries or not is_congestion(e):
+                raise
+            attempt += 1
+            disconnected = isinstance(e, (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError))
+            if disconnected or getattr(e, 'smtp_code', None) == 421:
+                connection.close()
+                with metrics.smtp_connect():
+                    connection.open()
+        else:
+            relay.release(time.monotonic() - started)
+            return
+
+
+def _chunked(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def deliver(prepared, recipients, mode=None, workers=None, chunk_size=None, connection=None, on_result=None):
+    """
+    Доставляет собранное письмо получателям (id клиента, email, ФИО) в выбранном режиме:
+    sequential - по очереди через одно соединение,
+    thread/process - пачками в пуле потоков/процессов, у каждой пачки свое SMTP соединение,
+    async - в одном потоке через несколько асинхронных SMTP сессий (см. mailing.async_delivery),
+    workers задает число сессий.
+    Письма с DKIM подписью при MAILING_DKIM_WORKERS > 0 подписываются пачками в пуле процессов.
+    recipients может быть генератором - он читается по мере отправки.
+    on_result вызывается в текущем потоке для каждой обработанной пачки.
+    """
+    mode = mode or settings.MAILING_DELIVERY_MODE
+    workers = workers or settings.MAILING_DELIVERY_WORKERS
+    chunk_size = chunk_size or settings.MAILING_DELIVERY_CHUNK_SIZE
+
+    if mode not in DELIVERY_MODES:
+        raise ValueError(f"Неизвестный режим доставки: {mode}")
+
+    if mode == SEQUENTIAL:
+        workers = 1
+    else:
+        # Не открываем к серверу больше соединений, чем он допускает
+        workers = min(workers, get_relay_controller().max_connections)
+
+    report = DeliveryReport(mode, workers)
+
+    def handle(result):
+        report.add_chunk(result)
+        if on_result is not None:
+            on_result(result)
+
+    # В режиме process письма подписывают DKIM сами дочерние процессы, в остальных
+    # RSA подписи можно вынести в пул процессов (MAILING_DKIM_WORKERS), чтобы не упираться в одно ядро
+    chunks = _chunked(recipients, chunk_size)
+    signing_pool = None
+    if mode != PROCESS and prepared.signer is not None and settings.MAILING_DKIM_WORKERS:
+        signing_pool = SigningPool()
+        batches = signing_pool.signed_chunks(prepared, chunks)
+    else:
+        batches = ((prepared, chunk) for chunk in chunks)
+
+    try:
+        if mode == SEQUENTIAL:
+            for message, chunk in batches:
+                outcomes = []
+                try:
+                    result = send_chunk(message, chunk, connection=connection, outcomes=outcomes)
+                except BaseException:
+                    # Учитываем уже отправленные письма пачки перед выходом
+                    handle({'worker': _worker_name(), 'elapsed': 0.0, 'outcomes': outcomes})
+                    raise
+                handle(result)
+        elif mode == ASYNC:
+            from mailing.async_delivery import deliver_async
+
+            deliver_async(batches, handle, sessions=workers)
+        else:
+            _deliver_pool(batches, handle, mode, workers)
+    finally:
+        if signing_pool is not None:
+            signing_pool.shutdown()
+
+    report.finish()
+    return report
+
+
+def _deliver_pool(batches, handle, mode, workers):
+    """Отправка пачек (письмо, получатели) в пуле потоков или процессов"""
+    if mode == PROCESS:
+        # spawn вместо fork: дочерние процессы не наследуют соединения с БД и SMTP
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup
+        )
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+
+    # Каждый процесс держит свой контроллер, лимит скорости делим между ними
+    share = workers if mode == PROCESS else 1
+
+    # В работе держим ограниченное число пачек, чтобы не читать всех получателей в память
+    in_flight = set()
+    with executor:
+        try:
+            while True:
+                while len(in_flight) < workers * 2:
+                    batch = next(batches, None)
+                    if batch is None:
+                        break
+                    message, chunk = batch
+                    in_flight.add(executor.submit(send_chunk, message, chunk, share=share))
+                if not in_flight:
+                    break
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    handle(future.result())
+        except BaseException:
+            # Дожидаемся уже начатых пачек и учитываем отправленные письма
+            executor.shutdown(wait=True, cancel_futures=True)
+            for future in in_flight:
+                if not future.cancelled() and not future.exception():
+                    handle(future.result())
+            raise
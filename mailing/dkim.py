@@ -0,0 +1,290 @@
+import base64
+import hashlib
+import logging
+import multiprocessing
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from email.utils import parseaddr
+import django
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa, utils
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Подписываемые заголовки в порядке h=, если они есть в письме
+SIGNED_HEADERS = (
+    'from', 'to', 'subject', 'date', 'message-id',
+    'mime-version', 'content-type', 'content-transfer-encoding',
+)
+
+_WSP = re.compile(rb'[ \t]+')
+
+_keys = {}
+_keys_lock = threading.Lock()
+
+
+class RSAPrivateKey:
+    """Закрытый RSA ключ домена: подпись RSASSA-PKCS1-v1_5 (SHA-256) считает OpenSSL"""
+
+    def __init__(self, key):
+        self.key = key
+        self.size = (key.key_size + 7) // 8
+
+    @classmethod
+    def from_pem(cls, data):
+        """Ключ в PEM без пароля: PKCS#1 (BEGIN RSA PRIVATE KEY) или PKCS#8 (BEGIN PRIVATE KEY)"""
+        if isinstance(data, str):
+            data = data.encode()
+        key = serialization.load_pem_private_key(data, password=None)
+        if not isinstance(key, rsa.RSAPrivateKey):
+            raise ValueError("Ключ DKIM должен быть RSA")
+        return cls(key)
+
+    def sign(self, digest):
+        """Подпись SHA-256 хеша в байтах длиной с модуль ключа"""
+        return self.key.sign(digest, padding.PKCS1v15(), utils.Prehashed(hashes.SHA256()))
+
+
+def domain_config(domain):
+    """
+    Селектор и файл ключа для домена отправителя: из MAILING_DKIM_DOMAINS,
+    для домена MAILING_DKIM_DOMAIN (по умолчанию домен DEFAULT_FROM_EMAIL) -
+    из MAILING_DKIM_SELECTOR и MAILING_DKIM_KEY_FILE. None, если домен не подписывается.
+    """
+    domain = domain.lower()
+    config = {name.lower(): value for name, value in settings.MAILING_DKIM_DOMAINS.items()}.get(domain)
+    if config is not None:
+        return config
+    default_domain = settings.MAILING_DKIM_DOMAIN or sender_domain(settings.DEFAULT_FROM_EMAIL or '')
+    if settings.MAILING_DKIM_KEY_FILE and domain == default_domain.lower():
+        return {'selector': settings.MAILING_DKIM_SELECTOR, 'key_file': settings.MAILING_DKIM_KEY_FILE}
+    return None
+
+
+def sender_domain(from_email):
+    return parseaddr(from_email)[1].rpartition('@')[2].lower()
+
+
+def get_key(domain, key_file):
+    """
+    Разобранный ключ домена из кеша процесса. Файл читается один раз:
+    после замены ключа процессы отправки нужно перезапустить.
+    """
+    cache_key = (domain, key_file)
+    key = _keys.get(cache_key)
+    if key is None:
+        with _keys_lock:
+            key = _keys.get(cache_key)
+            if key is None:
+                with open(key_file, 'rb') as f:
+                    key = RSAPrivateKey.from_pem(f.read())
+                _keys[cache_key] = key
+                logger.info(f"Загружен ключ DKIM домена {domain} ({key.size * 8} бит)")
+    return key
+
+
+def canonicalize_header(name, value):
+    """Каноникализация заголовка relaxed (RFC 6376, 3.4.2)"""
+    value = _WSP.sub(b' ', value.replace(b'\r\n', b'')).strip(b' ')
+    return name.strip().lower() + b':' + value + b'\r\n'
+
+
+def canonicalize_body(body):
+    """Каноникализация тела relaxed (RFC 6376, 3.4.4)"""
+    lines = [_WSP.sub(b' ', line).rstrip(b' ') for line in body.split(b'\r\n')]
+    while lines and not lines[-1]:
+        lines.pop()
+    return b''.join(line + b'\r\n' for line in lines)
+
+
+def body_hash(body):
+    """Значение bh= для тела письма в байтах"""
+    return base64.b64encode(hashlib.sha256(canonicalize_body(body)).digest()).decode()
+
+
+def parse_headers(data):
+    """Заголовки из байтов с CRLF списком (имя, значение) с сохранением переносов строк"""
+    headers = []
+    for line in data.split(b'\r\n'):
+        if not line:
+            continue
+        if line[:1] in (b' ', b'\t') and headers:
+            name, value = headers[-1]
+            headers[-1] = (name, value + b'\r\n' + line)
+        else:
+            name, sep, value = line.partition(b':')
+            headers.append((name, value))
+    return headers
+
+
+class MessageSigner:
+    """
+    DKIM подпись собранного письма одного отправителя. Хеш тела и
+    каноническая форма неизменных заголовков считаются один раз при создании,
+    для каждого получателя хешируются только To, Date и Message-ID
+    (и тема с текстом, если в них есть поля клиента) и считается
+    RSA подпись (sign) - ее можно вынести в пул процессов (SigningPool).
+    Ключ при передаче в другой процесс не копируется, а берется из его кеша.
+    """
+
+    def __init__(self, domain, selector, key_file, static_headers, body):
+        self.domain = domain
+        self.selector = selector
+        self.key_file = key_file
+        self.body_hash = body_hash(body)
+        self.static = {}
+        for name, value in parse_headers(static_headers):
+            # Подписывается последний экземпляр заголовка, у нас каждый встречается один раз
+            self.static[name.strip().lower().decode()] = canonicalize_header(name, value)
+        # Проверяем ключ сразу, чтобы ошибка настройки не всплыла на первом письме
+        get_key(domain, key_file)
+
+    @classmethod
+    def for_message(cls, from_email, static_headers, body):
+        """Подписывающий для письма или None, если DKIM для домена отправителя не настроен"""
+        domain = sender_domain(from_email)
+        config = domain_config(domain) if domain else None
+        if config is None:
+            return None
+        return cls(domain, config['selector'], config['key_file'], static_headers, body)
+
+    def prepare(self, headers, hashed_body=None):
+        """
+        Хеш для подписи письма с заголовками получателя headers (байты с CRLF),
+        они заменяют одноименные неизменные. hashed_body - bh= персонального тела.
+        Возвращает (заголовок DKIM-Signature без значения b=, SHA-256 хеш).
+        """
+        canonical = dict(self.static)
+        for name, value in parse_headers(headers):
+            canonical[name.strip().lower().decode()] = canonicalize_header(name, value)
+        names = [name for name in SIGNED_HEADERS if name in canonical]
+        signature = (
+            f"DKIM-Signature: v=1; a=rsa-sha256; c=relaxed/relaxed; d={self.domain};\r\n"
+            f" s={self.selector}; t={int(time.time())};\r\n"
+            f" h={':'.join(names)};\r\n"
+            f" bh={hashed_body or self.body_hash};\r\n"
+            f" b="
+        ).encode()
+        name, value = parse_headers(signature)[0]
+        data = b''.join(canonical[name] for name in names) + canonicalize_header(name, value)[:-2]
+        return signature, hashlib.sha256(data).digest()
+
+    def sign(self, digest):
+        return get_key(self.domain, self.key_file).sign(digest)
+
+    @staticmethod
+    def header(signature, value):
+        """Готовый заголовок DKIM-Signature с подписью value"""
+        return signature + base64.b64encode(value) + b'\r\n'
+
+    def signature_header(self, headers, hashed_body=None):
+        """Заголовок DKIM-Signature для письма с заголовками получателя headers, подпись в текущем потоке"""
+        signature, digest = self.prepare(headers, hashed_body)
+        return self.header(signature, self.sign(digest))
+
+
+def _sign_digests(domain, key_file, digests):
+    key = get_key(domain, key_file)
+    return [key.sign(digest) for digest in digests]
+
+
+class SignedMessage:
+    """
+    Письмо пачки получателей с заранее посчитанными подписями: отдает
+    бэкендам те же байты, что PreparedMessage, но без RSA в потоке отправки.
+    Получателей вне пачки подписывает обычным образом.
+    """
+
+    def __init__(self, prepared, rendered):
+        self.prepared = prepared
+        self.rendered = rendered
+        self.subject = prepared.subject
+        self.body = prepared.body
+        self.from_email = prepared.from_email
+
+    def render(self, email):
+        data = self.rendered.get(email)
+        if data is None:
+            return self.prepared.render(email)
+        return data
+
+    def personalize(self, recipients):
+        return self
+
+    def email_for(self, email):
+        from mailing.rendering import PreparedEmail
+
+        return PreparedEmail(self, email)
+
+
+class _PendingBatch:
+    def __init__(self, prepared, parts, future):
+        self.prepared = prepared
+        self.parts = parts
+        self.future = future
+
+    def result(self):
+        rendered = {}
+        for (email, headers, signature), value in zip(self.parts, self.future.result()):
+            rendered[email] = MessageSigner.header(signature, value) + headers
+        return SignedMessage(self.prepared, rendered)
+
+
+class SigningPool:
+    """
+    Пул процессов для RSA подписей (MAILING_DKIM_WORKERS). Заголовки
+    и хеши пачки собираются в вызывающем потоке, в процессы уходят
+    только 32-байтные хеши, обратно - подписи. Процессы запускаются через spawn.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or settings.MAILING_DKIM_WORKERS
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def submit(self, prepared, recipients):
+        """Начинает подпись письма для пачки получателей; result() вернет SignedMessage"""
+        signer = prepared.signer
+        message = prepared.personalize(recipients)
+        parts = []
+        digests = []
+        for client_id, email, full_name in recipients:
+            tail, signed, hashed_body = message.part(email)
+            headers = prepared.recipient_headers(email)
+            signature, digest = signer.prepare(headers + signed, hashed_body)
+            parts.append((email, headers + tail, signature))
+            digests.append(digest)
+        future = self._executor.submit(_sign_digests, signer.domain, signer.key_file, digests)
+        return _PendingBatch(prepared, parts, future)
+
+    def signed_chunks(self, prepared, chunks):
+        """
+        Пары (письмо, пачка получателей): пока отправляется одна пачка,
+        следующие подписываются в пуле. В работе держится не больше
+        двух пачек на процесс, чтобы не читать всех получателей в память.
+        """
+        pending = deque()
+        for chunk in chunks:
+            pending.append((self.submit(prepared, chunk), chunk))
+            if len(pending) > self.workers * 2:
+                batch, chunk = pending.popleft()
+                yield batch.result(), chunk
+        while pending:
+            batch, chunk = pending.popleft()
+            yield batch.result(), chunk
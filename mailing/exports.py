@@ -0,0 +1,60 @@
+import csv
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from mailing.models import Client, MailingLog
+
+
+class _Echo:
+    """Псевдофайл для csv.writer: возвращает строку вместо записи"""
+
+    def write(self, value):
+        return value
+
+
+# Начало ячейки, с которого Excel и LibreOffice читают формулу
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def escape_cell(value):
+    """
+    Защита от CSV-инъекции: строку, похожую на формулу (ФИО или комментарий
+    клиента вроде "=HYPERLINK(...)"), таблица покажет как текст
+    """
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def stream_csv(header, rows):
+    """
+    Отдает CSV построчно. BOM в начале - чтобы Excel открыл UTF-8 с кириллицей
+    """
+    writer = csv.writer(_Echo())
+    yield '\ufeff' + writer.writerow(header)
+    for row in rows:
+        yield writer.writerow([escape_cell(value) for value in row])
+
+
+def csv_response(filename, header, rows):
+    """
+    Потоковый ответ с CSV: первая строка уходит сразу, память не зависит от числа строк
+    """
+    response = StreamingHttpResponse(stream_csv(header, rows), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def client_rows(owner, chunk_size=2000):
+    # iterator() на PostgreSQL читает через серверный курсор порциями по chunk_size
+    return Client.objects.filter(owner=owner).order_by('id').values_list(
+        'id', 'email', 'full_name', 'comment'
+    ).iterator(chunk_size=chunk_size)
+
+
+def mailing_log_rows(mailing, chunk_size=2000):
+    statuses = dict(MailingLog.STATUS_CHOICES)
+    logs = MailingLog.objects.filter(mailing=mailing).order_by('attempt_time', 'id').values_list(
+        'attempt_time', 'status', 'client__email', 'smtp_code', 'response__text'
+    ).iterator(chunk_size=chunk_size)
+    for attempt_time, status, email, smtp_code, text in logs:
+        yield timezone.localtime(attempt_time).isoformat(), statuses[status], email or '', smtp_code or '', text
@@ -1,5 +1,6 @@
 from django import forms
 from .models import Client, Message, Mailing
+from .personalization import FIELDS, unknown_fields
 
 
 class ClientForm(forms.ModelForm):
@@ -12,6 +13,25 @@ class MessageForm(forms.ModelForm):
     class Meta:
         model = Message
         fields = ['subject', 'body']
+        help_texts = {
+            'body': 'В тему и текст можно подставить поля клиента: '
+                    + ', '.join('{{ %s }}' % name for name in FIELDS),
+        }
+
+    def _clean_fields_in(self, name):
+        text = self.cleaned_data[name]
+        unknown = unknown_fields(text)
+        if unknown:
+            raise forms.ValidationError(
+                f"Неизвестные поля: {', '.join(unknown)}. Доступны: {', '.join(FIELDS)}"
+            )
+        return text
+
+    def clean_subject(self):
+        return self._clean_fields_in('subject')
+
+    def clean_body(self):
+        return self._clean_fields_in('body')
 
 
 class MailingForm(forms.ModelForm):
@@ -30,3 +50,20 @@ class MailingForm(forms.ModelForm):
             'start_time': forms.DateTimeInput(attrs={'type': 'datetime-local'}),
             'end_time': forms.DateTimeInput(attrs={'type': 'datetime-local'}),
         }
+
+
+class ClientImportForm(forms.Form):
+    file = forms.FileField(
+        label='CSV файл',
+        help_text='Колонки: email, ФИО, комментарий. Первая строка может быть заголовком, разделитель , ; или tab'
+    )
+    mailing = forms.ModelChoiceField(
+        queryset=Mailing.objects.none(),
+        required=False,
+        label='Добавить в рассылку'
+    )
+
+    def __init__(self, *args, **kwargs):
+        user = kwargs.pop('user')
+        super().__init__(*args, **kwargs)
+        self.fields['mailing'].queryset = Mailing.objects.filter(owner=user)
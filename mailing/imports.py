@@ -0,0 +1,184 @@
+import csv
+import io
+import itertools
+import logging
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+from django.db.models.functions import Lower
+from mailing.caching import bump_owner_versions
+from mailing.dedup import RecipientDeduplicator, normalize_email
+from mailing.models import Client, Mailing
+from mailing.timeline import notify_schedule_changed
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ('email', 'full_name', 'comment')
+
+# Заголовки колонок, которые понимает импорт, кроме самих имен полей
+HEADER_ALIASES = {
+    'e-mail': 'email',
+    'почта': 'email',
+    'фио': 'full_name',
+    'name': 'full_name',
+    'имя': 'full_name',
+    'комментарий': 'comment',
+}
+
+
+class ImportReport:
+    """
+    Итог импорта: счетчики и первые max_errors отклоненных строк
+    (номер строки, строка, причина). Все отклоненные строки можно
+    потоком писать в CSV через rejected_file.
+    """
+
+    def __init__(self, max_errors=100, rejected_file=None):
+        self.created = 0
+        self.existing = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.attached = 0
+        self.errors = []
+        self.max_errors = max_errors
+        self._rejected_writer = csv.writer(rejected_file) if rejected_file is not None else None
+        if self._rejected_writer is not None:
+            self._rejected_writer.writerow(['line', *COLUMNS, 'error'])
+
+    def reject(self, line_number, row, reason):
+        self.rejected += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((line_number, row, reason))
+        if self._rejected_writer is not None:
+            self._rejected_writer.writerow([line_number, *row, reason])
+
+    def __str__(self):
+        return (
+            f"создано клиентов: {self.created}, уже были: {self.existing}, "
+            f"повторов в файле: {self.duplicates}, отклонено строк: {self.rejected}, "
+            f"добавлено в рассылку: {self.attached}"
+        )
+
+
+def open_csv(stream, sample_size=4096):
+    """
+    Читает CSV построчно из текстового потока, разделитель (, ; или tab)
+    определяется по началу файла. Файл целиком в память не загружается.
+    """
+    sample = stream.read(sample_size)
+    sample += stream.readline()
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    return csv.reader(itertools.chain(io.StringIO(sample), stream), dialect)
+
+
+def _column_positions(row):
+    """Номера колонок по заголовку или None, если первая строка - уже данные"""
+    names = [HEADER_ALIASES.get(cell.strip().lower(), cell.strip().lower()) for cell in row]
+    if 'email' not in names:
+        return None
+    return {column: names.index(column) for column in COLUMNS if column in names}
+
+
+def _parse_row(row, positions):
+    values = {}
+    for column, position in positions.items():
+        values[column] = row[position].strip() if position < len(row) else ''
+    email = values.get('email', '')
+    full_name = values.get('full_name', '')
+    if not email:
+        raise ValidationError('не указан email')
+    validate_email(email)
+    if len(email) > Client._meta.get_field('email').max_length:
+        raise ValidationError('слишком длинный email')
+    if not full_name:
+        raise ValidationError('не указано ФИО')
+    if len(full_name) > Client._meta.get_field('full_name').max_length:
+        raise ValidationError('слишком длинное ФИО')
+    return email, full_name, values.get('comment') or None
+
+
+def import_clients(stream, owner, mailing=None, batch_size=None, report=None):
+    """
+    Потоковый импорт клиентов владельца из CSV (email, ФИО, комментарий).
+    Строки проверяются и сохраняются пачками через bulk_create, каждая пачка
+    в своей транзакции. Адреса, которые у владельца уже есть, и повторы
+    внутри файла новых клиентов не создают. Если передана рассылка,
+    и новые, и уже существующие клиенты добавляются в нее.
+    """
+    batch_size = batch_size or settings.MAILING_IMPORT_BATCH_SIZE
+    report = report or ImportReport()
+    reader = open_csv(stream)
+
+    first_row = next(reader, None)
+    if first_row is None:
+        return report
+    positions = _column_positions(first_row)
+    if positions is None:
+        positions = {column: position for position, column in enumerate(COLUMNS)}
+        rows = itertools.chain([(1, first_row)], enumerate(reader, start=2))
+    else:
+        rows = enumerate(reader, start=2)
+
+    with RecipientDeduplicator() as seen:
+        batch = []
+        for line_number, row in rows:
+            if not any(cell.strip() for cell in row):
+                continue
+            try:
+                email, full_name, comment = _parse_row(row, positions)
+            except ValidationError as e:
+                report.reject(line_number, row, '; '.join(e.messages))
+                continue
+            if not seen.add(email):
+                report.duplicates += 1
+                continue
+            batch.append(Client(email=email, full_name=full_name, comment=comment, owner=owner))
+            if len(batch) >= batch_size:
+                _save_batch(batch, owner, mailing, report)
+                batch = []
+        if batch:
+            _save_batch(batch, owner, mailing, report)
+
+    if report.created or report.attached:
+        bump_owner_versions(owner.id)
+    if mailing is not None and report.attached:
+        notify_schedule_changed(mailing.id)
+    logger.info(f"Импорт клиентов пользователя {owner}: {report}")
+    return report
+
+
+def _save_batch(batch, owner, mailing, report):
+    emails = {normalize_email(client.email) for client in batch}
+    with transaction.atomic():
+        existing = dict(
+            Client.objects.filter(owner=owner)
+            .annotate(email_normalized=Lower('email'))
+            .filter(email_normalized__in=emails)
+            .values_list('email_normalized', 'id')
+        )
+        new_clients = [client for client in batch if normalize_email(client.email) not in existing]
+        Client.objects.bulk_create(new_clients, batch_size=len(batch))
+        report.created += len(new_clients)
+        report.existing += len(batch) - len(new_clients)
+
+        if mailing is not None:
+            through = Mailing.clients.through
+            # Существующие клиенты могут уже состоять в рассылке - считаем только новые связи
+            linked = set(
+                through.objects.filter(mailing_id=mailing.id, client_id__in=existing.values())
+                .values_list('client_id', flat=True)
+            )
+            client_ids = [
+                *(client_id for client_id in existing.values() if client_id not in linked),
+                *(client.pk for client in new_clients)
+            ]
+            # Связи вставляются напрямую, сигналы m2m_changed заменяет уведомление в конце импорта
+            through.objects.bulk_create(
+                [through(mailing_id=mailing.id, client_id=client_id) for client_id in client_ids],
+                ignore_conflicts=True
+            )
+            report.attached += len(client_ids)
@@ -0,0 +1,236 @@
+import contextlib
+import importlib
+import json
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import django
+import redis
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+INLINE = 'inline'
+PROCESS = 'process'
+REDIS = 'redis'
+
+JOB_BACKENDS = (INLINE, PROCESS, REDIS)
+
+# Задачи, которые можно поставить в очередь: имя -> функция. В очереди хранится
+# только имя и аргументы (JSON), поэтому выполнить можно лишь перечисленные функции
+JOBS = {
+    'start_mailing': 'mailing.tasks.start_mailing',
+    'check_mailings': 'mailing.tasks.check_mailings',
+    'complete_mailing': 'mailing.tasks.complete_mailing',
+}
+
+
+def run_job(name, args=(), kwargs=None):
+    """Выполняет задачу по имени в текущем процессе"""
+    try:
+        path = JOBS[name]
+    except KeyError:
+        raise ValueError(f"Неизвестная задача: {name}")
+    module, function = path.rsplit('.', 1)
+    return getattr(importlib.import_module(module), function)(*args, **(kwargs or {}))
+
+
+class InlineBackend:
+    """
+    Выполняет задачу сразу в вызывающем потоке. Для разработки и тестов:
+    запрос, запустивший рассылку, ждет окончания ее отправки.
+    """
+
+    def enqueue(self, name, args, kwargs):
+        try:
+            run_job(name, args, kwargs)
+        except Exception:
+            logger.exception(f"Задача {name}{tuple(args)} завершилась ошибкой")
+
+
+class ProcessPoolBackend:
+    """
+    Выполняет задачи в пуле локальных процессов (MAILING_JOB_WORKERS).
+    Процессы запускаются через spawn и не наследуют соединения с БД.
+    Задачи живут только в памяти: при перезапуске процесса невыполненные теряются.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or settings.MAILING_JOB_WORKERS
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def enqueue(self, name, args, kwargs):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=django.setup
+                )
+            future = self._executor.submit(run_job, name, args, kwargs)
+
+        def report(future):
+            if future.exception() is not None:
+                logger.error(f"Задача {name}{tuple(args)} завершилась ошибкой: {future.exception()}")
+
+        future.add_done_callback(report)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+class RedisQueueBackend:
+    """
+    Очередь задач в списке Redis: enqueue кладет задачу в начало списка,
+    воркеры (команда run_job_worker) забирают с конца. Взятая задача
+    атомарно переносится в список обрабатываемых воркера (BLMOVE)
+    и удаляется из него после выполнения. Живой воркер продлевает ключ
+    heartbeat; задачи из списков воркеров без heartbeat (упавших или убитых)
+    любой воркер возвращает в очередь, см. recover_orphaned.
+    client можно передать свой, например fakeredis в тестах.
+    """
+
+    # Сколько секунд heartbeat живет без продления
+    heartbeat_ttl = 30
+
+    def __init__(self, client=None, queue=None):
+        self._client = client
+        self.queue = queue or settings.MAILING_JOB_QUEUE
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = redis.Redis.from_url(settings.REDIS_URL)
+        return self._client
+
+    def processing_queue(self, worker_id):
+        return f"{self.queue}:processing:{worker_id}"
+
+    def heartbeat_key(self, worker_id):
+        return f"{self.queue}:heartbeat:{worker_id}"
+
+    def beat(self, worker_id):
+        self.client.set(self.heartbeat_key(worker_id), 1, ex=self.heartbeat_ttl)
+
+    @contextlib.contextmanager
+    def alive(self, worker_id):
+        """
+        Пока выполняется блок, фоновый поток продлевает heartbeat воркера,
+        в том числе во время долгой задачи. При выходе heartbeat удаляется:
+        то, что осталось в списке обрабатываемых, заберут другие воркеры.
+        """
+        self.beat(worker_id)
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(self.heartbeat_ttl / 3):
+                try:
+                    self.beat(worker_id)
+                except redis.RedisError as e:
+                    logger.warning(f"Воркер {worker_id}: не удалось продлить heartbeat: {str(e)}")
+
+        thread = threading.Thread(target=run, name=f'job-heartbeat-{worker_id}', daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+            try:
+                self.client.delete(self.heartbeat_key(worker_id))
+            except redis.RedisError:
+                pass
+
+    def enqueue(self, name, args, kwargs):
+        self.client.lpush(self.queue, json.dumps({'job': name, 'args': list(args), 'kwargs': kwargs}))
+
+    def recover(self, worker_id):
+        """Возвращает в очередь задачи, которые воркер взял, но не закончил. Возвращает их количество"""
+        processing = self.processing_queue(worker_id)
+        recovered = 0
+        while self.client.lmove(processing, self.queue, 'LEFT', 'RIGHT') is not None:
+            recovered += 1
+        if recovered:
+            logger.warning(f"Воркер {worker_id}: в очередь возвращено незаконченных задач: {recovered}")
+        return recovered
+
+    def recover_orphaned(self):
+        """
+        Возвращает в очередь задачи из списков обрабатываемых всех воркеров,
+        у которых нет heartbeat. Возвращает количество задач
+        """
+        prefix = self.processing_queue('')
+        recovered = 0
+        for key in self.client.scan_iter(match=f"{prefix}*"):
+            worker_id = key.decode()[len(prefix):] if isinstance(key, bytes) else key[len(prefix):]
+            if not self.client.exists(self.heartbeat_key(worker_id)):
+                recovered += self.recover(worker_id)
+        return recovered
+
+    def work_once(self, worker_id, timeout=5):
+        """
+        Ждет задачу до timeout секунд и выполняет ее.
+        Возвращает False, если задачи не было.
+        """
+        processing = self.processing_queue(worker_id)
+        raw = self.client.blmove(self.queue, processing, timeout, 'RIGHT', 'LEFT')
+        if raw is None:
+            return False
+        try:
+            payload = json.loads(raw)
+            logger.info(f"Воркер {worker_id}: задача {payload['job']}{tuple(payload['args'])}")
+            run_job(payload['job'], payload['args'], payload['kwargs'])
+        except Exception:
+            logger.exception(f"Воркер {worker_id}: задача {raw!r} завершилась ошибкой")
+        # При KeyboardInterrupt/SystemExit задача остается в списке обрабатываемых
+        # и будет выполнена заново после восстановления
+        self.client.lrem(processing, 1, raw)
+        return True
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name=None):
+    """Общий для процесса экземпляр бэкенда задач, по умолчанию MAILING_JOB_BACKEND"""
+    name = name or settings.MAILING_JOB_BACKEND
+    with _backends_lock:
+        backend = _backends.get(name)
+        if backend is None:
+            if name == INLINE:
+                backend = InlineBackend()
+            elif name == PROCESS:
+                backend = ProcessPoolBackend()
+            elif name == REDIS:
+                backend = RedisQueueBackend()
+            else:
+                raise ValueError(f"Неизвестный бэкенд задач: {name}")
+            _backends[name] = backend
+        return backend
+
+
+def enqueue(name, *args, **kwargs):
+    """
+    Ставит задачу в очередь выбранного бэкенда после коммита текущей
+    транзакции, чтобы задача увидела сохраненные изменения.
+    Аргументы должны сериализоваться в JSON.
+    """
+    if name not in JOBS:
+        raise ValueError(f"Неизвестная задача: {name}")
+    backend = get_backend()
+
+    def submit():
+        try:
+            backend.enqueue(name, args, kwargs)
+        except redis.RedisError as e:
+            # Рассылку все равно запустит планировщик, задача лишь ускоряет старт
+            logger.error(f"Не удалось поставить задачу {name}{args} в очередь: {str(e)}")
+
+    transaction.on_commit(submit)
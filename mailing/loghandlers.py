@@ -0,0 +1,116 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+from datetime import datetime, timezone
+from django.conf import settings
+
+# Атрибуты LogRecord, которые не считаются дополнительными полями (extra)
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Запись лога одной строкой JSON: время, уровень, логгер, модуль, процесс,
+    поток, сообщение, поля из extra и текст исключения
+    """
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'process': record.process,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES and name not in data:
+                data[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Очередь ограничена: при остановке ждем, пока фоновый поток освободит место
+        self.queue.put(self._sentinel)
+
+
+class QueueFileHandler(logging.handlers.QueueHandler):
+    """
+    Неблокирующая запись лога в файл: вызывающий поток только кладет запись
+    в ограниченную очередь, в файл с ротацией по размеру ее пишет фоновый
+    поток QueueListener. Если очередь переполнена, запись отбрасывается,
+    а не тормозит отправку писем; число отброшенных попадает в лог следующей записью.
+    Форматтер из настроек передается файловому обработчику и работает в фоновом потоке.
+    """
+
+    def __init__(self, filename, maxBytes=0, backupCount=0, encoding='utf-8', queue_size=10000):
+        super().__init__(queue.Queue(queue_size))
+        self.target = logging.handlers.RotatingFileHandler(
+            filename,
+            maxBytes=maxBytes,
+            backupCount=backupCount,
+            encoding=encoding,
+            delay=True
+        )
+        self.dropped = 0
+        self.listener = _QueueListener(self.queue, self.target)
+        self.listener.start()
+        # Дописываем очередь в файл при выходе из процесса
+        atexit.register(self.close)
+
+    def setFormatter(self, fmt):
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Форматирование переносим в фоновый поток, здесь только фиксируем текст сообщения и исключения
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            warning = logging.makeLogRecord({
+                'name': __name__,
+                'levelno': logging.WARNING,
+                'levelname': 'WARNING',
+                'msg': f"Очередь лога переполнена, отброшено записей: {dropped}",
+            })
+            try:
+                self.queue.put_nowait(warning)
+            except queue.Full:
+                self.dropped += dropped
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+            self.target.close()
+        super().close()
+
+
+def sampled():
+    """
+    Нужно ли писать поштучную запись о получателе: пишется доля
+    MAILING_LOG_RECIPIENT_SAMPLE_RATE, чтобы лог не рос с каждым письмом
+    """
+    rate = settings.MAILING_LOG_RECIPIENT_SAMPLE_RATE
+    return rate >= 1 or random.random() < rate
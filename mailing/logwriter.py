@@ -0,0 +1,111 @@
+import logging
+import threading
+import time
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from mailing import metrics
+from mailing.models import MailingLog, MailingRecipient
+from mailing.recipients import advance_checkpoint, renew_lease
+from mailing.statistics import record_attempts
+
+logger = logging.getLogger(__name__)
+
+
+class MailingLogWriter:
+    """
+    Копит записи MailingLog в памяти и сохраняет их через bulk_create:
+    когда накопилось batch_size записей или прошло flush_interval секунд
+    с последнего сброса. Используется как контекстный менеджер - при выходе,
+    в том числе по исключению или KeyboardInterrupt, остаток буфера сохраняется.
+    Если передан client_id, в той же транзакции обновляется журнал получателей
+    и контрольная точка рассылки. С worker_id статус меняется только у получателей,
+    которых этот воркер держит в аренде, а аренда остальных продлевается.
+    """
+
+    def __init__(self, batch_size=None, flush_interval=None, worker_id=None):
+        self.batch_size = batch_size or settings.MAILING_LOG_BATCH_SIZE
+        self.flush_interval = flush_interval if flush_interval is not None else settings.MAILING_LOG_FLUSH_INTERVAL
+        self.worker_id = worker_id
+        self.written = 0
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+            return
+        # Не подменяем исходное исключение ошибкой сохранения логов
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Не удалось сохранить {len(self._buffer)} логов рассылки: {str(e)}")
+
+    def add(self, mailing, status, server_response, client_id=None, smtp_code=None):
+        with self._lock:
+            self._buffer.append((client_id, MailingLog(
+                mailing=mailing,
+                client_id=client_id,
+                status=status,
+                smtp_code=smtp_code,
+                server_response=server_response,
+                attempt_time=timezone.now()
+            )))
+            due = (
+                len(self._buffer) >= self.batch_size
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+            self._last_flush = time.monotonic()
+        if not batch:
+            return
+        try:
+            with metrics.LOG_WRITE.time():
+                # Тексты ответов сохраняются отдельно и повторяются, в логах остаются ссылки на них
+                MailingLog.resolve_responses(log for client_id, log in batch)
+                with transaction.atomic():
+                    MailingLog.objects.bulk_create([log for client_id, log in batch], batch_size=self.batch_size)
+                    self._mark_recipients(batch)
+                    record_attempts((log.mailing.owner_id, log.status) for client_id, log in batch)
+        except Exception:
+            # Возвращаем записи в буфер, чтобы их можно было сохранить повторно
+            with self._lock:
+                self._buffer[:0] = batch
+            raise
+        self.written += len(batch)
+        metrics.LOG_ROWS.inc(len(batch))
+        logger.debug(f"Сохранено логов рассылки: {len(batch)}")
+
+    def _mark_recipients(self, batch):
+        attempts = {}
+        for client_id, log in batch:
+            if client_id is None:
+                continue
+            status = MailingRecipient.SENT if log.status == MailingLog.SUCCESS else MailingRecipient.FAILED
+            attempts.setdefault((log.mailing_id, status), []).append(client_id)
+
+        now = timezone.now()
+        for (mailing_id, status), client_ids in attempts.items():
+            recipients = MailingRecipient.objects.filter(mailing_id=mailing_id, client_id__in=client_ids)
+            if self.worker_id:
+                recipients = recipients.filter(leased_by=self.worker_id)
+            updated = recipients.update(status=status, attempt_time=now)
+            if self.worker_id and updated < len(client_ids):
+                # Аренда истекла и получателей забрал другой воркер - их статус ведет он
+                logger.warning(
+                    f"Рассылка ID {mailing_id}: воркер {self.worker_id} потерял аренду "
+                    f"{len(client_ids) - updated} получателей"
+                )
+        for mailing_id in {mailing_id for mailing_id, status in attempts}:
+            advance_checkpoint(mailing_id)
+            if self.worker_id:
+                renew_lease(mailing_id, self.worker_id)
@@ -0,0 +1,104 @@
+import json
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from mailing import benchmark
+from mailing.delivery import DELIVERY_MODES
+from mailing.models import Mailing
+
+SCALE_SUFFIXES = {'k': 1_000, 'm': 1_000_000}
+
+
+def scale(value):
+    """Число получателей: 10000, 10k, 1M"""
+    value = value.strip().lower()
+    multiplier = SCALE_SUFFIXES.get(value[-1:], 1)
+    number = value[:-1] if multiplier > 1 else value
+    try:
+        result = int(float(number) * multiplier)
+    except ValueError:
+        raise ValueError(f'invalid scale: {value}')
+    if result <= 0:
+        raise ValueError(f'invalid scale: {value}')
+    return result
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed synthetic clients and mailings, deliver them to an in-process SMTP sink '
+        'and print throughput, latency, DB queries per email and peak RSS as JSON. '
+        'Run it against a dedicated database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=scale, default=10_000, help='Recipients to seed: 10k, 100k, 1M')
+        parser.add_argument('--mailings', type=int, default=1, help='Mailings to split recipients between')
+        parser.add_argument(
+            '--mode', choices=DELIVERY_MODES, action='append',
+            help='Delivery mode, can be repeated (default: MAILING_DELIVERY_MODE)'
+        )
+        parser.add_argument('--workers', type=int, help='Worker pool size (default: MAILING_DELIVERY_WORKERS)')
+        parser.add_argument(
+            '--entry', choices=benchmark.ENTRY_POINTS, default=benchmark.SEND_MAILING,
+            help='Call send_mailing for each mailing or check_mailings like the scheduler does'
+        )
+        parser.add_argument('--smtp-latency', type=float, default=0.0, help='Sink reply delay for DATA, seconds')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded data after the run')
+
+    def handle(self, *args, **options):
+        modes = options['mode'] or [settings.MAILING_DELIVERY_MODE]
+        workers = options['workers'] or settings.MAILING_DELIVERY_WORKERS
+        if options['mailings'] < 1:
+            raise CommandError('--mailings must be positive')
+
+        if options['entry'] == benchmark.CHECK_MAILINGS:
+            now = timezone.now()
+            if Mailing.objects.filter(status=Mailing.STARTED, start_time__lte=now, end_time__gte=now).exists():
+                raise CommandError('check_mailings would also send active mailings that are not part of the benchmark')
+
+        self.stderr.write(f"Seeding {options['recipients']} recipients in {options['mailings']} mailings...")
+        started = time.monotonic()
+        data = benchmark.seed(options['recipients'], mailings=options['mailings'])
+        seed_seconds = time.monotonic() - started
+
+        runs = []
+        try:
+            for number, mode in enumerate(modes):
+                if number:
+                    benchmark.reset(data)
+                self.stderr.write(f'Running {mode} with {workers} workers...')
+                result = benchmark.run(
+                    data,
+                    mode,
+                    workers,
+                    entry=options['entry'],
+                    smtp_latency=options['smtp_latency']
+                )
+                runs.append(result)
+                self.stderr.write(
+                    f"{mode}: {result['emails']} emails in {result['seconds']} s "
+                    f"({result['emails_per_second']} emails/s)"
+                )
+        finally:
+            if options['keep']:
+                self.stderr.write(f'Seeded data kept, owner {data.owner.email}')
+            else:
+                benchmark.cleanup(data)
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'environment': benchmark.environment(),
+            'recipients': data.recipients,
+            'mailings': len(data.mailings),
+            'seed_seconds': round(seed_seconds, 3),
+            'runs': runs,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+        else:
+            self.stdout.write(output)
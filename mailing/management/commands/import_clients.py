@@ -0,0 +1,58 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from mailing.imports import ImportReport, import_clients
+from mailing.models import Mailing
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Import clients from a CSV file (email, full name, comment) in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV file path, '-' to read from stdin")
+        parser.add_argument('--owner', required=True, help='Email of the user who will own the clients')
+        parser.add_argument('--mailing', type=int, help='Add imported clients to this mailing')
+        parser.add_argument('--batch-size', type=int, help='Rows per insert (default: MAILING_IMPORT_BATCH_SIZE)')
+        parser.add_argument('--rejected', help='Write rejected rows with reasons to this CSV file')
+        parser.add_argument('--encoding', default='utf-8-sig', help='File encoding')
+
+    def handle(self, *args, **options):
+        try:
+            owner = User.objects.get(email=options['owner'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['owner']} not found")
+
+        mailing = None
+        if options['mailing']:
+            try:
+                mailing = Mailing.objects.get(id=options['mailing'], owner=owner)
+            except Mailing.DoesNotExist:
+                raise CommandError(f"Mailing {options['mailing']} of {owner} not found")
+
+        rejected_file = None
+        if options['rejected']:
+            rejected_file = open(options['rejected'], 'w', encoding='utf-8', newline='')
+        if options['path'] == '-':
+            source = open(sys.stdin.fileno(), encoding=options['encoding'], newline='', closefd=False)
+        else:
+            source = open(options['path'], encoding=options['encoding'], newline='')
+
+        try:
+            with source:
+                report = import_clients(
+                    source,
+                    owner,
+                    mailing=mailing,
+                    batch_size=options['batch_size'],
+                    report=ImportReport(max_errors=20, rejected_file=rejected_file)
+                )
+        finally:
+            if rejected_file is not None:
+                rejected_file.close()
+
+        for line_number, row, reason in report.errors:
+            self.stdout.write(self.style.WARNING(f'Line {line_number}: {reason} ({", ".join(row)})'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {report.created}, existing {report.existing}, duplicates {report.duplicates}, '
+            f'rejected {report.rejected}, attached to mailing {report.attached}'
+        ))
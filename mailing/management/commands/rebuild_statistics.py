@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from mailing.statistics import rebuild_statistics
+
+
+class Command(BaseCommand):
+    help = 'Recalculate precomputed mailing statistics from mailings and logs'
+
+    def handle(self, *args, **options):
+        owners = rebuild_statistics()
+        self.stdout.write(self.style.SUCCESS(f'Statistics rebuilt for {owners} owners'))
@@ -0,0 +1,44 @@
+import time
+import redis
+from django.core.management.base import BaseCommand
+from mailing.jobs import REDIS, get_backend
+from mailing.recipients import default_worker_id
+
+
+class Command(BaseCommand):
+    help = 'Run a worker that executes background jobs from the Redis job queue (MAILING_JOB_BACKEND=redis)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--worker-id', help='Worker identifier (default: hostname:pid); jobs of workers without a heartbeat are recovered by any worker')
+        parser.add_argument('--timeout', type=int, default=5, help='Seconds to wait for a job before polling again')
+        parser.add_argument('--once', action='store_true', help='Run queued jobs until the queue is empty and exit')
+
+    def handle(self, *args, **options):
+        worker_id = options['worker_id'] or default_worker_id()
+        backend = get_backend(REDIS)
+
+        try:
+            with backend.alive(worker_id):
+                # Задачи, оставшиеся от прошлого запуска с тем же идентификатором
+                # и от упавших воркеров (без heartbeat), выполняем заново
+                backend.recover(worker_id)
+                backend.recover_orphaned()
+                self.stdout.write(f'Job worker {worker_id} started')
+                recovered_at = time.monotonic()
+
+                while True:
+                    try:
+                        if time.monotonic() - recovered_at >= backend.heartbeat_ttl:
+                            backend.recover_orphaned()
+                            recovered_at = time.monotonic()
+                        done = backend.work_once(worker_id, timeout=options['timeout'])
+                    except redis.RedisError as e:
+                        if options['once']:
+                            raise
+                        self.stderr.write(f'Redis error: {e}')
+                        time.sleep(options['timeout'])
+                        continue
+                    if options['once'] and not done:
+                        break
+        except KeyboardInterrupt:
+            self.stdout.write(f'Job worker {worker_id} stopped')
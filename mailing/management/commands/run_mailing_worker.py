@@ -0,0 +1,26 @@
+import time
+from django.core.management.base import BaseCommand
+from mailing.recipients import default_worker_id
+from mailing.tasks import check_mailings
+
+
+class Command(BaseCommand):
+    help = 'Run a mailing worker that leases recipients of due mailings; start several to scale out'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--worker-id', help='Worker identifier (default: hostname:pid)')
+        parser.add_argument('--interval', type=float, default=30, help='Seconds between checks for due mailings')
+        parser.add_argument('--once', action='store_true', help='Process due mailings once and exit')
+
+    def handle(self, *args, **options):
+        worker_id = options['worker_id'] or default_worker_id()
+        self.stdout.write(f'Worker {worker_id} started')
+
+        try:
+            while True:
+                check_mailings(worker_id=worker_id)
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write(f'Worker {worker_id} stopped')
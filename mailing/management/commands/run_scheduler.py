@@ -0,0 +1 @@
+from mailing.tasks import Command  # noqa: F401
@@ -1,14 +1,17 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
-from mailing.models import Mailing, MailingLog
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
-from django.conf import settings
+from mailing.delivery import DELIVERY_MODES
+from mailing.models import Mailing
+from mailing.tasks import send_mailing
 
 
 class Command(BaseCommand):
     help = 'Send scheduled mailings'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=DELIVERY_MODES, help='Delivery mode (default: MAILING_DELIVERY_MODE)')
+        parser.add_argument('--workers', type=int, help='Worker pool size (default: MAILING_DELIVERY_WORKERS)')
+
     def handle(self, *args, **options):
         now = timezone.now()
 
@@ -21,36 +24,7 @@ class Command(BaseCommand):
 
         for mailing in mailings:
             self.stdout.write(f'Processing mailing {mailing.id}')
-
-            for client in mailing.clients.all():
-                try:
-                    # Отправляем письмо
-                    send_mail(
-                        subject=mailing.message.subject,
-                        message=mailing.message.body,
-                        from_email=settings.DEFAULT_FROM_EMAIL,
-                        recipient_list=[client.email],
-                        fail_silently=False,
-                    )
-
-                    # Логируем успешную отправку
-                    MailingLog.objects.create(
-                        mailing=mailing,
-                        status=MailingLog.SUCCESS,
-                        response='Email sent successfully'
-                    )
-
-                    self.stdout.write(f'Email sent to {client.email}')
-
-                except Exception as e:
-                    # Логируем ошибку
-                    MailingLog.objects.create(
-                        mailing=mailing,
-                        status=MailingLog.FAILURE,
-                        response=str(e)
-                    )
-
-                    self.stdout.write(f'Failed to send email to {client.email}: {str(e)}')
+            send_mailing(mailing.id, mode=options['mode'], workers=options['workers'])
 
         # Помечаем завершенные рассылки
         completed_mailings = Mailing.objects.filter(
@@ -0,0 +1,257 @@
+import bisect
+import logging
+import multiprocessing
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Registry:
+    """
+    Метрики процесса. Значения копятся в памяти и время от времени
+    (push) прибавляются к общему хешу в Redis, поэтому /metrics/ показывает
+    сумму по всем процессам: веб, планировщики, воркеры и дочерние процессы доставки.
+    Если Redis недоступен, прибавки ждут следующей попытки, а /metrics/
+    показывает значения своего процесса. После ошибки попытки откладываются
+    с растущей паузой (до max_backoff секунд), чтобы push на горячем пути
+    отправки не ждал таймаута соединения на каждой пачке.
+    """
+
+    max_backoff = 300
+
+    def __init__(self, key=None):
+        self.metrics = []
+        self._key = key
+        self._values = defaultdict(float)
+        self._pending = defaultdict(float)
+        self._lock = threading.Lock()
+        self._last_push = time.monotonic()
+        self._failures = 0
+        self._retry_at = 0.0
+        self._redis = None
+
+    @property
+    def key(self):
+        return self._key or settings.MAILING_METRICS_KEY
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def add(self, samples):
+        """samples - пары (имя образца с метками, прибавка)"""
+        with self._lock:
+            for sample, amount in samples:
+                self._values[sample] += amount
+                self._pending[sample] += amount
+
+    def push(self, force=False):
+        """
+        Отправляет накопленные прибавки в Redis не чаще раза в
+        MAILING_METRICS_PUSH_INTERVAL секунд, force - сразу
+        """
+        with self._lock:
+            if not self._pending:
+                return
+            # Redis недавно был недоступен: даже force ждет конца паузы
+            if time.monotonic() < self._retry_at:
+                return
+            if not force and time.monotonic() - self._last_push < settings.MAILING_METRICS_PUSH_INTERVAL:
+                return
+            pending, self._pending = self._pending, defaultdict(float)
+            self._last_push = time.monotonic()
+        try:
+            pipeline = self._client().pipeline(transaction=False)
+            for sample, amount in pending.items():
+                pipeline.hincrbyfloat(self.key, sample, amount)
+            pipeline.execute()
+        except redis.RedisError as e:
+            with self._lock:
+                for sample, amount in pending.items():
+                    self._pending[sample] += amount
+                self._failures += 1
+                pause = min(
+                    max(settings.MAILING_METRICS_PUSH_INTERVAL, 1) * 2 ** (self._failures - 1),
+                    self.max_backoff
+                )
+                self._retry_at = time.monotonic() + pause
+            logger.warning(f"Не удалось отправить метрики в Redis: {str(e)}, следующая попытка через {pause:.0f} с")
+            return
+        with self._lock:
+            self._failures = 0
+            self._retry_at = 0.0
+
+    def collect(self):
+        """Значения образцов по всем процессам, без Redis - только текущего процесса"""
+        self.push(force=True)
+        with self._lock:
+            if time.monotonic() < self._retry_at:
+                return dict(self._values)
+        try:
+            return {
+                sample.decode(): float(value)
+                for sample, value in self._client().hgetall(self.key).items()
+            }
+        except redis.RedisError as e:
+            logger.warning(f"Не удалось прочитать метрики из Redis: {str(e)}")
+            with self._lock:
+                return dict(self._values)
+
+    def render(self):
+        """Текст в формате Prometheus"""
+        values = self.collect()
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(f'{sample} {_format(value)}' for sample, value in metric.samples(values))
+        return '\n'.join(lines) + '\n'
+
+    def _client(self):
+        if self._redis is None:
+            # Короткие таймауты: недоступный Redis не должен тормозить отправку
+            self._redis = redis.Redis.from_url(settings.REDIS_URL, socket_connect_timeout=1, socket_timeout=1)
+        return self._redis
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self._registry = registry
+        registry.register(self)
+
+    def samples(self, values):
+        """Образцы метрики из значений всех метрик, пары (образец, значение)"""
+        return [
+            (sample, values[sample]) for sample in sorted(values)
+            if sample.split('{', 1)[0] == self.name
+        ]
+
+    @staticmethod
+    def _sample(name, labels):
+        if not labels:
+            return name
+        pairs = ','.join(f'{label}="{_escape(value)}"' for label, value in labels.items())
+        return f'{name}{{{pairs}}}'
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if amount:
+            self._registry.add([(self._sample(self.name, labels), amount)])
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS, registry=REGISTRY):
+        super().__init__(name, documentation, registry)
+        self.buckets = tuple(buckets)
+        self._bucket_samples = self._bucket_names({})
+
+    @property
+    def bounds(self):
+        return [_format(bound) for bound in self.buckets] + ['+Inf']
+
+    def _bucket_names(self, labels):
+        return [self._sample(self.name + '_bucket', {**labels, 'le': bound}) for bound in self.bounds]
+
+    def observe(self, value, **labels):
+        bucket_samples = self._bucket_names(labels) if labels else self._bucket_samples
+        # Корзины кумулятивные: значение попадает во все корзины с границей не меньше него
+        first = bisect.bisect_left(self.buckets, value)
+        samples = [(sample, 1) for sample in bucket_samples[first:]]
+        samples.append((self._sample(self.name + '_sum', labels), value))
+        samples.append((self._sample(self.name + '_count', labels), 1))
+        self._registry.add(samples)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def samples(self, values):
+        # Наборы меток берутся из образцов _count; корзин без попаданий нет в хранилище, у них 0
+        result = []
+        counts = sorted(sample for sample in values if sample.split('{', 1)[0] == self.name + '_count')
+        for count_sample in counts:
+            labels = count_sample[len(self.name + '_count'):]
+            bucket_labels = labels[:-1] + ',' if labels else '{'
+            for bound in self.bounds:
+                sample = f'{self.name}_bucket{bucket_labels}le="{bound}"}}'
+                result.append((sample, values.get(sample, 0)))
+            result.append((f'{self.name}_sum{labels}', values.get(f'{self.name}_sum{labels}', 0)))
+            result.append((count_sample, values[count_sample]))
+        return result
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format(value):
+    if value == int(value) and abs(value) < 2 ** 53:
+        return str(int(value))
+    return repr(value)
+
+
+SMTP_CONNECT = Histogram('mailing_smtp_connect_seconds', 'Time to open an SMTP connection.')
+SMTP_CONNECT_ERRORS = Counter('mailing_smtp_connect_errors_total', 'Failed SMTP connection attempts.')
+SMTP_SEND = Histogram('mailing_smtp_send_seconds', 'Time to send one message over an open SMTP connection.')
+SMTP_SEND_ERRORS = Counter('mailing_smtp_send_errors_total', 'Failed send attempts by kind (temporary or permanent).')
+LOG_WRITE = Histogram('mailing_log_write_seconds', 'Time to save one batch of mailing logs and recipient states.')
+LOG_ROWS = Counter('mailing_log_rows_total', 'Mailing log rows saved.')
+RECIPIENTS = Counter('mailing_recipients_processed_total', 'Recipients processed by outcome (sent, failed, skipped).')
+SCHEDULER_TICK = Histogram('mailing_scheduler_tick_seconds', 'Time the scheduler spends handling due events per wakeup.')
+
+
+@contextmanager
+def smtp_connect():
+    """Замеряет открытие SMTP соединения и считает неудачные попытки"""
+    started = time.monotonic()
+    try:
+        yield
+    except Exception:
+        SMTP_CONNECT_ERRORS.inc()
+        raise
+    finally:
+        SMTP_CONNECT.observe(time.monotonic() - started)
+
+
+def observe_send(relay, latency, error):
+    """Наблюдатель попыток отправки (см. mailing.throttle.add_send_observer)"""
+    from mailing.throttle import is_congestion
+
+    SMTP_SEND.observe(latency)
+    if error is not None:
+        SMTP_SEND_ERRORS.inc(kind='temporary' if is_congestion(error) else 'permanent')
+
+
+def push(force=False):
+    REGISTRY.push(force=force)
+
+
+def push_from_worker():
+    """
+    Отправка метрик в конце пачки: дочерний процесс пула может завершиться
+    без atexit, поэтому его прибавки уходят сразу, остальные - по интервалу
+    """
+    REGISTRY.push(force=multiprocessing.parent_process() is not None)
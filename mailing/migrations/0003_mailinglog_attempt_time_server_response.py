@@ -0,0 +1,37 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:50
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mailing", "0002_initial"),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name="mailinglog",
+            old_name="timestamp",
+            new_name="attempt_time",
+        ),
+        migrations.RenameField(
+            model_name="mailinglog",
+            old_name="response",
+            new_name="server_response",
+        ),
+        migrations.AlterField(
+            model_name="mailinglog",
+            name="attempt_time",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now, verbose_name="Дата и время попытки"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="mailinglog",
+            name="server_response",
+            field=models.TextField(default="", verbose_name="Ответ сервера"),
+            preserve_default=False,
+        ),
+    ]
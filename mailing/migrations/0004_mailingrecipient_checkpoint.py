@@ -0,0 +1,82 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mailing", "0003_mailinglog_attempt_time_server_response"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mailing",
+            name="checkpoint",
+            field=models.BigIntegerField(
+                default=0, verbose_name="Контрольная точка (ID клиента)"
+            ),
+        ),
+        migrations.CreateModel(
+            name="MailingRecipient",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Ожидает отправки"),
+                            ("sent", "Отправлено"),
+                            ("failed", "Ошибка отправки"),
+                        ],
+                        default="pending",
+                        max_length=10,
+                        verbose_name="Статус",
+                    ),
+                ),
+                (
+                    "attempt_time",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="Дата и время попытки"
+                    ),
+                ),
+                (
+                    "client",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="mailing.client",
+                        verbose_name="Клиент",
+                    ),
+                ),
+                (
+                    "mailing",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="recipients",
+                        to="mailing.mailing",
+                        verbose_name="Рассылка",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Получатель рассылки",
+                "verbose_name_plural": "Получатели рассылки",
+                "indexes": [
+                    models.Index(
+                        fields=["mailing", "status", "client"],
+                        name="mailing_recipient_pending",
+                    )
+                ],
+                "unique_together": {("mailing", "client")},
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mailing", "0004_mailingrecipient_checkpoint"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mailingrecipient",
+            name="lease_expires_at",
+            field=models.DateTimeField(blank=True, null=True, verbose_name="Аренда до"),
+        ),
+        migrations.AddField(
+            model_name="mailingrecipient",
+            name="leased_by",
+            field=models.CharField(
+                blank=True, default="", max_length=255, verbose_name="Воркер"
+            ),
+        ),
+    ]
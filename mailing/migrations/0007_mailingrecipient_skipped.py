@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mailing", "0006_message_updated_at"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="mailingrecipient",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Ожидает отправки"),
+                    ("sent", "Отправлено"),
+                    ("failed", "Ошибка отправки"),
+                    ("skipped", "Пропущен (дубликат адреса)"),
+                ],
+                default="pending",
+                max_length=10,
+                verbose_name="Статус",
+            ),
+        ),
+    ]
@@ -0,0 +1,115 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:06
+
+import django.db.models.deletion
+from django.conf import settings
+from collections import defaultdict
+from django.db import migrations, models
+from django.db.models import Count
+
+STATUS_FIELDS = {
+    "created": "created_mailings",
+    "started": "started_mailings",
+    "completed": "completed_mailings",
+}
+ATTEMPT_FIELDS = {
+    "success": "success_attempts",
+    "failure": "failure_attempts",
+}
+
+
+def fill_statistics(apps, schema_editor):
+    Mailing = apps.get_model("mailing", "Mailing")
+    MailingLog = apps.get_model("mailing", "MailingLog")
+    MailingStatistics = apps.get_model("mailing", "MailingStatistics")
+
+    rows = defaultdict(lambda: defaultdict(int))
+    mailings = (
+        Mailing.objects.values_list("owner_id", "status")
+        .annotate(count=Count("id"))
+        .order_by()
+    )
+    for owner_id, status, count in mailings:
+        rows[owner_id][STATUS_FIELDS[status]] += count
+    logs = (
+        MailingLog.objects.values_list("mailing__owner_id", "status")
+        .annotate(count=Count("id"))
+        .order_by()
+    )
+    for owner_id, status, count in logs:
+        rows[owner_id][ATTEMPT_FIELDS[status]] += count
+
+    totals = defaultdict(int)
+    for fields in rows.values():
+        for field, count in fields.items():
+            totals[field] += count
+
+    MailingStatistics.objects.bulk_create(
+        [
+            MailingStatistics(owner_id=owner_id, **fields)
+            for owner_id, fields in rows.items()
+        ]
+        + [MailingStatistics(owner=None, **totals)]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mailing", "0007_mailingrecipient_skipped"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MailingStatistics",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "created_mailings",
+                    models.IntegerField(default=0, verbose_name="Созданных рассылок"),
+                ),
+                (
+                    "started_mailings",
+                    models.IntegerField(default=0, verbose_name="Запущенных рассылок"),
+                ),
+                (
+                    "completed_mailings",
+                    models.IntegerField(default=0, verbose_name="Завершенных рассылок"),
+                ),
+                (
+                    "success_attempts",
+                    models.BigIntegerField(default=0, verbose_name="Успешных попыток"),
+                ),
+                (
+                    "failure_attempts",
+                    models.BigIntegerField(
+                        default=0, verbose_name="Неуспешных попыток"
+                    ),
+                ),
+                (
+                    "owner",
+                    models.OneToOneField(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="mailing_statistics",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Владелец",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Статистика рассылок",
+                "verbose_name_plural": "Статистика рассылок",
+            },
+        ),
+        migrations.RunPython(fill_statistics, migrations.RunPython.noop),
+    ]
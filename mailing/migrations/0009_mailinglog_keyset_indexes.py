@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mailing", "0008_mailingstatistics"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="mailinglog",
+            index=models.Index(
+                fields=["mailing", "attempt_time", "id"], name="mailinglog_mailing_time"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="mailinglog",
+            index=models.Index(
+                fields=["mailing", "status", "attempt_time", "id"],
+                name="mailinglog_mailing_status_time",
+            ),
+        ),
+    ]
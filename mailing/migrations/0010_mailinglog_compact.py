@@ -0,0 +1,197 @@
+import re
+from collections import defaultdict
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Min, OuterRef, Subquery
+from django.db.models.functions import MD5
+
+STATUSES = {"success": 1, "failure": 2}
+
+BATCH_SIZE = 1000
+
+# Код SMTP в сохраненных текстах: "(550, b'...')" от smtplib или "550 ..." в начале ответа
+CODE_PATTERNS = [re.compile(r"\((\d{3}), b?['\"]"), re.compile(r"(?:^|: )(\d{3})[ -]")]
+
+
+def parse_code(status, text):
+    if status == "success":
+        return 250
+    for pattern in CODE_PATTERNS:
+        match = pattern.search(text)
+        if match and 200 <= int(match.group(1)) < 600:
+            return int(match.group(1))
+    return None
+
+
+def compact_logs(apps, schema_editor):
+    MailingLog = apps.get_model("mailing", "MailingLog")
+    MailingResponse = apps.get_model("mailing", "MailingResponse")
+
+    for old, new in STATUSES.items():
+        MailingLog.objects.filter(status=old).update(status_code=new)
+
+    # Хеш текста считает база (MD5 есть и в PostgreSQL, и в SQLite у Django),
+    # дальше все запросы соединяются по нему, а не по тексту без индекса
+    MailingLog.objects.update(response_hash=MD5("server_response"))
+
+    texts = (
+        MailingLog.objects.values("response_hash")
+        .annotate(text=Min("server_response"))
+        .order_by()
+    )
+    batch = []
+    for row in texts.iterator(chunk_size=BATCH_SIZE):
+        batch.append(MailingResponse(text=row["text"], text_hash=row["response_hash"]))
+        if len(batch) >= BATCH_SIZE:
+            MailingResponse.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    MailingResponse.objects.bulk_create(batch, ignore_conflicts=True)
+
+    # Ссылки на ответы одним UPDATE, подзапрос идет по уникальному индексу text_hash
+    MailingLog.objects.update(
+        response_id=Subquery(
+            MailingResponse.objects.filter(text_hash=OuterRef("response_hash")).values("id")[:1]
+        )
+    )
+
+    # Код SMTP разбирается по различным текстам неудачных попыток
+    # и проставляется пачками id ответов по индексу response_id
+    MailingLog.objects.filter(status_code=STATUSES["success"]).update(smtp_code=250)
+    failures = MailingResponse.objects.filter(
+        id__in=MailingLog.objects.filter(status_code=STATUSES["failure"]).values("response_id")
+    ).values_list("id", "text")
+    codes = defaultdict(list)
+    for response_id, text in list(failures):
+        code = parse_code("failure", text)
+        if code is not None:
+            codes[code].append(response_id)
+    for code, ids in codes.items():
+        for start in range(0, len(ids), BATCH_SIZE):
+            MailingLog.objects.filter(
+                status_code=STATUSES["failure"], response_id__in=ids[start:start + BATCH_SIZE]
+            ).update(smtp_code=code)
+
+
+def expand_logs(apps, schema_editor):
+    MailingLog = apps.get_model("mailing", "MailingLog")
+    MailingResponse = apps.get_model("mailing", "MailingResponse")
+
+    for old, new in STATUSES.items():
+        MailingLog.objects.filter(status_code=new).update(status=old)
+    MailingLog.objects.update(
+        server_response=Subquery(
+            MailingResponse.objects.filter(id=OuterRef("response_id")).values("text")[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mailing", "0009_mailinglog_keyset_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MailingResponse",
+            fields=[
+                ("id", models.AutoField(primary_key=True, serialize=False)),
+                ("text", models.TextField(verbose_name="Текст ответа")),
+                (
+                    "text_hash",
+                    models.CharField(
+                        max_length=32, unique=True, verbose_name="Хеш текста"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Ответ сервера",
+                "verbose_name_plural": "Ответы сервера",
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name="mailinglog",
+            name="mailinglog_mailing_status_time",
+        ),
+        migrations.AddField(
+            model_name="mailinglog",
+            name="status_code",
+            field=models.PositiveSmallIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="mailinglog",
+            name="smtp_code",
+            field=models.PositiveSmallIntegerField(
+                blank=True, null=True, verbose_name="Код ответа SMTP"
+            ),
+        ),
+        migrations.AddField(
+            model_name="mailinglog",
+            name="response",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                to="mailing.mailingresponse",
+                verbose_name="Ответ сервера",
+            ),
+        ),
+        # Старые поля становятся необязательными, чтобы миграцию можно было откатить
+        migrations.AlterField(
+            model_name="mailinglog",
+            name="status",
+            field=models.CharField(max_length=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name="mailinglog",
+            name="server_response",
+            field=models.TextField(null=True),
+        ),
+        # Временный хеш текста для соединения логов с ответами
+        migrations.AddField(
+            model_name="mailinglog",
+            name="response_hash",
+            field=models.CharField(max_length=32, null=True),
+        ),
+        migrations.RunPython(compact_logs, expand_logs),
+        migrations.RemoveField(
+            model_name="mailinglog",
+            name="response_hash",
+        ),
+        migrations.RemoveField(
+            model_name="mailinglog",
+            name="server_response",
+        ),
+        migrations.RemoveField(
+            model_name="mailinglog",
+            name="status",
+        ),
+        migrations.RenameField(
+            model_name="mailinglog",
+            old_name="status_code",
+            new_name="status",
+        ),
+        migrations.AlterField(
+            model_name="mailinglog",
+            name="status",
+            field=models.PositiveSmallIntegerField(
+                choices=[(1, "Успешно"), (2, "Не успешно")],
+                verbose_name="Статус попытки",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="mailinglog",
+            name="response",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.PROTECT,
+                to="mailing.mailingresponse",
+                verbose_name="Ответ сервера",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="mailinglog",
+            index=models.Index(
+                fields=["mailing", "status", "attempt_time", "id"],
+                name="mailinglog_mailing_status_time",
+            ),
+        ),
+    ]
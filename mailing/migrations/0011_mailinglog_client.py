@@ -0,0 +1,25 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mailing", "0010_mailinglog_compact"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mailinglog",
+            name="client",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                to="mailing.client",
+                verbose_name="Клиент",
+            ),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:47
+
+import hashlib
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def email_key(email):
+    # Как mailing.dedup.email_key на момент миграции
+    return int.from_bytes(
+        hashlib.blake2b(email.strip().lower().encode(), digest_size=8).digest(),
+        "big",
+        signed=True,
+    )
+
+
+def fill_email_keys(apps, schema_editor):
+    MailingRecipient = apps.get_model("mailing", "MailingRecipient")
+
+    # Страницами по id: один запрос на чтение и один bulk_update на пачку
+    last_id = 0
+    while True:
+        batch = list(
+            MailingRecipient.objects.filter(id__gt=last_id)
+            .order_by("id")
+            .values_list("id", "client__email")[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        MailingRecipient.objects.bulk_update(
+            [MailingRecipient(id=pk, email_key=email_key(email)) for pk, email in batch],
+            ["email_key"],
+        )
+        last_id = batch[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mailing", "0011_mailinglog_client"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mailingrecipient",
+            name="email_key",
+            field=models.BigIntegerField(
+                blank=True, null=True, verbose_name="Ключ адреса"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="mailingrecipient",
+            index=models.Index(
+                fields=["mailing", "email_key", "client"],
+                name="mailing_recipient_email",
+            ),
+        ),
+        migrations.RunPython(fill_email_keys, migrations.RunPython.noop),
+    ]
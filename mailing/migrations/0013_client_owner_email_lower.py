@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:01
+
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mailing", "0012_mailingrecipient_email_key"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="client",
+            index=models.Index(
+                models.F("owner"),
+                django.db.models.functions.text.Lower("email"),
+                name="client_owner_email_lower",
+            ),
+        ),
+    ]
@@ -1,18 +1,11 @@
-from django.db import models
+import hashlib
+from django.db import models, transaction
+from django.db.models.functions import Lower
+from django.utils import timezone
 from users.models import User
 from django.contrib.auth import get_user_model
 
 
-def save(self, *args, **kwargs):
-    if self.status == self.STARTED and not self.pk:
-        # При создании новой рассылки со статусом "Запущена"
-        from mailing.tasks import send_mailing
-        super().save(*args, **kwargs)
-        send_mailing.delay(self.id)
-    else:
-        super().save(*args, **kwargs)
-
-
 class Client(models.Model):
     email = models.EmailField(verbose_name='Email')
     full_name = models.CharField(max_length=255, verbose_name='ФИО')
@@ -25,6 +18,10 @@ class Client(models.Model):
         permissions = [
             ('view_all_clients', 'Can view all clients'),
         ]
+        indexes = [
+            # Поиск существующих клиентов владельца по адресу без учета регистра при импорте
+            models.Index(models.F('owner'), Lower('email'), name='client_owner_email_lower'),
+        ]
 
     def __str__(self):
         return self.full_name
@@ -34,6 +31,7 @@ class Message(models.Model):
     subject = models.CharField(max_length=255, verbose_name='Тема письма')
     body = models.TextField(verbose_name='Тело письма')
     owner = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Владелец')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
 
     class Meta:
         verbose_name = 'Сообщение'
@@ -63,6 +61,7 @@ class Mailing(models.Model):
     message = models.ForeignKey(Message, on_delete=models.CASCADE, verbose_name='Сообщение')
     clients = models.ManyToManyField(Client, verbose_name='Клиенты')
     owner = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Владелец')
+    checkpoint = models.BigIntegerField(default=0, verbose_name='Контрольная точка (ID клиента)')
 
     class Meta:
         verbose_name = 'Рассылка'
@@ -75,24 +74,192 @@ class Mailing(models.Model):
     def __str__(self):
         return f'Рассылка {self.id} ({self.get_status_display()})'
 
+    def is_active(self):
+        """Рассылка запущена и текущее время попадает в период отправки"""
+        now = timezone.now()
+        return self.status == self.STARTED and self.start_time <= now <= self.end_time
+
+
+class MailingRecipient(models.Model):
+    """
+    Состояние доставки рассылки конкретному клиенту
+    """
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+
+    STATUS_CHOICES = [
+        (PENDING, 'Ожидает отправки'),
+        (SENT, 'Отправлено'),
+        (FAILED, 'Ошибка отправки'),
+        (SKIPPED, 'Пропущен (дубликат адреса)'),
+    ]
+
+    mailing = models.ForeignKey(Mailing, on_delete=models.CASCADE, related_name='recipients', verbose_name='Рассылка')
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, verbose_name='Клиент')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING, verbose_name='Статус')
+    attempt_time = models.DateTimeField(blank=True, null=True, verbose_name='Дата и время попытки')
+    leased_by = models.CharField(max_length=255, blank=True, default='', verbose_name='Воркер')
+    lease_expires_at = models.DateTimeField(blank=True, null=True, verbose_name='Аренда до')
+    # Хеш нормализованного адреса клиента (mailing.dedup.email_key) для поиска дубликатов
+    email_key = models.BigIntegerField(blank=True, null=True, verbose_name='Ключ адреса')
+
+    class Meta:
+        verbose_name = 'Получатель рассылки'
+        verbose_name_plural = 'Получатели рассылки'
+        unique_together = ('mailing', 'client')
+        indexes = [
+            models.Index(fields=['mailing', 'status', 'client'], name='mailing_recipient_pending'),
+            models.Index(fields=['mailing', 'email_key', 'client'], name='mailing_recipient_email'),
+        ]
+
+    def __str__(self):
+        return f'{self.client_id} в рассылке {self.mailing_id} ({self.get_status_display()})'
+
+
+class MailingResponseManager(models.Manager):
+    # Кеш процесса: хеш текста -> id, тексты ответов повторяются от письма к письму
+    _ids = {}
+    cache_size = 10000
+
+    def ids_for(self, texts):
+        """
+        Возвращает {текст: id} для текстов ответов, недостающие создает одним запросом
+        """
+        hashes = {text: MailingResponse.hash_text(text) for text in set(texts)}
+        found = {text_hash: self._ids[text_hash] for text_hash in hashes.values() if text_hash in self._ids}
+        missing = {text_hash: text for text, text_hash in hashes.items() if text_hash not in found}
+        if missing:
+            self.bulk_create(
+                [MailingResponse(text=text, text_hash=text_hash) for text_hash, text in missing.items()],
+                ignore_conflicts=True
+            )
+            created = dict(self.filter(text_hash__in=missing).values_list('text_hash', 'id'))
+            found.update(created)
+            # В кеш только после коммита: при откате транзакции созданных строк не будет
+            transaction.on_commit(lambda: self._remember(created), using=self.db)
+        return {text: found[text_hash] for text, text_hash in hashes.items()}
+
+    def _remember(self, ids):
+        if len(self._ids) + len(ids) > self.cache_size:
+            self._ids.clear()
+        self._ids.update(ids)
+
+
+class MailingResponse(models.Model):
+    """
+    Уникальный текст ответа сервера. Логи ссылаются на него, а не хранят
+    одинаковые строки миллионы раз.
+    """
+    id = models.AutoField(primary_key=True)
+    text = models.TextField(verbose_name='Текст ответа')
+    text_hash = models.CharField(max_length=32, unique=True, verbose_name='Хеш текста')
+
+    objects = MailingResponseManager()
+
+    class Meta:
+        verbose_name = 'Ответ сервера'
+        verbose_name_plural = 'Ответы сервера'
+
+    def __str__(self):
+        return self.text
+
+    @staticmethod
+    def hash_text(text):
+        # md5, как функция MD5 в базе: миграция 0010 считает хеши старых логов одним UPDATE
+        return hashlib.md5(text.encode(), usedforsecurity=False).hexdigest()
+
 
 class MailingLog(models.Model):
-    SUCCESS = 'success'
-    FAILURE = 'failure'
+    SUCCESS = 1
+    FAILURE = 2
 
     STATUS_CHOICES = [
         (SUCCESS, 'Успешно'),
         (FAILURE, 'Не успешно'),
     ]
 
-    attempt_time = models.DateTimeField(auto_now_add=True, verbose_name='Дата и время попытки')
-    status = models.CharField(max_length=10, choices=STATUS_CHOICES, verbose_name='Статус попытки')
-    server_response = models.TextField(verbose_name='Ответ сервера')
+    attempt_time = models.DateTimeField(default=timezone.now, verbose_name='Дата и время попытки')
+    status = models.PositiveSmallIntegerField(choices=STATUS_CHOICES, verbose_name='Статус попытки')
+    smtp_code = models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Код ответа SMTP')
+    response = models.ForeignKey(MailingResponse, on_delete=models.PROTECT, verbose_name='Ответ сервера')
     mailing = models.ForeignKey(Mailing, on_delete=models.CASCADE, verbose_name='Рассылка')
+    # Адрес получателя в тексте ответа не хранится, он берется у клиента
+    client = models.ForeignKey(
+        Client, on_delete=models.SET_NULL, blank=True, null=True, verbose_name='Клиент'
+    )
 
     class Meta:
         verbose_name = 'Лог рассылки'
         verbose_name_plural = 'Логи рассылки'
+        indexes = [
+            # Страницы логов рассылки по ключу (attempt_time, id), в т.ч. с фильтром по статусу
+            models.Index(fields=['mailing', 'attempt_time', 'id'], name='mailinglog_mailing_time'),
+            models.Index(fields=['mailing', 'status', 'attempt_time', 'id'], name='mailinglog_mailing_status_time'),
+        ]
 
     def __str__(self):
         return f'Лог {self.id} ({self.get_status_display()})'
+
+    @property
+    def server_response(self):
+        """Текст ответа сервера; можно передать в конструктор, id ответа найдется при сохранении"""
+        if self.response_id is None:
+            return getattr(self, '_server_response', None)
+        return self.response.text
+
+    @server_response.setter
+    def server_response(self, text):
+        self._server_response = text
+        self.response_id = None
+
+    @classmethod
+    def resolve_responses(cls, logs):
+        """Проставляет ссылки на тексты ответов логам перед bulk_create"""
+        logs = [log for log in logs if log.response_id is None]
+        ids = MailingResponse.objects.ids_for(log._server_response for log in logs)
+        for log in logs:
+            log.response_id = ids[log._server_response]
+
+    def save(self, *args, **kwargs):
+        if self.response_id is None:
+            self.resolve_responses([self])
+        super().save(*args, **kwargs)
+
+
+class MailingStatistics(models.Model):
+    """
+    Предрасчитанные счетчики для страницы статистики: строка на владельца
+    и общая строка без владельца. Обновляются при смене статуса рассылки
+    и записи логов (см. mailing.statistics), пересчитываются командой
+    rebuild_statistics.
+    """
+    owner = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        blank=True,
+        null=True,
+        related_name='mailing_statistics',
+        verbose_name='Владелец'
+    )
+    created_mailings = models.IntegerField(default=0, verbose_name='Созданных рассылок')
+    started_mailings = models.IntegerField(default=0, verbose_name='Запущенных рассылок')
+    completed_mailings = models.IntegerField(default=0, verbose_name='Завершенных рассылок')
+    success_attempts = models.BigIntegerField(default=0, verbose_name='Успешных попыток')
+    failure_attempts = models.BigIntegerField(default=0, verbose_name='Неуспешных попыток')
+
+    class Meta:
+        verbose_name = 'Статистика рассылок'
+        verbose_name_plural = 'Статистика рассылок'
+
+    def __str__(self):
+        return f'Статистика {self.owner or "общая"}'
+
+    @property
+    def total_mailings(self):
+        return self.created_mailings + self.started_mailings + self.completed_mailings
+
+    @property
+    def total_attempts(self):
+        return self.success_attempts + self.failure_attempts
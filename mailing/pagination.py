@@ -0,0 +1,73 @@
+import base64
+from datetime import datetime
+from django.db.models import Q
+
+
+class KeysetPage:
+    """
+    Страница keyset-пагинации: записи и курсоры соседних страниц
+    """
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+def encode_cursor(obj):
+    value = f"{obj.attempt_time.isoformat()}|{obj.pk}"
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Возвращает (время попытки, id), ValueError для испорченного курсора"""
+    try:
+        value = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        attempt_time, pk = value.split('|')
+        return datetime.fromisoformat(attempt_time), int(pk)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Некорректный курсор: {cursor}") from e
+
+
+def keyset_paginate(queryset, page_size, after=None, before=None):
+    """
+    Делит логи на страницы от новых к старым по ключу (attempt_time, id).
+    Вместо OFFSET каждая страница начинается условием на ключ последней
+    записи предыдущей, поэтому с составным индексом страница N стоит
+    столько же, сколько первая.
+    after - курсор, после которого идут более старые записи,
+    before - курсор, до которого идут более новые (переход назад).
+    """
+    if before is not None:
+        attempt_time, pk = decode_cursor(before)
+        rows = list(
+            queryset.filter(Q(attempt_time__gt=attempt_time) | Q(attempt_time=attempt_time, id__gt=pk))
+            .order_by('attempt_time', 'id')[:page_size + 1]
+        )
+        has_more = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        return KeysetPage(
+            rows,
+            next_cursor=encode_cursor(rows[-1]) if rows else None,
+            previous_cursor=encode_cursor(rows[0]) if has_more else None,
+        )
+
+    if after is not None:
+        attempt_time, pk = decode_cursor(after)
+        queryset = queryset.filter(Q(attempt_time__lt=attempt_time) | Q(attempt_time=attempt_time, id__lt=pk))
+    rows = list(queryset.order_by('-attempt_time', '-id')[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    return KeysetPage(
+        rows,
+        next_cursor=encode_cursor(rows[-1]) if has_more else None,
+        previous_cursor=encode_cursor(rows[0]) if after is not None and rows else None,
+    )
@@ -0,0 +1,54 @@
+import re
+
+# Поля клиента, которые можно подставить в тему и текст письма: {{ full_name }}
+FIELDS = ('full_name', 'email')
+
+_FIELD = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+
+
+class Template:
+    """
+    Тема или текст письма, разобранные один раз в план подстановки:
+    статические куски текста чередуются с именами полей. Отрисовка - склейка
+    кусков со значениями, без движка шаблонов Django.
+    Неизвестные поля остаются в тексте как есть, поэтому письма,
+    написанные до появления полей, отправляются без изменений.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.static = []
+        self.names = []
+        position = 0
+        for match in _FIELD.finditer(text):
+            if match.group(1) not in FIELDS:
+                continue
+            self.static.append(text[position:match.start()])
+            self.names.append(match.group(1))
+            position = match.end()
+        self.static.append(text[position:])
+        self.fields = tuple(sorted(set(self.names)))
+
+    @property
+    def is_static(self):
+        return not self.names
+
+    def render(self, values):
+        """Текст со значениями полей из словаря values"""
+        if not self.names:
+            return self.text
+        parts = [self.static[0]]
+        for name, static in zip(self.names, self.static[1:]):
+            parts.append(values[name])
+            parts.append(static)
+        return ''.join(parts)
+
+
+def recipient_values(email, full_name):
+    """Значения полей для получателя"""
+    return {'full_name': full_name or '', 'email': email}
+
+
+def unknown_fields(text):
+    """Поля в {{ }}, которых нет среди FIELDS"""
+    return sorted({name for name in _FIELD.findall(text) if name not in FIELDS})
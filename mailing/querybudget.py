@@ -0,0 +1,77 @@
+import logging
+from contextlib import ContextDecorator, ExitStack
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class query_budget(ContextDecorator):
+    """
+    Считает SQL запросы внутри блока и сообщает, если их больше limit.
+    Работает и при DEBUG=False (через execute_wrapper), поэтому годится для тестов:
+
+        with query_budget(4):
+            client.get('/mailings/')
+
+    strict=True бросает QueryBudgetExceeded (наследник AssertionError - тест упадет),
+    иначе пишет предупреждение в лог. По умолчанию берется QUERY_BUDGET_STRICT.
+    limit=None только считает запросы (budget.queries).
+    """
+
+    def __init__(self, limit, name=None, strict=None):
+        self.limit = limit
+        self.name = name
+        self.strict = strict
+        self.queries = []
+        self._stack = None
+
+    def __enter__(self):
+        self.queries = []
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self._record))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stack.close()
+        if exc_type is None and self.limit is not None and len(self.queries) > self.limit:
+            self._report()
+        return False
+
+    def _record(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+    def _report(self):
+        message = (
+            f"{self.name or 'Блок'}: {len(self.queries)} SQL запросов при бюджете {self.limit}\n"
+            + '\n'.join(f"{number}. {sql}" for number, sql in enumerate(self.queries, 1))
+        )
+        strict = settings.QUERY_BUDGET_STRICT if self.strict is None else self.strict
+        if strict:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+class QueryBudgetMixin:
+    """
+    Ограничивает число запросов представления вместе с отрисовкой шаблона.
+    Задается атрибутом query_budget; должен стоять в базовых классах первым,
+    чтобы учитывались и запросы проверки доступа.
+    """
+    query_budget = None
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.query_budget is None:
+            return super().dispatch(request, *args, **kwargs)
+        with query_budget(self.query_budget, name=self.__class__.__name__):
+            response = super().dispatch(request, *args, **kwargs)
+            # TemplateResponse рисуется после dispatch, а запросы N+1 случаются как раз в шаблоне
+            if hasattr(response, 'render') and callable(response.render):
+                response.render()
+        return response
@@ -0,0 +1,190 @@
+import logging
+import os
+import socket
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Min, Q
+from django.utils import timezone
+from mailing.dedup import email_key
+from mailing.models import Mailing, MailingRecipient
+
+logger = logging.getLogger(__name__)
+
+
+def sync_recipients(mailing, batch_size=1000):
+    """
+    Приводит журнал получателей в соответствие с клиентами рассылки:
+    добавляет новых клиентов в статусе "ожидает", убирает ожидающих,
+    которых исключили из рассылки. Уже обработанные записи не трогает.
+    Возвращает количество добавленных получателей.
+    """
+    ledger = MailingRecipient.objects.filter(mailing=mailing)
+
+    removed, _ = ledger.filter(status=MailingRecipient.PENDING).exclude(
+        client_id__in=mailing.clients.values('id')
+    ).delete()
+    if removed:
+        logger.info(f"Рассылка ID {mailing.id}: из журнала убрано получателей: {removed}")
+
+    new_clients = mailing.clients.exclude(
+        id__in=ledger.values('client_id')
+    ).order_by('id').values_list('id', 'email')
+
+    # Читаем id страницами, а не курсором: запись во время открытого чтения блокирует SQLite
+    added = 0
+    first_new_id = None
+    last_id = 0
+    while True:
+        batch = list(new_clients.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            break
+        if first_new_id is None:
+            first_new_id = batch[0][0]
+        MailingRecipient.objects.bulk_create(
+            [
+                MailingRecipient(mailing=mailing, client_id=client_id, email_key=email_key(email))
+                for client_id, email in batch
+            ],
+            ignore_conflicts=True
+        )
+        added += len(batch)
+        last_id = batch[-1][0]
+
+    # Новые получатели могут оказаться раньше контрольной точки - откатываем ее
+    if first_new_id is not None and first_new_id <= mailing.checkpoint:
+        mailing.checkpoint = first_new_id - 1
+        Mailing.objects.filter(id=mailing.id).update(checkpoint=mailing.checkpoint)
+
+    if added:
+        logger.info(f"Рассылка ID {mailing.id}: в журнал добавлено получателей: {added}")
+    return added
+
+
+def pending_recipients(mailing):
+    """
+    Получатели, которым рассылка еще не отправлялась, начиная с контрольной точки
+    """
+    return MailingRecipient.objects.filter(
+        mailing=mailing,
+        status=MailingRecipient.PENDING,
+        client_id__gt=mailing.checkpoint
+    ).order_by('client_id')
+
+
+def iter_pending_recipients(mailing, chunk_size=None):
+    """
+    Потоково отдает ожидающих получателей как (id клиента, email, ФИО).
+    Читает журнал кусками по ключу client_id (keyset-пагинация), поэтому
+    память не зависит от размера аудитории, а каждый следующий кусок
+    стоит столько же, сколько первый.
+    """
+    chunk_size = chunk_size or settings.MAILING_RECIPIENTS_CHUNK_SIZE
+    last_id = mailing.checkpoint
+    while True:
+        chunk = list(
+            MailingRecipient.objects.filter(
+                mailing=mailing,
+                status=MailingRecipient.PENDING,
+                client_id__gt=last_id
+            ).order_by('client_id').values_list('client_id', 'client__email', 'client__full_name')[:chunk_size]
+        )
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1][0]
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_recipients(mailing, worker_id, limit=None, lease_seconds=None):
+    """
+    Берет в аренду до limit ожидающих получателей, которых не держит другой воркер
+    (или чья аренда истекла), и возвращает их как (id клиента, email, ФИО).
+    На PostgreSQL строки выбираются через SELECT ... FOR UPDATE SKIP LOCKED, поэтому
+    воркеры не ждут друг друга. В SQLite блокировок строк нет - там запись
+    сериализуется базой, а условный UPDATE не даст двум воркерам взять одни строки.
+    """
+    limit = limit or settings.MAILING_RECIPIENTS_CHUNK_SIZE
+    lease_seconds = lease_seconds or settings.MAILING_LEASE_SECONDS
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=lease_seconds)
+    free = Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lt=now)
+
+    with transaction.atomic():
+        candidates = MailingRecipient.objects.filter(
+            free,
+            mailing=mailing,
+            status=MailingRecipient.PENDING
+        ).order_by('client_id')
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        ids = list(candidates.values_list('id', flat=True)[:limit])
+        if not ids:
+            return []
+        MailingRecipient.objects.filter(free, id__in=ids).update(
+            leased_by=worker_id,
+            lease_expires_at=expires_at
+        )
+
+    return list(
+        MailingRecipient.objects.filter(
+            id__in=ids,
+            leased_by=worker_id,
+            lease_expires_at=expires_at
+        ).order_by('client_id').values_list('client_id', 'client__email', 'client__full_name')
+    )
+
+
+def iter_claimed_recipients(mailing, worker_id, chunk_size=None):
+    """
+    Потоково отдает получателей, взятых в аренду воркером, пока ожидающие не закончатся
+    """
+    while True:
+        chunk = claim_recipients(mailing, worker_id, limit=chunk_size)
+        if not chunk:
+            return
+        logger.debug(f"Рассылка ID {mailing.id}: воркер {worker_id} взял получателей: {len(chunk)}")
+        yield from chunk
+
+
+def renew_lease(mailing_id, worker_id, lease_seconds=None):
+    """
+    Продлевает аренду всех еще не обработанных получателей воркера на lease_seconds
+    от текущего момента. Вызывается после каждого сохранения исходов, чтобы пачку,
+    которую воркер еще отправляет, не забрал другой воркер. Возвращает количество строк.
+    """
+    lease_seconds = lease_seconds or settings.MAILING_LEASE_SECONDS
+    return MailingRecipient.objects.filter(
+        mailing_id=mailing_id,
+        status=MailingRecipient.PENDING,
+        leased_by=worker_id
+    ).update(lease_expires_at=timezone.now() + timedelta(seconds=lease_seconds))
+
+
+def release_recipients(mailing, worker_id):
+    """
+    Снимает аренду с необработанных получателей воркера, чтобы их сразу подхватили другие
+    """
+    return MailingRecipient.objects.filter(
+        mailing=mailing,
+        status=MailingRecipient.PENDING,
+        leased_by=worker_id
+    ).update(leased_by='', lease_expires_at=None)
+
+
+def advance_checkpoint(mailing_id):
+    """
+    Сдвигает контрольную точку к последнему клиенту, до которого включительно
+    все получатели обработаны. Вызывается после сохранения исходов отправки.
+    """
+    ledger = MailingRecipient.objects.filter(mailing_id=mailing_id)
+    first_pending = ledger.filter(status=MailingRecipient.PENDING).aggregate(Min('client_id'))['client_id__min']
+    if first_pending is not None:
+        checkpoint = first_pending - 1
+    else:
+        checkpoint = ledger.order_by('-client_id').values_list('client_id', flat=True).first() or 0
+    Mailing.objects.filter(id=mailing_id, checkpoint__lt=checkpoint).update(checkpoint=checkpoint)
+    return checkpoint
@@ -0,0 +1,266 @@
+import base64
+import re
+import threading
+from collections import OrderedDict
+from email.message import Message
+from email.policy import compat32
+from email.utils import formatdate, make_msgid
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.core.mail.message import RFC5322_EMAIL_LINE_LENGTH_LIMIT, SafeMIMEText, forbid_multi_line_headers
+from django.core.mail.message import sanitize_address
+from django.core.mail.utils import DNS_NAME
+from mailing.dkim import MessageSigner, body_hash, parse_headers
+from mailing.personalization import Template, recipient_values
+
+_HEADER_POLICY = compat32.clone(linesep='\r\n')
+# ASCII тема такой длины помещается в строку заголовка без переноса
+_ASCII_SUBJECT_LENGTH = 78 - len('Subject: ')
+_NEWLINE = re.compile(r'\r\n|\r|\n')
+# Разрывы строк, которые str.splitlines видит, а почтовый генератор нет
+_OTHER_BREAKS = re.compile('[\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]')
+
+
+class RenderedMessage:
+    """
+    Готовое письмо в байтах с интерфейсом, который ждут почтовые бэкенды Django
+    """
+
+    def __init__(self, data):
+        self._data = data
+
+    def as_bytes(self, unixfrom=False, linesep='\n'):
+        if linesep == '\r\n':
+            return self._data
+        return self._data.replace(b'\r\n', linesep.encode())
+
+    def as_string(self, unixfrom=False, linesep='\n'):
+        return self.as_bytes(linesep=linesep).decode()
+
+    def get_charset(self):
+        return None
+
+
+class PreparedMessage:
+    """
+    Письмо, собранное и закодированное один раз: заголовки Subject/From/MIME
+    и тело хранятся в байтах, для каждого получателя дописываются только
+    To, Date и Message-ID. Если для домена отправителя настроен DKIM,
+    письмо подписывается (signer), хеш тела считается один раз.
+    Тема и текст с полями клиента ({{ full_name }}) разбираются в планы
+    подстановки (mailing.personalization), отрисовываются пачками
+    в personalize, остальные заголовки берутся готовыми.
+    """
+
+    def __init__(self, subject, body, from_email, version=None):
+        self.subject = subject
+        self.body = body
+        self.from_email = from_email
+        self.version = version
+        self.subject_template = Template(subject)
+        self.body_template = Template(body)
+
+        message = EmailMessage(subject=subject, body=body, from_email=from_email, to=[from_email]).message()
+        for header in ('To', 'Date', 'Message-ID'):
+            del message[header]
+        self.static = message.as_bytes(linesep='\r\n')
+        static_headers, separator, body = self.static.partition(b'\r\n\r\n')
+        self.static_body = body
+        self.headers = [(name.strip().lower(), name + b':' + value + b'\r\n') for name, value in parse_headers(static_headers)]
+        self.signer = MessageSigner.for_message(from_email, static_headers, body)
+
+    @property
+    def personalized(self):
+        return not (self.subject_template.is_static and self.body_template.is_static)
+
+    def recipient_headers(self, email):
+        headers = (
+            f"To: {sanitize_address(email, settings.DEFAULT_CHARSET)}\r\n"
+            f"Date: {formatdate(localtime=settings.EMAIL_USE_LOCALTIME)}\r\n"
+            f"Message-ID: {make_msgid(domain=DNS_NAME)}\r\n"
+        )
+        return headers.encode()
+
+    def part(self, email):
+        """
+        Неизменная для получателя часть письма: (байты после его заголовков,
+        замененные заголовки для DKIM, хеш тела для DKIM или None - общий)
+        """
+        return self.static, b'', None
+
+    def render_part(self, values):
+        """Часть письма (см. part) с темой и текстом, отрисованными для значений полей values"""
+        overrides = {}
+        if not self.subject_template.is_static:
+            # Перевод строки в значении поля сделал бы из темы несколько заголовков
+            subject = self.subject_template.render({
+                name: ' '.join(value.splitlines()) for name, value in values.items()
+            })
+            overrides[b'subject'] = encode_subject(subject)
+        if self.body_template.is_static:
+            body = self.static_body
+        else:
+            encoding, body = encode_body(self.body_template.render(values))
+            overrides[b'content-transfer-encoding'] = f"Content-Transfer-Encoding: {encoding}\r\n".encode()
+        tail = b''.join(overrides.get(name, line) for name, line in self.headers) + b'\r\n' + body
+        signed = b''.join(overrides.values())
+        if self.signer is None or self.body_template.is_static:
+            return tail, signed, None
+        return tail, signed, body_hash(body)
+
+    def personalize(self, recipients):
+        """
+        Письмо для пачки получателей (id клиента, email, ФИО): без полей
+        в теме и тексте - само собранное письмо, иначе PersonalizedMessage
+        """
+        if not self.personalized:
+            return self
+        return PersonalizedMessage(self, recipients)
+
+    def render(self, email, part=None):
+        tail, signed, hashed_body = part or self.part(email)
+        headers = self.recipient_headers(email)
+        if self.signer is not None:
+            headers = self.signer.signature_header(headers + signed, hashed_body) + headers
+        return headers + tail
+
+    def email_for(self, email):
+        return PreparedEmail(self, email)
+
+
+class PersonalizedMessage:
+    """
+    Письмо с полями клиента, отрисованное для пачки получателей.
+    Тема и текст отрисовываются один раз на каждый набор значений полей
+    (у тезок с полем full_name письмо общее), заголовки MIME и From
+    берутся из PreparedMessage без изменений.
+    """
+
+    def __init__(self, prepared, recipients):
+        self.prepared = prepared
+        self.subject = prepared.subject
+        self.body = prepared.body
+        self.from_email = prepared.from_email
+        self.parts = {}
+
+        fields = sorted(set(prepared.subject_template.fields) | set(prepared.body_template.fields))
+        rendered = {}
+        for client_id, email, full_name in recipients:
+            values = recipient_values(email, full_name)
+            key = tuple(values[name] for name in fields)
+            part = rendered.get(key)
+            if part is None:
+                part = rendered[key] = prepared.render_part(values)
+            self.parts[email] = part
+
+    def part(self, email):
+        part = self.parts.get(email)
+        if part is None:
+            # Адрес не из пачки: поля, кроме email, остаются пустыми
+            part = self.parts[email] = self.prepared.render_part(recipient_values(email, ''))
+        return part
+
+    def personalize(self, recipients):
+        return self
+
+    def render(self, email):
+        return self.prepared.render(email, self.part(email))
+
+    def email_for(self, email):
+        return PreparedEmail(self, email)
+
+
+def encode_subject(subject):
+    """
+    Заголовок Subject в байтах. Тема не в ASCII кодируется словами base64
+    (RFC 2047) по 45 байт без разрыва символов, без сборки объекта Header.
+    Длинную ASCII тему и другие кодировки переносит пакет email, как у Django.
+    """
+    if subject.isascii() and len(subject) <= _ASCII_SUBJECT_LENGTH and ' ' * 2 not in subject:
+        return f"Subject: {subject}\r\n".encode()
+    if subject.isascii() or settings.DEFAULT_CHARSET.lower() != 'utf-8':
+        name, value = forbid_multi_line_headers('Subject', subject, settings.DEFAULT_CHARSET)
+        message = Message()
+        message['Subject'] = value
+        return message.as_bytes(policy=_HEADER_POLICY)[:-2]
+
+    data = subject.encode()
+    words = []
+    start = 0
+    while start < len(data):
+        end = min(start + 45, len(data))
+        # Не режем многобайтовый символ UTF-8
+        while end < len(data) and data[end] & 0xc0 == 0x80:
+            end -= 1
+        words.append(b'=?utf-8?b?' + base64.b64encode(data[start:end]) + b'?=')
+        start = end
+    return b'Subject: ' + b'\r\n '.join(words) + b'\r\n'
+
+
+def encode_body(text):
+    """
+    Текст письма в байтах с CRLF и его Content-Transfer-Encoding так же, как
+    их выбирает Django: 7bit или 8bit без кодирования, quoted-printable при строках
+    длиннее 998 байт. Обычный текст в UTF-8 кодируется без сборки MIME объекта.
+    """
+    lines = _NEWLINE.split(text)
+    encoded = [line.encode() for line in lines] if settings.DEFAULT_CHARSET.lower() == 'utf-8' else None
+    if (
+        encoded is None
+        or _OTHER_BREAKS.search(text)
+        or any(len(line) > RFC5322_EMAIL_LINE_LENGTH_LIMIT for line in encoded)
+    ):
+        message = SafeMIMEText(text, 'plain', settings.DEFAULT_CHARSET)
+        return message['Content-Transfer-Encoding'], message.as_bytes(linesep='\r\n').partition(b'\r\n\r\n')[2]
+    return '7bit' if text.isascii() else '8bit', b'\r\n'.join(encoded)
+
+
+class PreparedEmail(EmailMessage):
+    """
+    EmailMessage для одного получателя, который отдает бэкенду заранее собранные байты
+    """
+
+    def __init__(self, prepared, email):
+        super().__init__(
+            subject=prepared.subject,
+            body=prepared.body,
+            from_email=prepared.from_email,
+            to=[email]
+        )
+        self.prepared = prepared
+
+    def message(self, *args, **kwargs):
+        return RenderedMessage(self.prepared.render(self.to[0]))
+
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_prepared_message(message, from_email=None):
+    """
+    Возвращает собранное письмо для Message из кеша процесса.
+    Версия - дата изменения сообщения, поэтому после редактирования
+    письмо собирается заново даже в процессах, не получивших сигнал.
+    """
+    from_email = from_email or settings.DEFAULT_FROM_EMAIL
+    key = (message.pk, from_email)
+
+    with _lock:
+        prepared = _cache.get(key)
+        if prepared is not None and prepared.version == message.updated_at:
+            _cache.move_to_end(key)
+            return prepared
+
+    prepared = PreparedMessage(message.subject, message.body, from_email, version=message.updated_at)
+    with _lock:
+        _cache[key] = prepared
+        while len(_cache) > settings.MAILING_MESSAGE_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return prepared
+
+
+def invalidate_message(message_id):
+    with _lock:
+        for key in [key for key in _cache if key[0] == message_id]:
+            del _cache[key]
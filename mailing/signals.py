@@ -0,0 +1,85 @@
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+from mailing.caching import bump_owner_versions
+from mailing.dedup import email_key
+from mailing.models import Client, Mailing, MailingLog, MailingRecipient, Message
+from mailing.rendering import invalidate_message
+from mailing import statistics
+from mailing.timeline import notify_schedule_changed
+
+
+@receiver(post_save, sender=Mailing)
+@receiver(post_delete, sender=Mailing)
+def mailing_changed(sender, instance, **kwargs):
+    notify_schedule_changed(instance.id)
+    bump_owner_versions(instance.owner_id)
+
+
+@receiver(pre_save, sender=Mailing)
+def remember_mailing_status(sender, instance, raw=False, **kwargs):
+    # Статус до сохранения нужен, чтобы перенести рассылку между счетчиками статистики
+    if raw or instance._state.adding:
+        instance._saved_status = None
+    else:
+        instance._saved_status = Mailing.objects.filter(pk=instance.pk).values_list('owner_id', 'status').first()
+
+
+@receiver(post_save, sender=Mailing)
+def count_mailing_status(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    statistics.mailing_status_changed(
+        getattr(instance, '_saved_status', None),
+        (instance.owner_id, instance.status)
+    )
+    instance._saved_status = (instance.owner_id, instance.status)
+
+
+@receiver(pre_delete, sender=Mailing)
+def uncount_mailing(sender, instance, **kwargs):
+    statistics.mailing_attempts_deleted(instance)
+    statistics.mailing_status_changed((instance.owner_id, instance.status), None)
+
+
+@receiver(post_save, sender=MailingLog)
+def count_mailing_log(sender, instance, created, raw=False, **kwargs):
+    # bulk_create сигналов не шлет - MailingLogWriter учитывает свои логи сам
+    if created and not raw:
+        statistics.record_attempts([(instance.mailing.owner_id, instance.status)])
+
+
+@receiver(m2m_changed, sender=Mailing.clients.through)
+def mailing_clients_changed(sender, instance, action, reverse, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        # Изменили рассылки клиента - уведомляем о каждой затронутой рассылке
+        mailing_ids = kwargs['pk_set'] or ()
+        for mailing_id in mailing_ids:
+            notify_schedule_changed(mailing_id)
+        bump_owner_versions(*Mailing.objects.filter(id__in=mailing_ids).values_list('owner_id', flat=True))
+    else:
+        notify_schedule_changed(instance.id)
+        bump_owner_versions(instance.owner_id)
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def message_changed(sender, instance, **kwargs):
+    invalidate_message(instance.id)
+    bump_owner_versions(instance.owner_id)
+
+
+@receiver(post_save, sender=Client)
+@receiver(post_delete, sender=Client)
+def client_changed(sender, instance, **kwargs):
+    bump_owner_versions(instance.owner_id)
+
+
+@receiver(post_save, sender=Client)
+def update_recipient_email_key(sender, instance, created, raw=False, **kwargs):
+    # Адрес мог измениться - ключ ожидающих получателей должен совпадать с тем, куда уйдет письмо
+    if not created and not raw:
+        MailingRecipient.objects.filter(client=instance, status=MailingRecipient.PENDING).update(
+            email_key=email_key(instance.email)
+        )
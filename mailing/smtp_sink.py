@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class SMTPSink:
+    """
+    Локальный SMTP сервер, который принимает и отбрасывает письма.
+    Запускается в отдельном потоке со своим event loop, нужен для проверки
+    и замеров скорости доставки без настоящего SMTP сервера:
+
+        with SMTPSink() as sink:
+            settings.EMAIL_HOST, settings.EMAIL_PORT = sink.host, sink.port
+            ...
+            sink.messages  # сколько писем принято
+
+    latency - искусственная задержка ответа на DATA (секунды), имитирует удаленный сервер.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.messages = 0
+        self.recipients = 0
+        self.connections = 0
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='smtp-sink', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, self.host, self.port, limit=2 ** 24)
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._loop.close()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        writer.write(b'220 sink ESMTP\r\n')
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line[:4].upper()
+                if command in (b'EHLO', b'HELO'):
+                    writer.write(b'250-sink\r\n250-PIPELINING\r\n250-8BITMIME\r\n250 AUTH PLAIN LOGIN\r\n')
+                elif command == b'AUTH':
+                    if line.split()[1].upper() == b'LOGIN':
+                        # Логин и пароль приходят отдельными строками
+                        for _ in range(2):
+                            writer.write(b'334 \r\n')
+                            await reader.readline()
+                    writer.write(b'235 Authentication successful\r\n')
+                elif command == b'RCPT':
+                    self.recipients += 1
+                    writer.write(b'250 OK\r\n')
+                elif command == b'DATA':
+                    writer.write(b'354 End data with <CR><LF>.<CR><LF>\r\n')
+                    await writer.drain()
+                    await reader.readuntil(b'\r\n.\r\n')
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    self.messages += 1
+                    writer.write(b'250 OK queued\r\n')
+                elif command == b'QUIT':
+                    writer.write(b'221 Bye\r\n')
+                    await writer.drain()
+                    break
+                else:
+                    # MAIL, RSET, NOOP и прочее просто подтверждаем
+                    writer.write(b'250 OK\r\n')
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
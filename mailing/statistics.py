@@ -0,0 +1,197 @@
+import logging
+from collections import defaultdict
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.conf import settings
+from mailing.caching import get_or_compute, owner_key, global_key, bump_owner_versions
+from mailing.models import Client, Mailing, MailingLog, MailingStatistics, Message
+
+logger = logging.getLogger(__name__)
+
+STATUS_FIELDS = {
+    Mailing.CREATED: 'created_mailings',
+    Mailing.STARTED: 'started_mailings',
+    Mailing.COMPLETED: 'completed_mailings',
+}
+
+ATTEMPT_FIELDS = {
+    MailingLog.SUCCESS: 'success_attempts',
+    MailingLog.FAILURE: 'failure_attempts',
+}
+
+
+def site_counters():
+    """
+    Общие счетчики для главной страницы и статистики
+    """
+    def compute_mailings():
+        overall = MailingStatistics.objects.filter(owner__isnull=True).first() or MailingStatistics()
+        return {
+            'total_mailings': overall.total_mailings,
+            'active_mailings': overall.started_mailings,
+        }
+
+    def compute_unique_clients():
+        return Client.objects.values('email').distinct().count()
+
+    return {
+        **get_or_compute(global_key('statistics:site'), compute_mailings, timeout=settings.CACHE_VERSIONED_TTL),
+        # DISTINCT по всем клиентам - самый дорогой запрос, кешируем надолго
+        'unique_clients': get_or_compute('statistics:unique_clients', compute_unique_clients, timeout=60 * 60),
+    }
+
+
+def owner_counters(user):
+    """
+    Счетчики рассылок и попыток отправки пользователя
+    """
+    def compute():
+        own = MailingStatistics.objects.filter(owner=user).first() or MailingStatistics()
+        return {
+            'total_mailings': own.total_mailings,
+            'active_mailings': own.started_mailings,
+            'success_attempts': own.success_attempts,
+            'failure_attempts': own.failure_attempts,
+        }
+
+    # Статусы рассылок обновляют версию владельца, попытки отправки - только срок жизни
+    return get_or_compute(owner_key('statistics', user.id), compute, timeout=60)
+
+
+def popular_messages(user, limit=5):
+    """
+    Сообщения пользователя, которые чаще всего используются в рассылках
+    """
+    def compute():
+        return list(
+            Message.objects.filter(owner=user).annotate(
+                mailing_count=Count('mailing')
+            ).order_by('-mailing_count').values('id', 'subject', 'mailing_count')[:limit]
+        )
+
+    return get_or_compute(
+        owner_key(f'popular_messages:{limit}', user.id),
+        compute,
+        timeout=settings.CACHE_VERSIONED_TTL
+    )
+
+
+def apply_deltas(deltas):
+    """
+    Прибавляет к счетчикам изменения вида {id владельца: {поле: приращение}},
+    общая строка получает их сумму. Обновление идет через F-выражения,
+    поэтому одновременные изменения из разных процессов не теряются.
+    """
+    totals = defaultdict(int)
+    for fields in deltas.values():
+        for field, delta in fields.items():
+            totals[field] += delta
+
+    for owner_id, fields in [*deltas.items(), (None, totals)]:
+        fields = {field: delta for field, delta in fields.items() if delta}
+        if fields:
+            _apply(owner_id, fields)
+
+
+def _apply(owner_id, fields):
+    if owner_id is None:
+        rows = MailingStatistics.objects.filter(owner__isnull=True)
+    else:
+        rows = MailingStatistics.objects.filter(owner_id=owner_id)
+    changes = {field: F(field) + delta for field, delta in fields.items()}
+    if rows.update(**changes):
+        return
+    # Строки еще нет - это первые данные владельца. Уменьшать нечего:
+    # при удалении владельца его строка удаляется каскадом раньше
+    if any(delta < 0 for delta in fields.values()):
+        return
+    try:
+        with transaction.atomic():
+            MailingStatistics.objects.create(owner_id=owner_id, **fields)
+    except IntegrityError:
+        # Строку успел создать другой процесс
+        rows.update(**changes)
+
+
+def mailing_status_changed(old, new):
+    """
+    Учитывает сохранение рассылки. old и new - пары (id владельца, статус),
+    None для созданной или удаленной рассылки.
+    """
+    if old == new:
+        return
+    deltas = defaultdict(lambda: defaultdict(int))
+    if old is not None:
+        deltas[old[0]][STATUS_FIELDS[old[1]]] -= 1
+    if new is not None:
+        deltas[new[0]][STATUS_FIELDS[new[1]]] += 1
+    apply_deltas(deltas)
+
+
+def update_mailing_status(queryset, status):
+    """
+    Массово меняет статус рассылок queryset (без сигналов save) с учетом в статистике.
+    Возвращает количество измененных рассылок.
+    """
+    with transaction.atomic():
+        rows = list(queryset.exclude(status=status).select_for_update().values_list('id', 'owner_id', 'status'))
+        if not rows:
+            return 0
+        updated = Mailing.objects.filter(id__in=[row[0] for row in rows]).update(status=status)
+
+        deltas = defaultdict(lambda: defaultdict(int))
+        for mailing_id, owner_id, old_status in rows:
+            deltas[owner_id][STATUS_FIELDS[old_status]] -= 1
+            deltas[owner_id][STATUS_FIELDS[status]] += 1
+        apply_deltas(deltas)
+        bump_owner_versions(*deltas)
+    return updated
+
+
+def record_attempts(attempts):
+    """
+    Учитывает записанные логи рассылок, attempts - пары (id владельца, статус попытки)
+    """
+    deltas = defaultdict(lambda: defaultdict(int))
+    for owner_id, status in attempts:
+        deltas[owner_id][ATTEMPT_FIELDS[status]] += 1
+    apply_deltas(deltas)
+
+
+def mailing_attempts_deleted(mailing):
+    """
+    Вычитает попытки удаляемой рассылки: логи удаляются каскадом без сигналов
+    """
+    deltas = defaultdict(lambda: defaultdict(int))
+    counts = MailingLog.objects.filter(mailing=mailing).values_list('status').annotate(count=Count('id')).order_by()
+    for status, count in counts:
+        deltas[mailing.owner_id][ATTEMPT_FIELDS[status]] -= count
+    apply_deltas(deltas)
+
+
+def rebuild_statistics():
+    """
+    Полностью пересчитывает статистику по рассылкам и логам.
+    Возвращает количество строк владельцев.
+    """
+    rows = defaultdict(lambda: defaultdict(int))
+    mailings = Mailing.objects.values_list('owner_id', 'status').annotate(count=Count('id')).order_by()
+    for owner_id, status, count in mailings:
+        rows[owner_id][STATUS_FIELDS[status]] += count
+    logs = MailingLog.objects.values_list('mailing__owner_id', 'status').annotate(count=Count('id')).order_by()
+    for owner_id, status, count in logs:
+        rows[owner_id][ATTEMPT_FIELDS[status]] += count
+
+    totals = defaultdict(int)
+    for fields in rows.values():
+        for field, count in fields.items():
+            totals[field] += count
+
+    with transaction.atomic():
+        MailingStatistics.objects.all().delete()
+        MailingStatistics.objects.bulk_create(
+            [MailingStatistics(owner_id=owner_id, **fields) for owner_id, fields in rows.items()]
+            + [MailingStatistics(owner=None, **totals)]
+        )
+    logger.info(f"Статистика рассылок пересчитана, владельцев: {len(rows)}")
+    return len(rows)
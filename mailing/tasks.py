@@ -1,23 +1,44 @@
 import logging
+import time
 from datetime import datetime
 from django.conf import settings
-from django.core.mail import send_mail, get_connection
-from django.db import transaction
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
 from django.utils import timezone
-from apscheduler.schedulers.blocking import BlockingScheduler
+from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 from django_apscheduler.jobstores import DjangoJobStore
 from django_apscheduler.models import DjangoJobExecution
+from mailing import metrics
+from mailing.dedup import LedgerDeduplicator
+from mailing.delivery import deliver
+from mailing.logwriter import MailingLogWriter
 from mailing.models import Mailing, MailingLog
+from mailing.rendering import get_prepared_message
+from mailing.statistics import update_mailing_status
+from mailing.recipients import (
+    sync_recipients,
+    pending_recipients,
+    iter_pending_recipients,
+    iter_claimed_recipients,
+    release_recipients,
+    default_worker_id,
+)
+from mailing.throttle import reply_code
+from mailing.timeline import MailingTimeline, ScheduleListener, START
 
 logger = logging.getLogger(__name__)
 
-def send_mailing(mailing_id):
+def send_mailing(mailing_id, mode=None, workers=None, worker_id=None):
     """
-    Отправляет рассылку и обрабатывает все возможные ошибки
+    Отправляет рассылку и обрабатывает все возможные ошибки.
+    mode и workers выбирают режим доставки (см. mailing.delivery),
+    по умолчанию берутся из настроек MAILING_DELIVERY_*.
+    Если передан worker_id, получатели берутся в аренду пачками, и одну рассылку
+    могут параллельно отправлять несколько процессов-воркеров
     """
     try:
-        mailing = Mailing.objects.get(id=mailing_id)
+        mailing = Mailing.objects.select_related('message').get(id=mailing_id)
         logger.info(f"Начата обработка рассылки ID {mailing.id}")
     except Mailing.DoesNotExist:
         logger.error(f"Рассылка ID {mailing_id} не найдена")
@@ -32,10 +53,19 @@ def send_mailing(mailing_id):
         )
         return
 
+    # Журнал получателей: после перезапуска отправляем только тем, кто еще ожидает
+    sync_recipients(mailing)
+    pending = pending_recipients(mailing)
+    pending_count = pending.count()
+    if not pending_count:
+        logger.debug(f"Рассылка ID {mailing.id}: нет получателей, ожидающих отправки")
+        return
+
     try:
-        # Проверка доступности SMTP сервера
+        # Проверка доступности SMTP сервера, в последовательном режиме соединение используется для отправки
         conn = get_connection()
-        conn.open()
+        with metrics.smtp_connect():
+            conn.open()
         logger.debug("SMTP сервер доступен")
     except Exception as e:
         error_msg = f"Ошибка подключения к SMTP: {str(e)}"
@@ -43,53 +73,65 @@ def send_mailing(mailing_id):
         MailingLog.objects.create(
             mailing=mailing,
             status=MailingLog.FAILURE,
+            smtp_code=reply_code(e),
             server_response=error_msg
         )
         return
 
-    # Отправка писем в транзакции
+    # Отправка писем, логи попыток сохраняются пачками
     try:
-        with transaction.atomic():
-            success_count = 0
-            clients_count = mailing.clients.count()
-
-            for client in mailing.clients.all():
-                try:
-                    send_mail(
-                        subject=mailing.message.subject,
-                        message=mailing.message.body,
-                        from_email=settings.DEFAULT_FROM_EMAIL,
-                        recipient_list=[client.email],
-                        fail_silently=False,
-                        connection=conn
-                    )
-                    MailingLog.objects.create(
-                        mailing=mailing,
-                        status=MailingLog.SUCCESS,
-                        server_response="Успешно отправлено"
-                    )
-                    success_count += 1
-                    logger.debug(f"Письмо клиенту {client.email} отправлено")
-
-                except Exception as e:
-                    error_msg = f"Ошибка отправки для {client.email}: {str(e)}"
-                    logger.warning(error_msg)
-                    MailingLog.objects.create(
-                        mailing=mailing,
-                        status=MailingLog.FAILURE,
-                        server_response=error_msg
+        with MailingLogWriter(worker_id=worker_id) as log_writer:
+            # Письмо собирается один раз и переиспользуется для всех получателей
+            prepared = get_prepared_message(mailing.message)
+
+            def write_logs(result):
+                for client_id, email, success, response, code in result['outcomes']:
+                    log_writer.add(
+                        mailing,
+                        MailingLog.SUCCESS if success else MailingLog.FAILURE,
+                        response,
+                        client_id=client_id,
+                        smtp_code=code
                     )
 
-            # Обновление статуса если это последняя рассылка
-            if timezone.now() >= mailing.end_time:
-                mailing.status = Mailing.COMPLETED
-                mailing.save()
-                logger.info(f"Рассылка ID {mailing.id} автоматически завершена")
+            if worker_id:
+                recipients = iter_claimed_recipients(mailing, worker_id)
+            else:
+                recipients = iter_pending_recipients(mailing)
 
-            logger.info(
-                f"Рассылка ID {mailing.id} завершена. "
-                f"Успешно: {success_count}/{clients_count}"
+            # Один адрес может принадлежать нескольким клиентам - отправляем ему одно письмо,
+            # в том числе когда клиенты достались разным воркерам
+            deduplicator = LedgerDeduplicator(mailing)
+            recipients = deduplicator.filter(recipients)
+
+            report = deliver(
+                prepared,
+                recipients,
+                mode=mode,
+                workers=workers,
+                connection=conn,
+                on_result=write_logs
             )
+            report.duplicates = deduplicator.skipped
+            report.log(mailing.id)
+            metrics.RECIPIENTS.inc(report.duplicates, status='skipped')
+
+        # Обновление статуса если это последняя рассылка
+        if timezone.now() >= mailing.end_time:
+            mailing.status = Mailing.COMPLETED
+            mailing.save()
+            logger.info(f"Рассылка ID {mailing.id} автоматически завершена")
+
+        if worker_id:
+            # Получатели берутся в аренду по ходу отправки - считаем только доставшихся этому воркеру
+            handled = f"{report.total + report.duplicates} (воркер {worker_id})"
+        else:
+            handled = pending_count
+        logger.info(
+            f"Рассылка ID {mailing.id} завершена. "
+            f"Успешно: {report.success_count}/{handled}, "
+            f"пропущено дубликатов: {report.duplicates}"
+        )
 
     except Exception as e:
         error_msg = f"Критическая ошибка при отправке: {str(e)}"
@@ -99,10 +141,24 @@ def send_mailing(mailing_id):
             status=MailingLog.FAILURE,
             server_response=error_msg
         )
+    finally:
+        conn.close()
+        if worker_id:
+            release_recipients(mailing, worker_id)
+        metrics.push(force=True)
 
-def check_mailings():
+def start_mailing(mailing_id):
     """
-    Проверяет и запускает активные рассылки
+    Задача очереди (mailing.jobs): отправка рассылки сразу после запуска.
+    Получатели берутся в аренду, поэтому параллельная работа с планировщиком
+    и воркерами не приводит к повторным письмам
+    """
+    send_mailing(mailing_id, worker_id=default_worker_id())
+
+def check_mailings(worker_id=None):
+    """
+    Проверяет и запускает активные рассылки.
+    worker_id включает режим совместной работы нескольких воркеров (см. send_mailing)
     """
     now = timezone.now()
     logger.debug(f"Проверка рассылок в {now}")
@@ -116,17 +172,68 @@ def check_mailings():
 
     for mailing in mailings:
         logger.info(f"Запуск рассылки ID {mailing.id}")
-        send_mailing(mailing.id)
+        send_mailing(mailing.id, worker_id=worker_id)
 
     # Помечаем завершенные рассылки
-    completed = Mailing.objects.filter(
-        status=Mailing.STARTED,
-        end_time__lt=now
-    ).update(status=Mailing.COMPLETED)
+    completed = update_mailing_status(
+        Mailing.objects.filter(status=Mailing.STARTED, end_time__lt=now),
+        Mailing.COMPLETED
+    )
 
     if completed:
         logger.info(f"Автоматически завершено рассылок: {completed}")
 
+def complete_mailing(mailing_id):
+    """
+    Завершает рассылку, у которой наступило время окончания
+    """
+    completed = update_mailing_status(
+        Mailing.objects.filter(id=mailing_id, status=Mailing.STARTED, end_time__lte=timezone.now()),
+        Mailing.COMPLETED
+    )
+
+    if completed:
+        logger.info(f"Рассылка ID {mailing_id} автоматически завершена")
+
+def run_timeline(worker_id=None, timeline=None, listener=None):
+    """
+    Событийный цикл планировщика: спит до ближайшего начала или окончания
+    рассылки либо до уведомления об изменении рассылки, без периодического опроса БД.
+    Раз в MAILING_SCHEDULER_RESYNC_SECONDS очередь полностью перечитывается на случай
+    потерянных уведомлений
+    """
+    timeline = timeline or MailingTimeline()
+    listener = listener or ScheduleListener()
+    resync = settings.MAILING_SCHEDULER_RESYNC_SECONDS
+
+    timeline.load()
+    loaded_at = time.monotonic()
+    try:
+        while True:
+            timeout = timeline.seconds_until_next()
+            timeout = resync if timeout is None else min(timeout, resync)
+
+            changed = listener.wait(timeout)
+
+            with metrics.SCHEDULER_TICK.time():
+                for mailing_id in changed:
+                    logger.debug(f"Рассылка ID {mailing_id} изменена, обновляем расписание")
+                    timeline.refresh(mailing_id)
+
+                if time.monotonic() - loaded_at >= resync:
+                    timeline.load()
+                    loaded_at = time.monotonic()
+
+                for mailing_id, kind in timeline.pop_due():
+                    if kind == START:
+                        logger.info(f"Запуск рассылки ID {mailing_id}")
+                        send_mailing(mailing_id, worker_id=worker_id)
+                    else:
+                        complete_mailing(mailing_id)
+            metrics.push()
+    finally:
+        listener.close()
+
 def delete_old_job_executions(max_age=604_800):
     """
     Удаляет старые записи выполнения задач (по умолчанию старше 7 дней)
@@ -134,22 +241,12 @@ def delete_old_job_executions(max_age=604_800):
     DjangoJobExecution.objects.delete_old_job_executions(max_age)
 
 class Command(BaseCommand):
-    help = "Запускает APScheduler для обработки рассылок"
+    help = "Запускает планировщик рассылок"
 
     def handle(self, *args, **options):
-        scheduler = BlockingScheduler(timezone=settings.TIME_ZONE)
+        scheduler = BackgroundScheduler(timezone=settings.TIME_ZONE)
         scheduler.add_jobstore(DjangoJobStore(), "default")
 
-        # Проверка рассылок каждые 30 секунд
-        scheduler.add_job(
-            check_mailings,
-            trigger=CronTrigger(second="*/30"),
-            id="check_mailings",
-            max_instances=1,
-            replace_existing=True,
-        )
-        logger.info("Добавлена задача 'check_mailings' (каждые 30 секунд)")
-
         # Очистка старых логов каждую неделю
         scheduler.add_job(
             delete_old_job_executions,
@@ -163,6 +260,8 @@ class Command(BaseCommand):
         try:
             logger.info("Запуск scheduler...")
             scheduler.start()
+            # Рассылки запускаются по событиям, аренда получателей позволяет держать несколько планировщиков
+            run_timeline(worker_id=default_worker_id())
         except KeyboardInterrupt:
             logger.info("Остановка scheduler...")
             scheduler.shutdown()
@@ -0,0 +1,1027 @@
+import asyncio
+import base64
+import csv
+import email
+import hashlib
+import io
+import json
+import re
+import shutil
+import smtplib
+import tempfile
+import time
+from datetime import timedelta
+from email import policy
+from pathlib import Path
+from unittest import mock
+import fakeredis
+import redis
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from django.core import mail
+from django.core.management import call_command
+from django.core.mail.backends import locmem
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from mailing import benchmark, dkim, jobs, metrics, statistics
+from mailing.async_delivery import AsyncSMTPSession
+from mailing.dedup import LedgerDeduplicator
+from mailing.forms import MessageForm
+from mailing.imports import ImportReport, import_clients
+from mailing.logwriter import MailingLogWriter
+from mailing.management.commands.benchmark_delivery import scale
+from mailing.models import (
+    Client, Mailing, MailingLog, MailingRecipient, MailingResponse, MailingStatistics, Message
+)
+from mailing.pagination import decode_cursor, keyset_paginate
+from mailing.personalization import Template, unknown_fields
+from mailing.querybudget import query_budget
+from mailing.recipients import claim_recipients, release_recipients, sync_recipients
+from mailing.rendering import PreparedMessage
+from mailing.smtp_sink import SMTPSink
+from mailing.tasks import send_mailing
+from mailing.throttle import AIMDLimiter, reply_text
+from users.models import User
+
+
+def create_mailing(owner, clients=0, subject='Тема', body='Текст', status=Mailing.CREATED):
+    """Рассылка владельца owner на clients новых клиентов"""
+    now = timezone.now()
+    message = Message.objects.create(subject=subject, body=body, owner=owner)
+    mailing = Mailing.objects.create(
+        start_time=now - timedelta(hours=1),
+        end_time=now + timedelta(hours=1),
+        status=status,
+        message=message,
+        owner=owner
+    )
+    start = Client.objects.count()
+    mailing.clients.set(Client.objects.bulk_create([
+        Client(email=f'client{number}@test.ru', full_name=f'Клиент {number}', owner=owner)
+        for number in range(start, start + clients)
+    ]))
+    return mailing
+
+
+def verify_dkim(data, public_key):
+    """
+    Проверка подписи DKIM-Signature письма data открытым ключом.
+    Возвращает теги подписи; при неверной подписи или хеше тела - исключение.
+    """
+    head, separator, body = data.partition(b'\r\n\r\n')
+    headers = dkim.parse_headers(head)
+    name, value = next((name, value) for name, value in headers if name.lower() == b'dkim-signature')
+    tags = dict(
+        tag.strip().split(b'=', 1) for tag in re.sub(rb'\s+', b'', value).split(b';') if tag.strip()
+    )
+    assert tags[b'bh'] == base64.b64encode(hashlib.sha256(dkim.canonicalize_body(body)).digest()), 'bh'
+
+    canonical = {}
+    for header_name, header_value in headers:
+        canonical[header_name.strip().lower()] = dkim.canonicalize_header(header_name, header_value)
+    data = b''.join(canonical[header_name] for header_name in tags[b'h'].split(b':'))
+    # Значение b= при проверке считается пустым
+    unsigned = re.sub(rb'(;\s*b=)[^;]*$', rb'\1', value)
+    data += dkim.canonicalize_header(name, unsigned)[:-2]
+    public_key.verify(base64.b64decode(tags[b'b']), data, padding.PKCS1v15(), hashes.SHA256())
+    return tags
+
+
+class DKIMCanonicalizationTests(SimpleTestCase):
+    """Примеры каноникализации relaxed из RFC 6376, 3.4.5"""
+
+    def test_relaxed_header(self):
+        headers = dkim.parse_headers(b'A: X\r\nB : Y\t\r\n\tZ  \r\n')
+        self.assertEqual(
+            b''.join(dkim.canonicalize_header(name, value) for name, value in headers),
+            b'a:X\r\nb:Y Z\r\n'
+        )
+
+    def test_relaxed_body(self):
+        self.assertEqual(dkim.canonicalize_body(b' C \r\nD \t E\r\n\r\n\r\n'), b' C\r\nD E\r\n')
+
+    def test_empty_body(self):
+        self.assertEqual(dkim.canonicalize_body(b''), b'')
+        self.assertEqual(dkim.canonicalize_body(b'\r\n\r\n'), b'')
+
+    def test_parse_headers_keeps_folding(self):
+        self.assertEqual(
+            dkim.parse_headers(b'Subject: a\r\n b\r\nFrom: x@y.z\r\n'),
+            [(b'Subject', b' a\r\n b'), (b'From', b' x@y.z')]
+        )
+
+
+class DKIMSigningTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.mkdtemp()
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        cls.public_key = private_key.public_key()
+        cls.key_file = str(Path(cls.directory) / 'dkim.pem')
+        with open(cls.key_file, 'wb') as f:
+            f.write(private_key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.TraditionalOpenSSL,
+                serialization.NoEncryption()
+            ))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+        super().tearDownClass()
+
+    def dkim_settings(self):
+        return override_settings(
+            MAILING_DKIM_DOMAINS={'example.com': {'selector': 'mail', 'key_file': self.key_file}}
+        )
+
+    def test_unsigned_domain(self):
+        with self.dkim_settings():
+            prepared = PreparedMessage('Тема', 'Текст', 'news@other.com')
+        self.assertIsNone(prepared.signer)
+        self.assertNotIn(b'DKIM-Signature', prepared.render('a@test.ru'))
+
+    def test_inline_signature(self):
+        with self.dkim_settings():
+            prepared = PreparedMessage('Тема  письма', 'Текст\n\n\n', 'Отдел <news@Example.com>')
+            tags = verify_dkim(prepared.render('Иван <ivan@test.ru>'), self.public_key)
+        self.assertEqual(tags[b'd'], b'example.com')
+        self.assertEqual(tags[b's'], b'mail')
+        self.assertIn(b'to', tags[b'h'].split(b':'))
+
+    def test_personalized_signature(self):
+        with self.dkim_settings():
+            prepared = PreparedMessage('Для {{ full_name }}', 'Привет, {{ full_name }}!\n', 'news@example.com')
+            recipients = [(1, 'a@test.ru', 'Анна'), (2, 'b@test.ru', 'x' * 1100)]
+            message = prepared.personalize(recipients)
+            for client_id, email, full_name in recipients:
+                verify_dkim(message.render(email), self.public_key)
+
+    def test_signing_pool(self):
+        with self.dkim_settings():
+            prepared = PreparedMessage('Для {{ full_name }}', 'Привет, {{ full_name }}!\n', 'news@example.com')
+            chunks = [
+                [(number, f'client{number}@test.ru', f'Клиент {number}') for number in range(start, start + 5)]
+                for start in range(0, 15, 5)
+            ]
+            with dkim.SigningPool(workers=1) as pool:
+                batches = list(pool.signed_chunks(prepared, iter(chunks)))
+
+        self.assertEqual([chunk for message, chunk in batches], chunks)
+        for message, chunk in batches:
+            self.assertIsInstance(message, dkim.SignedMessage)
+            for client_id, email, full_name in chunk:
+                data = message.email_for(email).message().as_bytes(linesep='\r\n')
+                self.assertEqual(data, message.render(email))
+                self.assertIn(full_name.encode(), data)
+                verify_dkim(data, self.public_key)
+
+
+class FailureResponseTests(TestCase):
+    def test_reply_text_hides_address(self):
+        error = smtplib.SMTPRecipientsRefused({'a@test.ru': (550, b'5.1.1 <a@test.ru>: Recipient address rejected')})
+        self.assertEqual(reply_text(error), "(550, b'5.1.1 <адрес>: Recipient address rejected')")
+
+    def test_failures_share_response(self):
+        owner = User.objects.create_user(email='owner@test.ru', password='secret')
+        mailing = create_mailing(owner, clients=3)
+        MailingRecipient.objects.bulk_create(
+            MailingRecipient(mailing=mailing, client=client) for client in mailing.clients.all()
+        )
+        with MailingLogWriter() as writer:
+            for client in mailing.clients.all():
+                error = smtplib.SMTPRecipientsRefused({client.email: (550, f'5.1.1 <{client.email}>: unknown'.encode())})
+                writer.add(mailing, MailingLog.FAILURE, f"Ошибка отправки: {reply_text(error)}", client.id, 550)
+
+        logs = MailingLog.objects.filter(mailing=mailing)
+        self.assertEqual(logs.values('response').distinct().count(), 1)
+        self.assertEqual(
+            set(logs.values_list('client__email', flat=True)),
+            set(mailing.clients.values_list('email', flat=True))
+        )
+        self.assertEqual(MailingResponse.objects.filter(text__contains='@').count(), 0)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class QueryBudgetTests(TestCase):
+    """
+    Число запросов страниц не должно зависеть от числа строк: рассылок
+    и логов в данных больше, чем один запрос на строку уложился бы в бюджет
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owners = [User.objects.create_user(email=f'owner{number}@test.ru', password='secret') for number in range(3)]
+        cls.manager = User.objects.create_user(email='manager@test.ru', password='secret', is_staff=True)
+        for owner in cls.owners:
+            for number in range(10):
+                create_mailing(owner, clients=3, subject=f'Тема {number}')
+        cls.mailing = Mailing.objects.filter(owner=cls.owners[0]).first()
+        clients = list(cls.mailing.clients.all())
+        with MailingLogWriter(batch_size=1000) as writer:
+            for number in range(150):
+                status = MailingLog.SUCCESS if number % 3 else MailingLog.FAILURE
+                text = "Успешно отправлено" if status == MailingLog.SUCCESS else f"Ошибка отправки: {number % 5}"
+                writer.add(cls.mailing, status, text, clients[number % len(clients)].id)
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, user, url, limit):
+        self.client.force_login(user)
+        with query_budget(limit, strict=True):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_mailing_list(self):
+        response = self.get(self.owners[0], reverse('mailing:mailing_list'), 3)
+        self.assertEqual(len(response.context['object_list']), 10)
+        self.assertContains(response, 'Тема 9')
+
+    def test_mailing_list_staff(self):
+        response = self.get(self.manager, reverse('mailing:mailing_list'), 3)
+        self.assertEqual(len(response.context['object_list']), 30)
+
+    def test_manager_mailing_list(self):
+        response = self.get(self.manager, reverse('mailing:manager_mailing_list'), 3)
+        self.assertEqual(len(response.context['object_list']), 30)
+        self.assertContains(response, 'owner2@test.ru')
+
+    def test_mailing_logs(self):
+        # Сессия, пользователь, рассылка и страница логов с ответами и клиентами
+        response = self.get(self.owners[0], reverse('mailing:mailing_logs', args=[self.mailing.pk]), 4)
+        self.assertEqual(len(response.context['logs']), 100)
+        self.assertContains(response, 'Ошибка отправки: 4')
+        self.assertContains(response, self.mailing.clients.first().email)
+
+    def test_mailing_logs_failures(self):
+        url = reverse('mailing:mailing_logs', args=[self.mailing.pk])
+        response = self.get(self.owners[0], f'{url}?status={MailingLog.FAILURE}', 4)
+        self.assertEqual(len(response.context['logs']), 50)
+
+
+class AIMDLimiterTests(SimpleTestCase):
+    def test_async_waiter_woken_by_release_from_thread(self):
+        limiter = AIMDLimiter(maximum=1)
+
+        async def scenario():
+            await limiter.acquire_async()
+            waiting = asyncio.ensure_future(limiter.acquire_async())
+            await asyncio.sleep(0.01)
+            self.assertFalse(waiting.done())
+            self.assertEqual(len(limiter._waiters), 1)
+            await asyncio.get_running_loop().run_in_executor(None, limiter.release, 0.0)
+            await asyncio.wait_for(waiting, 1)
+
+        asyncio.run(scenario())
+        self.assertEqual(limiter.in_flight, 1)
+
+    def test_window_growth_wakes_waiters(self):
+        limiter = AIMDLimiter(maximum=3, initial=2)
+
+        async def scenario():
+            await limiter.acquire_async()
+            await limiter.acquire_async()
+            waiters = [asyncio.ensure_future(limiter.acquire_async()) for number in range(2)]
+            await asyncio.sleep(0.01)
+            # Быстрая отправка расширяет окно до 2.5, место одно - просыпается один
+            limiter.release(0.0)
+            done, pending = await asyncio.wait(waiters, timeout=0.1)
+            self.assertEqual((len(done), len(pending)), (1, 1))
+            # Еще одна: окно 2.9, занято 2 - просыпается второй
+            limiter.release(0.0)
+            await asyncio.wait_for(asyncio.gather(*pending), 1)
+
+        asyncio.run(scenario())
+        self.assertEqual(limiter.in_flight, 2)
+
+    def test_cancelled_waiter_passes_wakeup(self):
+        limiter = AIMDLimiter(maximum=1)
+
+        async def scenario():
+            await limiter.acquire_async()
+            first = asyncio.ensure_future(limiter.acquire_async())
+            second = asyncio.ensure_future(limiter.acquire_async())
+            await asyncio.sleep(0.01)
+            limiter.release(0.0)
+            # Первую разбудили, но отменили раньше, чем она заняла место
+            first.cancel()
+            await asyncio.wait_for(second, 1)
+            self.assertTrue(first.cancelled())
+
+        asyncio.run(scenario())
+        self.assertEqual(limiter.in_flight, 1)
+        self.assertFalse(limiter._waiters)
+
+
+# Вызовы тестовой задачи: (аргумент, содержимое списка обрабатываемых воркера в момент вызова)
+job_calls = []
+
+
+def record_job(value, processing=None, fail=False, kill=False):
+    job_calls.append((value, jobs.get_backend(jobs.REDIS).client.lrange(processing, 0, -1) if processing else None))
+    if fail:
+        raise RuntimeError('Ошибка задачи')
+    if kill and len(job_calls) == 1:
+        # Процесс воркера завершается посреди первого выполнения задачи
+        raise SystemExit(1)
+
+
+@override_settings(MAILING_METRICS_PUSH_INTERVAL=10)
+class MetricsPushTests(SimpleTestCase):
+    def setUp(self):
+        self.registry = metrics.Registry(key='test:metrics')
+        self.registry._redis = mock.Mock()
+        self.pipeline = self.registry._redis.pipeline.return_value
+
+    def test_backoff_after_redis_error(self):
+        self.pipeline.execute.side_effect = redis.ConnectionError('Connection refused')
+        self.registry.add([('sent_total', 1)])
+        with mock.patch('mailing.metrics.time.monotonic', return_value=1000), self.assertLogs('mailing.metrics', 'WARNING'):
+            self.registry.push(force=True)
+            # Пока идет пауза, отправка не обращается к Redis
+            self.registry.push(force=True)
+            self.registry.push(force=True)
+        self.assertEqual(self.pipeline.execute.call_count, 1)
+
+        # Пауза растет с каждой ошибкой: 10, затем 20 секунд
+        with mock.patch('mailing.metrics.time.monotonic', return_value=1010), self.assertLogs('mailing.metrics', 'WARNING'):
+            self.registry.push(force=True)
+        with mock.patch('mailing.metrics.time.monotonic', return_value=1020):
+            self.registry.push(force=True)
+        self.assertEqual(self.pipeline.execute.call_count, 2)
+
+        # Redis снова доступен: накопленные прибавки уходят целиком, пауза сбрасывается
+        self.pipeline.execute.side_effect = None
+        with mock.patch('mailing.metrics.time.monotonic', return_value=1030):
+            self.registry.push(force=True)
+        self.pipeline.hincrbyfloat.assert_called_with('test:metrics', 'sent_total', 1)
+        self.assertEqual(self.registry._retry_at, 0.0)
+
+
+@mock.patch.dict(jobs.JOBS, {'record': 'mailing.tests.record_job'})
+class JobBackendTests(TestCase):
+    def setUp(self):
+        job_calls.clear()
+        self.backend = jobs.RedisQueueBackend(client=fakeredis.FakeRedis(), queue='test:jobs')
+        patcher = mock.patch.dict(jobs._backends, {jobs.REDIS: self.backend})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_process_by_default(self):
+        self.assertEqual(jobs.get_backend().__class__, jobs.ProcessPoolBackend)
+
+    @override_settings(MAILING_JOB_BACKEND=jobs.INLINE)
+    def test_inline_runs_on_commit(self):
+        self.assertEqual(jobs.get_backend().__class__, jobs.InlineBackend)
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.enqueue('record', 1)
+            self.assertEqual(job_calls, [])
+        self.assertEqual(job_calls, [(1, None)])
+
+    def test_unknown_job(self):
+        with self.assertRaises(ValueError):
+            jobs.enqueue('missing')
+
+    @override_settings(MAILING_JOB_BACKEND=jobs.INLINE)
+    def test_toggle_does_not_send_inline(self):
+        user = User.objects.create_user(email='owner@test.ru', password='secret')
+        mailing = create_mailing(user, clients=1)
+        self.client.force_login(user)
+        with mock.patch.object(jobs, 'enqueue') as enqueue, self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('mailing:toggle_mailing_status', args=[mailing.id]))
+        enqueue.assert_not_called()
+        mailing.refresh_from_db()
+        self.assertEqual(mailing.status, Mailing.STARTED)
+
+    @override_settings(MAILING_JOB_BACKEND=jobs.REDIS)
+    def test_toggle_enqueues_start(self):
+        user = User.objects.create_user(email='owner@test.ru', password='secret')
+        mailing = create_mailing(user, clients=1)
+        self.client.force_login(user)
+        with mock.patch.object(jobs, 'enqueue') as enqueue:
+            self.client.get(reverse('mailing:toggle_mailing_status', args=[mailing.id]))
+        enqueue.assert_called_once_with('start_mailing', mailing.id)
+
+    @override_settings(MAILING_JOB_BACKEND=jobs.REDIS)
+    def test_redis_enqueue_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.enqueue('record', 1, fail=False)
+            self.assertEqual(self.backend.client.llen('test:jobs'), 0)
+        self.assertEqual(self.backend.client.llen('test:jobs'), 1)
+        self.assertEqual(job_calls, [])
+
+    def test_work_once_moves_job_to_processing(self):
+        processing = self.backend.processing_queue('w1')
+        self.backend.enqueue('record', [1], {'processing': processing})
+        self.backend.enqueue('record', [2], {'processing': processing})
+
+        self.assertTrue(self.backend.work_once('w1', timeout=1))
+        self.assertTrue(self.backend.work_once('w1', timeout=1))
+        self.assertFalse(self.backend.work_once('w1', timeout=1))
+        # Задачи выполняются по порядку постановки, на время выполнения лежат в списке воркера
+        self.assertEqual([value for value, items in job_calls], [1, 2])
+        self.assertEqual([len(items) for value, items in job_calls], [1, 1])
+        self.assertEqual(self.backend.client.llen(processing), 0)
+
+    def test_failed_job_leaves_processing(self):
+        processing = self.backend.processing_queue('w1')
+        self.backend.enqueue('record', [1], {'processing': processing, 'fail': True})
+        with self.assertLogs('mailing.jobs', 'ERROR'):
+            self.assertTrue(self.backend.work_once('w1', timeout=1))
+        self.assertEqual(len(job_calls), 1)
+        self.assertEqual(self.backend.client.llen(processing), 0)
+        self.assertEqual(self.backend.client.llen('test:jobs'), 0)
+
+    def test_recover_returns_unfinished_jobs(self):
+        self.backend.enqueue('record', [1], {})
+        self.backend.enqueue('record', [2], {})
+        self.backend.enqueue('record', [3], {})
+        # Воркер взял две задачи и упал, не выполнив их
+        for number in range(2):
+            self.backend.client.lmove('test:jobs', self.backend.processing_queue('w1'), 'RIGHT', 'LEFT')
+
+        self.assertEqual(self.backend.recover('w2'), 0)
+        with self.assertLogs('mailing.jobs', 'WARNING'):
+            self.assertEqual(self.backend.recover('w1'), 2)
+        self.assertEqual(self.backend.client.llen(self.backend.processing_queue('w1')), 0)
+        while self.backend.work_once('w1', timeout=1):
+            pass
+        # Возвращенные задачи выполняются первыми и в прежнем порядке
+        self.assertEqual([value for value, items in job_calls], [1, 2, 3])
+
+    def test_restarted_worker_recovers_killed_worker_jobs(self):
+        self.backend.enqueue('record', [1], {'kill': True})
+        # Воркер убит после BLMOVE, задача осталась в его списке обрабатываемых
+        with self.assertRaises(SystemExit), self.backend.alive('host:100'):
+            self.backend.work_once('host:100', timeout=1)
+        self.assertEqual(self.backend.client.llen(self.backend.processing_queue('host:100')), 1)
+        self.assertFalse(self.backend.client.exists(self.backend.heartbeat_key('host:100')))
+
+        # Задачу живого воркера с heartbeat не трогаем
+        self.backend.client.lpush(self.backend.processing_queue('host:300'), 'busy')
+        with self.backend.alive('host:300'):
+            # Перезапущенный воркер получает новый идентификатор (другой pid)
+            with self.backend.alive('host:200'), self.assertLogs('mailing.jobs', 'WARNING'):
+                self.assertEqual(self.backend.recover_orphaned(), 1)
+                self.assertTrue(self.backend.work_once('host:200', timeout=1))
+            self.assertEqual(self.backend.client.llen(self.backend.processing_queue('host:300')), 1)
+
+        self.assertEqual([value for value, items in job_calls], [1, 1])
+        self.assertEqual(self.backend.client.llen(self.backend.processing_queue('host:100')), 0)
+        self.assertEqual(self.backend.client.llen('test:jobs'), 0)
+
+
+class _RecordingWriter:
+    def __init__(self):
+        self.data = b''
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+
+class AsyncSMTPSessionTests(SimpleTestCase):
+    def send(self, from_email, to_email, replies):
+        session = AsyncSMTPSession('test', host='localhost', port=25)
+        session.pipelining = True
+
+        async def scenario():
+            session._reader = asyncio.StreamReader()
+            session._reader.feed_data(replies)
+            session._writer = _RecordingWriter()
+            return await session.send(from_email, to_email, b'Subject: x\r\n\r\n.text\r\n')
+
+        return asyncio.run(scenario()), session._writer.data
+
+    def test_envelope_uses_bare_addresses(self):
+        reply, data = self.send(
+            'Отдел рассылок <news@example.com>',
+            'Иван <ivan@пример.рф>',
+            b'250 OK\r\n250 OK\r\n354 go\r\n250 queued\r\n'
+        )
+        self.assertEqual(reply, '250 queued')
+        self.assertEqual(
+            data,
+            b'MAIL FROM:<news@example.com>\r\nRCPT TO:<ivan@xn--e1afmkfd.xn--p1ai>\r\nDATA\r\n'
+            b'Subject: x\r\n\r\n..text\r\n.\r\n'
+        )
+
+    def test_address_with_line_break_rejected(self):
+        with self.assertRaises(ValueError):
+            self.send('news@example.com', 'a@test.ru\r\nRCPT TO:<b@test.ru>', b'')
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class DeduplicationTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(email='owner@test.ru', password='secret')
+        self.mailing = create_mailing(self.owner, status=Mailing.STARTED)
+        emails = ['a@test.ru', ' A@Test.ru ', 'b@test.ru', 'B@TEST.RU', 'c@test.ru']
+        self.clients = Client.objects.bulk_create(
+            Client(email=email, full_name=f'Клиент {number}', owner=self.owner) for number, email in enumerate(emails)
+        )
+        self.mailing.clients.set(self.clients)
+        sync_recipients(self.mailing)
+
+    def statuses(self):
+        return dict(MailingRecipient.objects.filter(mailing=self.mailing).values_list('client_id', 'status'))
+
+    def test_send_once_per_address(self):
+        send_mailing(self.mailing.id, mode='sequential')
+
+        self.assertEqual(sorted(message.to[0].strip().lower() for message in mail.outbox), ['a@test.ru', 'b@test.ru', 'c@test.ru'])
+        statuses = self.statuses()
+        self.assertEqual(statuses[self.clients[1].id], MailingRecipient.SKIPPED)
+        self.assertEqual(statuses[self.clients[3].id], MailingRecipient.SKIPPED)
+        self.assertEqual(list(statuses.values()).count(MailingRecipient.SENT), 3)
+
+    def test_workers_with_different_leases(self):
+        # Первый воркер держит a@test.ru и еще не отправил, второму достался его дубликат
+        first = claim_recipients(self.mailing, 'w1', limit=1)
+        second = claim_recipients(self.mailing, 'w2', limit=4)
+        self.assertEqual([client_id for client_id, email, full_name in first], [self.clients[0].id])
+
+        deduplicator = LedgerDeduplicator(self.mailing)
+        kept = [client_id for client_id, email, full_name in deduplicator.filter(second)]
+        self.assertEqual(kept, [self.clients[2].id, self.clients[4].id])
+        self.assertEqual(deduplicator.skipped, 2)
+        kept = [client_id for client_id, email, full_name in LedgerDeduplicator(self.mailing).filter(first)]
+        self.assertEqual(kept, [self.clients[0].id])
+
+    def test_address_sent_in_previous_run(self):
+        MailingRecipient.objects.filter(mailing=self.mailing, client=self.clients[1]).update(
+            status=MailingRecipient.SENT
+        )
+        self.assertEqual(
+            LedgerDeduplicator(self.mailing).duplicates([self.clients[0].id, self.clients[4].id]),
+            {self.clients[0].id}
+        )
+
+    def test_changed_email_updates_key(self):
+        client = self.clients[3]
+        client.email = 'd@test.ru'
+        client.save()
+        self.assertEqual(LedgerDeduplicator(self.mailing).duplicates([client.id]), set())
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class RecipientLeaseTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(email='owner@test.ru', password='secret')
+        self.mailing = create_mailing(self.owner, clients=5, status=Mailing.STARTED)
+        sync_recipients(self.mailing)
+        self.client_ids = list(self.mailing.clients.order_by('id').values_list('id', flat=True))
+
+    def claimed(self, worker_id, limit, **kwargs):
+        return [client_id for client_id, email, full_name in claim_recipients(self.mailing, worker_id, limit, **kwargs)]
+
+    def test_workers_get_disjoint_leases(self):
+        self.assertEqual(self.claimed('w1', 2), self.client_ids[:2])
+        self.assertEqual(self.claimed('w2', 2), self.client_ids[2:4])
+        self.assertEqual(self.claimed('w1', 5), self.client_ids[4:])
+        self.assertEqual(self.claimed('w2', 5), [])
+
+    def test_expired_lease_taken_over(self):
+        self.assertEqual(self.claimed('w1', 2), self.client_ids[:2])
+        MailingRecipient.objects.filter(mailing=self.mailing, leased_by='w1').update(
+            lease_expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertEqual(self.claimed('w2', 2), self.client_ids[:2])
+        self.assertEqual(
+            set(MailingRecipient.objects.filter(client_id__in=self.client_ids[:2]).values_list('leased_by', flat=True)),
+            {'w2'}
+        )
+
+    def test_released_lease_taken_over(self):
+        self.claimed('w1', 3)
+        MailingRecipient.objects.filter(mailing=self.mailing, client_id=self.client_ids[0]).update(
+            status=MailingRecipient.SENT
+        )
+        self.assertEqual(release_recipients(self.mailing, 'w1'), 2)
+        self.assertEqual(self.claimed('w2', 5), self.client_ids[1:])
+
+    def test_send_mailing_skips_foreign_lease(self):
+        self.claimed('w1', 3)
+        with self.assertLogs('mailing.tasks', 'INFO') as logs:
+            send_mailing(self.mailing.id, mode='sequential', worker_id='w2')
+
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertIn('Успешно: 2/2 (воркер w2)', '\n'.join(logs.output))
+        statuses = dict(MailingRecipient.objects.filter(mailing=self.mailing).values_list('client_id', 'status'))
+        self.assertEqual([statuses[client_id] for client_id in self.client_ids], ['pending'] * 3 + ['sent'] * 2)
+        # Аренда первого воркера не снята, второй ничего не держит
+        self.assertFalse(MailingRecipient.objects.filter(leased_by='w2', status=MailingRecipient.PENDING).exists())
+        self.assertEqual(MailingRecipient.objects.filter(leased_by='w1').count(), 3)
+
+    @override_settings(
+        EMAIL_BACKEND='mailing.tests.SlowBackend',
+        MAILING_LEASE_SECONDS=1,
+        MAILING_LOG_BATCH_SIZE=1,
+        MAILING_DELIVERY_CHUNK_SIZE=1
+    )
+    def test_lease_renewed_during_delivery(self):
+        # Отправка всей пачки дольше срока аренды, но воркер продлевает ее после каждого сохранения
+        SlowBackend.mailing = self.mailing
+        SlowBackend.stolen = []
+        send_mailing(self.mailing.id, mode='sequential', worker_id='w1')
+
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(SlowBackend.stolen, [])
+        statuses = MailingRecipient.objects.filter(mailing=self.mailing).values_list('status', flat=True)
+        self.assertEqual(list(statuses), [MailingRecipient.SENT] * 5)
+
+    def test_expired_lease_not_marked(self):
+        self.claimed('w1', 3, lease_seconds=1)
+        # Аренда истекла посреди отправки, получателей забрал второй воркер
+        MailingRecipient.objects.filter(mailing=self.mailing, leased_by='w1').update(
+            lease_expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertEqual(self.claimed('w2', 2), self.client_ids[:2])
+
+        with self.assertLogs('mailing.logwriter', 'WARNING') as logs, MailingLogWriter(worker_id='w1') as writer:
+            for client_id in self.client_ids[:3]:
+                writer.add(self.mailing, MailingLog.SUCCESS, '250 OK', client_id=client_id, smtp_code=250)
+        self.assertIn('воркер w1 потерял аренду 2 получателей', '\n'.join(logs.output))
+
+        statuses = dict(MailingRecipient.objects.filter(mailing=self.mailing).values_list('client_id', 'status'))
+        self.assertEqual(
+            [statuses[client_id] for client_id in self.client_ids],
+            ['pending', 'pending', 'sent', 'pending', 'pending']
+        )
+        self.assertEqual(MailingRecipient.objects.filter(leased_by='w2').count(), 2)
+        self.assertEqual(MailingLog.objects.filter(mailing=self.mailing).count(), 3)
+
+
+class SlowBackend(locmem.EmailBackend):
+    """Отправляет письмо 0.3 секунды и после каждого пытается забрать получателей вторым воркером"""
+    mailing = None
+    stolen = []
+
+    def send_messages(self, messages):
+        time.sleep(0.3)
+        sent = super().send_messages(messages)
+        SlowBackend.stolen += claim_recipients(self.mailing, 'w2')
+        return sent
+
+
+class DeliveryModeTests(TestCase):
+    """Отправка рассылки через локальный SMTPSink в каждом режиме доставки"""
+
+    def test_all_modes(self):
+        owner = User.objects.create_user(email='owner@test.ru', password='secret')
+        for mode in ('sequential', 'thread', 'process', 'async'):
+            with self.subTest(mode=mode):
+                mailing = create_mailing(owner, clients=12, status=Mailing.STARTED)
+                with SMTPSink() as sink, benchmark.sink_settings(sink, mode, 2), \
+                        override_settings(MAILING_DELIVERY_CHUNK_SIZE=5):
+                    send_mailing(mailing.id, mode=mode, workers=2)
+
+                self.assertEqual(sink.messages, 12)
+                self.assertEqual(sink.recipients, 12)
+                statuses = MailingRecipient.objects.filter(mailing=mailing).values_list('status', flat=True)
+                self.assertEqual(list(statuses), [MailingRecipient.SENT] * 12)
+                logs = MailingLog.objects.filter(mailing=mailing)
+                self.assertEqual(logs.filter(status=MailingLog.SUCCESS, smtp_code=250).count(), 12)
+                self.assertEqual(logs.values('client').distinct().count(), 12)
+
+
+class InterruptingBackend(locmem.EmailBackend):
+    """Принимает limit писем, затем прерывает отправку, как Ctrl+C или остановка процесса"""
+    limit = 0
+
+    def send_messages(self, messages):
+        if len(mail.outbox) >= self.limit:
+            raise KeyboardInterrupt
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', MAILING_DELIVERY_CHUNK_SIZE=2)
+class RecipientLedgerTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(email='owner@test.ru', password='secret')
+        self.mailing = create_mailing(self.owner, clients=7, status=Mailing.STARTED)
+
+    def sent_to(self):
+        return sorted(message.to[0] for message in mail.outbox)
+
+    def test_resume_after_interruption(self):
+        InterruptingBackend.limit = 3
+        with override_settings(EMAIL_BACKEND='mailing.tests.InterruptingBackend'), self.assertRaises(KeyboardInterrupt):
+            send_mailing(self.mailing.id, mode='sequential')
+        first_run = self.sent_to()
+        self.assertEqual(len(first_run), 3)
+        # Исходы отправленных до прерывания писем сохранены, контрольная точка сдвинута
+        ledger = MailingRecipient.objects.filter(mailing=self.mailing)
+        self.assertEqual(ledger.filter(status=MailingRecipient.SENT).count(), 3)
+        self.mailing.refresh_from_db()
+        self.assertEqual(self.mailing.checkpoint, ledger.order_by('client_id')[2].client_id)
+
+        mail.outbox = []
+        send_mailing(self.mailing.id, mode='sequential')
+        second_run = self.sent_to()
+        self.assertEqual(len(second_run), 4)
+        self.assertFalse(set(first_run) & set(second_run))
+        self.assertEqual(ledger.filter(status=MailingRecipient.SENT).count(), 7)
+        self.assertEqual(MailingLog.objects.filter(mailing=self.mailing).count(), 7)
+
+    def test_no_resend_on_rerun(self):
+        send_mailing(self.mailing.id, mode='thread', workers=2)
+        self.assertEqual(len(mail.outbox), 7)
+
+        mail.outbox = []
+        send_mailing(self.mailing.id, mode='thread', workers=2)
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(MailingLog.objects.filter(mailing=self.mailing).count(), 7)
+
+    def test_new_client_sent_on_rerun(self):
+        send_mailing(self.mailing.id, mode='sequential')
+        client = Client.objects.create(email='new@test.ru', full_name='Новый', owner=self.owner)
+        self.mailing.clients.add(client)
+
+        mail.outbox = []
+        send_mailing(self.mailing.id, mode='sequential')
+        self.assertEqual(self.sent_to(), ['new@test.ru'])
+
+
+class StatisticsTests(TestCase):
+    """Счетчики, которые ведутся по ходу работы, совпадают с полным пересчетом"""
+
+    def counters(self):
+        fields = ['created_mailings', 'started_mailings', 'completed_mailings', 'success_attempts', 'failure_attempts']
+        return {
+            row[0]: row[1:]
+            for row in MailingStatistics.objects.values_list('owner_id', *fields)
+            if any(row[1:])
+        }
+
+    def test_incremental_matches_rebuild(self):
+        owners = [User.objects.create_user(email=f'owner{number}@test.ru', password='secret') for number in range(2)]
+        mailings = [create_mailing(owner) for owner in owners for number in range(3)]
+
+        # Смена статуса через save и массово
+        mailings[0].status = Mailing.STARTED
+        mailings[0].save()
+        statistics.update_mailing_status(Mailing.objects.filter(id__in=[mailings[1].id, mailings[3].id]), Mailing.COMPLETED)
+
+        # Логи пачкой через MailingLogWriter и поштучно
+        with MailingLogWriter() as writer:
+            for number in range(10):
+                mailing = mailings[number % len(mailings)]
+                writer.add(mailing, MailingLog.SUCCESS if number % 4 else MailingLog.FAILURE, "Ответ")
+        MailingLog.objects.create(mailing=mailings[2], status=MailingLog.FAILURE, server_response="Ошибка")
+
+        # Удаление рассылки вместе с логами и владельца со всеми его рассылками
+        mailings[2].delete()
+        owners[1].delete()
+        self.assertNotEqual(self.counters(), {})
+        incremental = self.counters()
+
+        statistics.rebuild_statistics()
+        self.assertEqual(incremental, self.counters())
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(email='owner@test.ru', password='secret')
+        cls.mailing = create_mailing(cls.owner)
+        response = MailingResponse.objects.create(text='Успешно отправлено', text_hash='0' * 32)
+        # По 4 лога на одно время: порядок внутри одинакового времени задает id
+        moment = timezone.now()
+        MailingLog.objects.bulk_create(
+            MailingLog(
+                mailing=cls.mailing,
+                status=MailingLog.SUCCESS if number % 3 else MailingLog.FAILURE,
+                response=response,
+                attempt_time=moment - timedelta(seconds=number // 4)
+            )
+            for number in range(23)
+        )
+        cls.logs = MailingLog.objects.filter(mailing=cls.mailing)
+        cls.expected = list(cls.logs.order_by('-attempt_time', '-id').values_list('id', flat=True))
+
+    def ids(self, page):
+        return [log.id for log in page.object_list]
+
+    def test_forward_and_back(self):
+        pages = [keyset_paginate(self.logs, 5)]
+        self.assertFalse(pages[0].has_previous)
+        while pages[-1].has_next:
+            pages.append(keyset_paginate(self.logs, 5, after=pages[-1].next_cursor))
+        self.assertEqual([len(page.object_list) for page in pages], [5, 5, 5, 5, 3])
+        self.assertEqual([log_id for page in pages for log_id in self.ids(page)], self.expected)
+
+        # Назад от последней страницы - те же страницы в обратном порядке
+        page = pages[-1]
+        for expected in reversed(pages[:-1]):
+            page = keyset_paginate(self.logs, 5, before=page.previous_cursor)
+            self.assertEqual(self.ids(page), self.ids(expected))
+        self.assertFalse(page.has_previous)
+
+    def test_filtered_by_status(self):
+        failures = self.logs.filter(status=MailingLog.FAILURE)
+        first = keyset_paginate(failures, 5)
+        second = keyset_paginate(failures, 5, after=first.next_cursor)
+        self.assertEqual(self.ids(first) + self.ids(second), list(
+            failures.order_by('-attempt_time', '-id').values_list('id', flat=True)
+        ))
+        self.assertFalse(second.has_next)
+
+    def test_invalid_cursor(self):
+        for cursor in ('garbage', 'MjAyNnwx', '!!'):
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor)
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse('mailing:mailing_logs', args=[self.mailing.pk]), {'after': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+
+class ClientImportTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(email='owner@test.ru', password='secret')
+        Client.objects.create(email='Old@Test.ru', full_name='Старый', owner=self.owner)
+
+    def test_counts(self):
+        data = (
+            'Почта;ФИО;Комментарий\n'
+            'a@test.ru;Анна;\n'
+            'b@test.ru;Борис;vip\n'
+            'old@test.ru;Старый;\n'
+            'A@TEST.RU;Анна снова;\n'
+            ';;\n'
+            'not-an-email;Кто-то;\n'
+            'c@test.ru;;\n'
+            'd@test.ru;Дарья;\n'
+        )
+        mailing = create_mailing(self.owner)
+        rejected = io.StringIO()
+        # Пачки по 2 строки и перенос проверки повторов на диск уже после двух адресов
+        with override_settings(MAILING_DEDUP_MEMORY_LIMIT=2):
+            report = import_clients(
+                io.StringIO(data), self.owner, mailing=mailing, batch_size=2,
+                report=ImportReport(rejected_file=rejected)
+            )
+
+        self.assertEqual(
+            (report.created, report.existing, report.duplicates, report.rejected, report.attached),
+            (3, 1, 1, 2, 4)
+        )
+        self.assertEqual([line for line, row, reason in report.errors], [7, 8])
+        self.assertEqual(len(rejected.getvalue().splitlines()), 3)
+        self.assertEqual(Client.objects.filter(owner=self.owner).count(), 4)
+        self.assertEqual(Client.objects.get(email='b@test.ru').comment, 'vip')
+        self.assertEqual(mailing.clients.count(), 4)
+
+    def test_attached_counts_new_links_only(self):
+        mailing = create_mailing(self.owner)
+        mailing.clients.add(Client.objects.get(email='Old@Test.ru'))
+        data = 'email;full_name\nold@test.ru;Старый\nnew@test.ru;Новый\n'
+        report = import_clients(io.StringIO(data), self.owner, mailing=mailing)
+        self.assertEqual((report.created, report.existing, report.attached), (1, 1, 1))
+        self.assertEqual(mailing.clients.count(), 2)
+
+        # Повторный импорт того же файла ничего не добавляет
+        report = import_clients(io.StringIO(data), self.owner, mailing=mailing)
+        self.assertEqual((report.created, report.existing, report.attached), (0, 2, 0))
+
+    def test_without_header(self):
+        report = import_clients(io.StringIO('x@test.ru,Икс,\ny@test.ru,Игрек,комментарий\n'), self.owner)
+        self.assertEqual((report.created, report.rejected), (2, 0))
+        self.assertEqual(Client.objects.get(email='y@test.ru').comment, 'комментарий')
+
+
+class ExportTests(TestCase):
+    def test_formula_cells_escaped(self):
+        owner = User.objects.create_user(email='owner@test.ru', password='secret')
+        for full_name, comment in (
+            ('=HYPERLINK("http://evil.example","Открыть")', '+7 900 000-00-00'),
+            ('@SUM(A1:A2)', '-1+2'),
+            ('Обычное имя', 'a=b'),
+        ):
+            Client.objects.create(email='client@test.ru', full_name=full_name, comment=comment, owner=owner)
+        self.client.force_login(owner)
+
+        response = self.client.get(reverse('mailing:client_export'))
+        content = b''.join(response.streaming_content).decode('utf-8-sig')
+        rows = list(csv.reader(io.StringIO(content)))[1:]
+        self.assertEqual(
+            [(full_name, comment) for client_id, email, full_name, comment in rows],
+            [
+                ('\'=HYPERLINK("http://evil.example","Открыть")', "'+7 900 000-00-00"),
+                ("'@SUM(A1:A2)", "'-1+2"),
+                ('Обычное имя', 'a=b'),
+            ]
+        )
+        # Числа не экранируются
+        self.assertTrue(all(row[0].isdigit() for row in rows))
+
+
+class BenchmarkTests(TestCase):
+    def test_seed_run_cleanup(self):
+        data = benchmark.seed(10, mailings=2, batch_size=4)
+        self.assertEqual(Client.objects.filter(owner=data.owner).count(), 10)
+        self.assertEqual([mailing.clients.count() for mailing in data.mailings], [5, 5])
+
+        result = benchmark.run(data, 'thread', 2)
+        self.assertEqual(
+            (result['emails'], result['sent'], result['pending'], result['accepted_by_sink']),
+            (10, 10, 0, 10)
+        )
+        self.assertEqual(result['latency_samples'], 10)
+
+        # Повторный прогон после reset отправляет все заново, в том числе через check_mailings
+        benchmark.reset(data)
+        result = benchmark.run(data, 'sequential', 1, entry=benchmark.CHECK_MAILINGS)
+        self.assertEqual((result['sent'], result['accepted_by_sink']), (10, 10))
+        self.assertEqual(MailingLog.objects.filter(mailing_id__in=data.mailing_ids).count(), 10)
+
+        benchmark.cleanup(data)
+        self.assertFalse(Client.objects.filter(owner_id=data.owner.id).exists())
+        self.assertFalse(Mailing.objects.filter(id__in=data.mailing_ids).exists())
+        self.assertFalse(User.objects.filter(id=data.owner.id).exists())
+
+    def test_command_report(self):
+        stdout = io.StringIO()
+        call_command(
+            'benchmark_delivery', '--recipients', '6', '--mode', 'sequential', '--mode', 'async',
+            stdout=stdout, stderr=io.StringIO()
+        )
+        report = json.loads(stdout.getvalue())
+        self.assertEqual([run['mode'] for run in report['runs']], ['sequential', 'async'])
+        self.assertEqual([run['accepted_by_sink'] for run in report['runs']], [6, 6])
+        self.assertFalse(User.objects.filter(email__endswith=benchmark.BENCHMARK_DOMAIN).exists())
+
+    def test_scale(self):
+        self.assertEqual([scale('10000'), scale('10k'), scale('1.5M')], [10000, 10000, 1500000])
+        for value in ('0', 'abc', '-1k'):
+            with self.assertRaises(ValueError):
+                scale(value)
+
+
+def parse_message(data):
+    """Тема и текст письма; у 8bit тела парсер оставляет CRLF, как и у писем Django"""
+    message = email.message_from_bytes(data, policy=policy.default)
+    return message['Subject'], message.get_content().replace('\r\n', '\n')
+
+
+class PersonalizationTests(TestCase):
+    def test_template(self):
+        template = Template('Здравствуйте, {{full_name}}! Ваш адрес {{ email }}, {{ city }}')
+        self.assertEqual(template.fields, ('email', 'full_name'))
+        self.assertEqual(
+            template.render({'full_name': 'Анна', 'email': 'a@test.ru'}),
+            'Здравствуйте, Анна! Ваш адрес a@test.ru, {{ city }}'
+        )
+        self.assertTrue(Template('Без полей {{ city }}').is_static)
+        self.assertEqual(unknown_fields('{{ full_name }} {{ city }} {{city}} {{ phone }}'), ['city', 'phone'])
+
+    def test_form_rejects_unknown_fields(self):
+        form = MessageForm(data={'subject': 'Для {{ full_name }}', 'body': 'Ваш {{ phone }}'})
+        self.assertFalse(form.is_valid())
+        self.assertIn('phone', form.errors['body'][0])
+        self.assertTrue(MessageForm(data={'subject': 'Для {{ full_name }}', 'body': '{{ email }}'}).is_valid())
+
+    def test_rendered_per_recipient(self):
+        prepared = PreparedMessage('Для {{ full_name }}', 'Привет, {{ full_name }}!\nАдрес: {{ email }}\n', 'news@test.ru')
+        recipients = [
+            (1, 'a@test.ru', 'Анна'),
+            (2, 'b@test.ru', 'Anna'),
+            (3, 'c@test.ru', 'Очень ' * 40),
+            (4, 'd@test.ru', ''),
+            (5, 'e@test.ru', 'Первая\nвторая'),
+        ]
+        message = prepared.personalize(recipients)
+        for client_id, address, full_name in recipients:
+            subject, body = parse_message(message.render(address))
+            self.assertEqual(subject, 'Для ' + ' '.join(full_name.splitlines()))
+            self.assertEqual(body, f'Привет, {full_name}!\nАдрес: {address}\n')
+            # Бэкенды Django получают то же письмо
+            self.assertEqual(parse_message(message.email_for(address).message().as_bytes()), (subject, body))
+
+    def test_static_message_unchanged(self):
+        prepared = PreparedMessage('Новости', 'Текст без полей {{ city }}\n', 'news@test.ru')
+        self.assertFalse(prepared.personalized)
+        subject, body = parse_message(prepared.personalize([(1, 'a@test.ru', 'Анна')]).render('a@test.ru'))
+        self.assertEqual((subject, body), ('Новости', 'Текст без полей {{ city }}\n'))
+
+    @override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+    def test_send_mailing(self):
+        owner = User.objects.create_user(email='owner@test.ru', password='secret')
+        mailing = create_mailing(
+            owner, clients=4, subject='{{ full_name }}, новости', body='Здравствуйте, {{ full_name }}!', status=Mailing.STARTED
+        )
+        send_mailing(mailing.id, mode='thread', workers=2)
+
+        expected = {client.email: client.full_name for client in mailing.clients.all()}
+        self.assertEqual(len(mail.outbox), 4)
+        for sent in mail.outbox:
+            subject, body = parse_message(sent.message().as_bytes())
+            full_name = expected[sent.to[0]]
+            self.assertEqual((subject, body.strip()), (f'{full_name}, новости', f'Здравствуйте, {full_name}!'))
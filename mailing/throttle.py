@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import re
+import smtplib
+import threading
+import time
+from collections import deque
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Ограничение скорости: rate писем в секунду с запасом burst
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1.0, self.rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Забирает токен и возвращает 0 или сколько секунд ждать до следующего"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        while (delay := self._reserve()) > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        while (delay := self._reserve()) > 0:
+            await asyncio.sleep(delay)
+
+
+class AIMDLimiter:
+    """
+    Адаптивное ограничение числа одновременных отправок (AIMD):
+    каждая успешная быстрая отправка понемногу увеличивает лимит (+1 за "окно"),
+    ответ 4xx/421, обрыв соединения или задержка выше target_latency
+    уменьшает его вдвое, не чаще раза в cooldown секунд.
+    """
+
+    def __init__(self, maximum, minimum=1, initial=None, target_latency=None, decrease_factor=0.5, cooldown=1.0):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(initial or minimum)
+        self.target_latency = target_latency
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+        # Ожидающие корутины (цикл событий, future): лимитер общий для процесса,
+        # release() может прийти из другого потока, поэтому не asyncio.Condition
+        self._waiters = deque()
+
+    def _notify(self):
+        """
+        Будит ожидающих после освобождения места или смены окна: потоки - все,
+        корутины - по числу свободных мест. Вызывается под self._condition.
+        """
+        self._condition.notify_all()
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            loop, waiter = self._waiters.popleft()
+            loop.call_soon_threadsafe(_wake, waiter)
+            free -= 1
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    async def acquire_async(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                waiter = loop.create_future()
+                self._waiters.append((loop, waiter))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                with self._condition:
+                    try:
+                        self._waiters.remove((loop, waiter))
+                    except ValueError:
+                        # Корутину уже разбудили, но место она не займет - будим следующую
+                        self._notify()
+                raise
+
+    def release(self, latency, congested=False):
+        with self._condition:
+            self.in_flight -= 1
+            slow = self.target_latency is not None and latency > self.target_latency
+            if congested or slow:
+                now = time.monotonic()
+                if now - self._last_decrease >= max(self.cooldown, latency):
+                    self.limit = max(self.minimum, self.limit * self.decrease_factor)
+                    self._last_decrease = now
+                    logger.info(
+                        f"Снижаем параллельность до {int(self.limit)}: "
+                        f"{'сервер просит подождать' if congested else f'задержка {latency:.2f} с'}"
+                    )
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._notify()
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class RelayController:
+    """
+    Ограничения для одного SMTP сервера: скорость (писем/с),
+    максимум соединений и адаптивная параллельность.
+    """
+
+    def __init__(self, relay, rate=0, max_connections=10, target_latency=None, retries=0):
+        self.relay = relay
+        self.max_connections = max_connections
+        self.retries = retries
+        self.bucket = TokenBucket(rate) if rate else None
+        self.limiter = AIMDLimiter(maximum=max_connections, target_latency=target_latency)
+
+    def acquire(self):
+        if self.bucket is not None:
+            self.bucket.acquire()
+        self.limiter.acquire()
+
+    async def acquire_async(self):
+        if self.bucket is not None:
+            await self.bucket.acquire_async()
+        await self.limiter.acquire_async()
+
+    def release(self, latency, error=None):
+        self.limiter.release(latency, congested=error is not None and is_congestion(error))
+        for observer in _send_observers:
+            observer(self.relay, latency, error)
+
+
+_send_observers = []
+
+
+def add_send_observer(callback):
+    """
+    Подписывает callback(relay, latency, error) на каждую попытку отправки
+    в текущем процессе (замеры, метрики). Вызывается из потоков отправки.
+    """
+    _send_observers.append(callback)
+
+
+def remove_send_observer(callback):
+    _send_observers.remove(callback)
+
+
+def is_congestion(error):
+    """
+    Временная ошибка, по которой сервер просит снизить нагрузку: 4xx (в т.ч. 421),
+    обрыв или таймаут соединения. Постоянные ошибки 5xx сюда не относятся.
+    """
+    if isinstance(error, (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)):
+        return True
+    code = reply_code(error)
+    return code is not None and 400 <= code < 500
+
+
+def reply_code(error):
+    """
+    Числовой код ответа SMTP из исключения smtplib или асинхронного клиента, None если его нет
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, message in error.recipients.values()]
+        return codes[0] if codes else None
+    code = getattr(error, 'smtp_code', None) or getattr(error, 'code', None)
+    return code if isinstance(code, int) and 100 <= code < 600 else None
+
+
+# Адрес в ответе сервера: "550 5.1.1 <ivan@test.ru>: Recipient address rejected"
+_ADDRESS = re.compile(r'<?[^\s<>()\[\],;:"\'@]+@[^\s<>()\[\],;:"\']+>?')
+
+
+def reply_text(error):
+    """
+    Текст ошибки отправки для лога без адреса получателя (он есть в клиенте лога):
+    одинаковые отказы сервера разным получателям дают один текст ответа
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        text = '; '.join(str(reply) for reply in error.recipients.values())
+    else:
+        text = str(error)
+    return _ADDRESS.sub('<адрес>', text)
+
+
+_controllers = {}
+_controllers_lock = threading.Lock()
+
+
+def get_relay_controller(host=None, port=None, share=1):
+    """
+    Общий для процесса контроллер SMTP сервера. Настройки берутся из
+    MAILING_RELAY_LIMITS['host:port'], иначе из MAILING_RELAY_*.
+    share делит лимит скорости между процессами, отправляющими параллельно.
+    """
+    host = host or settings.EMAIL_HOST
+    port = int(port or settings.EMAIL_PORT or 25)
+    relay = f"{host}:{port}"
+    key = (relay, share)
+
+    with _controllers_lock:
+        controller = _controllers.get(key)
+        if controller is None:
+            limits = settings.MAILING_RELAY_LIMITS.get(relay, {})
+            rate = limits.get('rate', settings.MAILING_RELAY_RATE)
+            controller = _controllers[key] = RelayController(
+                relay,
+                rate=rate / share if rate else 0,
+                max_connections=limits.get('max_connections', settings.MAILING_RELAY_MAX_CONNECTIONS),
+                target_latency=limits.get('target_latency', settings.MAILING_RELAY_TARGET_LATENCY),
+                retries=limits.get('retries', settings.MAILING_RELAY_RETRIES),
+            )
+        return controller
@@ -0,0 +1,151 @@
+import heapq
+import itertools
+import logging
+import time
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from mailing.models import Mailing
+from mailing.statistics import update_mailing_status
+
+logger = logging.getLogger(__name__)
+
+START = 'start'
+END = 'end'
+
+
+class MailingTimeline:
+    """
+    Очередь ближайших событий запущенных рассылок (начало и окончание) в виде кучи.
+    При изменении рассылки в кучу добавляются новые события, а старые
+    становятся неактуальными по номеру версии и пропускаются при извлечении.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._versions = {}
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._versions)
+
+    def load(self):
+        """Полная загрузка запущенных рассылок из БД"""
+        now = timezone.now()
+        self._heap.clear()
+        self._versions.clear()
+
+        completed = update_mailing_status(
+            Mailing.objects.filter(status=Mailing.STARTED, end_time__lt=now),
+            Mailing.COMPLETED
+        )
+        if completed:
+            logger.info(f"Автоматически завершено рассылок: {completed}")
+
+        mailings = Mailing.objects.filter(status=Mailing.STARTED).values('id', 'start_time', 'end_time')
+        for row in mailings:
+            self._schedule(row)
+        logger.debug(f"Загружено запущенных рассылок: {len(self._versions)}")
+
+    def refresh(self, mailing_id):
+        """Перечитывает одну рассылку после ее изменения"""
+        self._versions.pop(mailing_id, None)
+        row = Mailing.objects.filter(
+            id=mailing_id,
+            status=Mailing.STARTED
+        ).values('id', 'start_time', 'end_time').first()
+        if row is not None:
+            self._schedule(row)
+
+    def _schedule(self, row):
+        version = next(self._counter)
+        self._versions[row['id']] = version
+        heapq.heappush(self._heap, (row['start_time'], version, row['id'], START))
+        heapq.heappush(self._heap, (row['end_time'], version, row['id'], END))
+
+    def _is_current(self, entry):
+        when, version, mailing_id, kind = entry
+        return self._versions.get(mailing_id) == version
+
+    def seconds_until_next(self, now=None):
+        """Сколько секунд до ближайшего события, None если событий нет"""
+        while self._heap and not self._is_current(self._heap[0]):
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        now = now or timezone.now()
+        return max(0.0, (self._heap[0][0] - now).total_seconds())
+
+    def pop_due(self, now=None):
+        """Извлекает наступившие события как список (id рассылки, тип события)"""
+        now = now or timezone.now()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            if not self._is_current(entry):
+                continue
+            when, version, mailing_id, kind = entry
+            due.append((mailing_id, kind))
+            if kind == END:
+                self._versions.pop(mailing_id, None)
+        return due
+
+
+def _redis(**kwargs):
+    return redis.Redis.from_url(settings.REDIS_URL, **kwargs)
+
+
+def notify_schedule_changed(mailing_id):
+    """
+    Сообщает планировщику об изменении рассылки после коммита транзакции
+    """
+    def publish():
+        try:
+            # Короткие таймауты: недоступный Redis не должен тормозить сохранение рассылок
+            _redis(socket_connect_timeout=1, socket_timeout=1).publish(settings.MAILING_SCHEDULER_CHANNEL, mailing_id)
+        except redis.RedisError as e:
+            logger.warning(f"Не удалось уведомить планировщик о рассылке ID {mailing_id}: {str(e)}")
+
+    transaction.on_commit(publish)
+
+
+class ScheduleListener:
+    """
+    Подписка планировщика на уведомления об изменении рассылок.
+    Если Redis недоступен, просто ждет до следующего события по таймеру.
+    """
+
+    def __init__(self):
+        self._pubsub = None
+
+    def _subscribe(self):
+        if self._pubsub is None:
+            pubsub = _redis().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(settings.MAILING_SCHEDULER_CHANNEL)
+            self._pubsub = pubsub
+        return self._pubsub
+
+    def wait(self, timeout):
+        """Ждет уведомлений не дольше timeout секунд и возвращает множество id рассылок"""
+        changed = set()
+        try:
+            pubsub = self._subscribe()
+            message = pubsub.get_message(timeout=timeout)
+            while message is not None:
+                if message['type'] == 'message':
+                    changed.add(int(message['data']))
+                message = pubsub.get_message(timeout=0)
+        except redis.RedisError as e:
+            logger.warning(f"Нет связи с Redis, уведомления о рассылках недоступны: {str(e)}")
+            self.close()
+            time.sleep(timeout)
+        return changed
+
+    def close(self):
+        if self._pubsub is not None:
+            try:
+                self._pubsub.close()
+            except redis.RedisError:
+                pass
+            self._pubsub = None
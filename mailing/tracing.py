@@ -0,0 +1,168 @@
+import heapq
+import itertools
+import os
+import random
+import sys
+import sysconfig
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.base import Template
+from django.utils import timezone
+
+# Кольцевой буфер последних трасс процесса
+_traces = deque(maxlen=200)
+_local = threading.local()
+_template_patched = False
+
+# Кадры стандартной библиотеки и установленных пакетов (в т.ч. Django) не считаются местом вызова запроса
+_LIBRARY_PATHS = tuple({sysconfig.get_path(name) for name in ('stdlib', 'purelib', 'platlib')})
+
+
+class Trace:
+    """
+    Замеры одного запроса: общее время, время отрисовки шаблонов,
+    число и время SQL запросов и самые медленные из них с местом вызова
+    """
+
+    def __init__(self, request, slow_queries):
+        self.started_at = timezone.now()
+        self.method = request.method
+        self.path = request.get_full_path()
+        self.view = ''
+        self.status = None
+        self.duration = 0.0
+        self.template_time = 0.0
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.pid = os.getpid()
+        self._slow_queries = slow_queries
+        self._slowest = []
+        self._counter = itertools.count()
+        self._template_depth = 0
+
+    @property
+    def view_time(self):
+        """Время без отрисовки шаблонов (вместе с SQL самого представления)"""
+        return max(0.0, self.duration - self.template_time)
+
+    @property
+    def timings_ms(self):
+        """Время запроса, представления, шаблонов и SQL в миллисекундах для страницы трасс"""
+        return {
+            'total': self.duration * 1000,
+            'view': self.view_time * 1000,
+            'template': self.template_time * 1000,
+            'sql': self.sql_time * 1000,
+        }
+
+    @property
+    def slowest_queries(self):
+        """Самые медленные запросы по убыванию времени: (миллисекунды, SQL, место вызова)"""
+        return [
+            (duration * 1000, sql, site)
+            for duration, number, sql, site in sorted(self._slowest, reverse=True)
+        ]
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.sql_count += 1
+            self.sql_time += duration
+            # Место вызова ищем только для запросов, попадающих в самые медленные
+            if len(self._slowest) < self._slow_queries or duration > self._slowest[0][0]:
+                entry = (duration, next(self._counter), sql, _call_site())
+                if len(self._slowest) < self._slow_queries:
+                    heapq.heappush(self._slowest, entry)
+                else:
+                    heapq.heapreplace(self._slowest, entry)
+
+
+def _call_site():
+    """Первый кадр стека в коде проекта: файл:строка в функции"""
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename != __file__ and not filename.startswith(_LIBRARY_PATHS):
+            return f"{os.path.relpath(filename, settings.BASE_DIR)}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return ''
+
+
+def _patch_template_render():
+    """
+    Оборачивает Template.render, чтобы считать время отрисовки шаблонов
+    трассируемого запроса. Вложенные шаблоны (include) в сумму не добавляются.
+    Для запросов без трассы обертка сразу вызывает исходный метод.
+    """
+    global _template_patched
+    if _template_patched:
+        return
+    original = Template.render
+
+    def render(self, context):
+        trace = getattr(_local, 'trace', None)
+        if trace is None or trace._template_depth:
+            return original(self, context)
+        trace._template_depth += 1
+        started = time.perf_counter()
+        try:
+            return original(self, context)
+        finally:
+            trace.template_time += time.perf_counter() - started
+            trace._template_depth -= 1
+
+    Template.render = render
+    _template_patched = True
+
+
+class TracingMiddleware:
+    """
+    Выборочная трассировка запросов: доля TRACING_SAMPLE_RATE запросов
+    замеряется (время представления и шаблонов, SQL запросы), трассы
+    складываются в кольцевой буфер процесса на TRACING_BUFFER_SIZE записей
+    и видны сотрудникам на странице /traces/. При нулевой доле
+    middleware отключается и ничего не стоит.
+    """
+
+    def __init__(self, get_response):
+        if not settings.TRACING_SAMPLE_RATE:
+            raise MiddlewareNotUsed
+        global _traces
+        if _traces.maxlen != settings.TRACING_BUFFER_SIZE:
+            _traces = deque(_traces, maxlen=settings.TRACING_BUFFER_SIZE)
+        _patch_template_render()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.TRACING_SAMPLE_RATE or request.path.startswith(settings.TRACING_EXCLUDE_PATHS):
+            return self.get_response(request)
+
+        trace = Trace(request, settings.TRACING_SLOW_QUERIES)
+        _local.trace = trace
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(trace.record_query))
+                response = self.get_response(request)
+            trace.status = response.status_code
+            return response
+        finally:
+            trace.duration = time.perf_counter() - started
+            _local.trace = None
+            if request.resolver_match is not None:
+                trace.view = request.resolver_match.view_name
+            _traces.append(trace)
+
+
+def recent_traces():
+    """Трассы этого процесса от новых к старым"""
+    return list(reversed(_traces))
@@ -9,6 +9,8 @@ urlpatterns = [
     # Клиенты
     path('clients/', views.ClientListView.as_view(), name='client_list'),
     path('clients/create/', views.ClientCreateView.as_view(), name='client_create'),
+    path('clients/import/', views.ClientImportView.as_view(), name='client_import'),
+    path('clients/export/', views.export_clients, name='client_export'),
     path('clients/<int:pk>/update/', views.ClientUpdateView.as_view(), name='client_update'),
     path('clients/<int:pk>/delete/', views.ClientDeleteView.as_view(), name='client_delete'),
     # Сообщения
@@ -22,10 +24,13 @@ urlpatterns = [
     path('mailings/<int:pk>/update/', views.MailingUpdateView.as_view(), name='mailing_update'),
     path('mailings/<int:pk>/delete/', views.MailingDeleteView.as_view(), name='mailing_delete'),
     path('mailings/<int:pk>/logs/', views.MailingLogListView.as_view(), name='mailing_logs'),
+    path('mailings/<int:pk>/logs/export/', views.export_mailing_logs, name='mailing_logs_export'),
     path('mailings/<int:pk>/toggle/', views.toggle_mailing_status, name='toggle_mailing_status'),
     path('manager/mailings/', views.ManagerMailingListView.as_view(), name='manager_mailing_list'),
     path('manager/mailings/<int:pk>/disable/', views.disable_mailing, name='disable_mailing'),
     path('statistics/', views.statistics, name='statistics'),
+    path('metrics/', views.metrics, name='metrics'),
+    path('traces/', views.traces, name='traces'),
     path('logs/<int:pk>/', views.MailingLogView.as_view(), name='mailing_logs'),
 ]
 
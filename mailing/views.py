@@ -1,17 +1,26 @@
-from django.core.cache import cache
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import permission_required, login_required, user_passes_test
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.db.models import Count, Case, When, IntegerField
+from django.http import Http404, HttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse_lazy
-from django.utils.decorators import method_decorator
 from django.views import View
-from django.views.generic import ListView, CreateView, UpdateView, DeleteView, TemplateView
+from django.views.generic import ListView, CreateView, UpdateView, DeleteView, TemplateView, FormView
 from .models import Client, Message, Mailing, MailingLog
-from .forms import ClientForm, MessageForm, MailingForm
-from django.views.decorators.cache import cache_page
+from .caching import get_or_compute, owner_key, global_key
+from .forms import ClientForm, MessageForm, MailingForm, ClientImportForm
+from .exports import csv_response, client_rows, mailing_log_rows
+from .imports import import_clients
+from . import jobs, metrics as delivery_metrics
+from .tracing import recent_traces
+from .pagination import keyset_paginate
+from .querybudget import QueryBudgetMixin
+from .statistics import site_counters, owner_counters, popular_messages
 from django.contrib.auth.models import User
+import hmac
+import io
 import logging
 
 
@@ -19,27 +28,8 @@ logger = logging.getLogger(__name__)
 
 
 def home(request):
-    total_mailings = cache.get('total_mailings')
-    if not total_mailings:
-        total_mailings = Mailing.objects.count()
-        cache.set('total_mailings', total_mailings, 60 * 15)  # Исправлена ошибка в строке
-
-    active_mailings = cache.get('active_mailings')
-    if not active_mailings:
-        active_mailings = Mailing.objects.filter(status=Mailing.STARTED).count()
-        cache.set('active_mailings', active_mailings, 60 * 5)
-
-    unique_clients = cache.get('unique_clients')
-    if not unique_clients:
-        unique_clients = Client.objects.values('email').distinct().count()
-        cache.set('unique_clients', unique_clients, 60 * 60)
-
-    context = {
-        'total_mailings': total_mailings,
-        'active_mailings': active_mailings,
-        'unique_clients': unique_clients,
-    }
-    return render(request, 'mailing/home.html', context)
+    # Счетчики берутся из кеша, пересчитывает их один запрос (см. mailing.caching)
+    return render(request, 'mailing/home.html', site_counters())
 
 
 class ClientListView(LoginRequiredMixin, ListView):
@@ -62,6 +52,32 @@ class ClientCreateView(LoginRequiredMixin, CreateView):
         return super().form_valid(form)
 
 
+@login_required
+def export_clients(request):
+    return csv_response(
+        'clients.csv',
+        ['id', 'email', 'full_name', 'comment'],
+        client_rows(request.user)
+    )
+
+
+class ClientImportView(LoginRequiredMixin, FormView):
+    form_class = ClientImportForm
+    template_name = 'mailing/client_import.html'
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['user'] = self.request.user
+        return kwargs
+
+    def form_valid(self, form):
+        # Загруженный файл читается построчно, большие файлы Django держит на диске
+        stream = io.TextIOWrapper(form.cleaned_data['file'].file, encoding='utf-8-sig', errors='replace', newline='')
+        report = import_clients(stream, self.request.user, mailing=form.cleaned_data['mailing'])
+        logger.info(f"User {self.request.user} imported clients: {report}")
+        return self.render_to_response(self.get_context_data(form=form, report=report))
+
+
 class ClientUpdateView(LoginRequiredMixin, UpdateView):
     model = Client
     form_class = ClientForm
@@ -159,23 +175,76 @@ class MailingDeleteView(LoginRequiredMixin, DeleteView):
         return Mailing.objects.filter(owner=self.request.user)
 
 
-class MailingLogListView(LoginRequiredMixin, ListView):
+class MailingLogPageMixin:
+    """
+    Логи рассылки страницами по ключу (attempt_time, id) от новых к старым
+    с фильтром ?status=. Курсоры страниц передаются в ?after= и ?before=
+    """
     model = MailingLog
     template_name = 'mailing/mailing_logs.html'
+    context_object_name = 'logs'
+    page_size = 100
+
+    def filter_logs(self, queryset):
+        status = self.get_status()
+        if status is not None:
+            queryset = queryset.filter(status=status)
+        return queryset.select_related('response', 'client')
+
+    def get_status(self):
+        try:
+            status = int(self.request.GET.get('status', ''))
+        except ValueError:
+            return None
+        return status if status in dict(MailingLog.STATUS_CHOICES) else None
+
+    def get_context_data(self, **kwargs):
+        try:
+            page = keyset_paginate(
+                self.object_list,
+                self.page_size,
+                after=self.request.GET.get('after'),
+                before=self.request.GET.get('before')
+            )
+        except ValueError:
+            raise Http404('Страница не найдена')
+        context = super().get_context_data(object_list=page.object_list, **kwargs)
+        context['page'] = page
+        context['status'] = self.get_status()
+        context['status_choices'] = MailingLog.STATUS_CHOICES
+        return context
+
+
+class MailingLogListView(MailingLogPageMixin, LoginRequiredMixin, ListView):
 
     def get_queryset(self):
-        return MailingLog.objects.filter(mailing__owner=self.request.user, mailing_id=self.kwargs['pk'])
+        self.mailing = get_object_or_404(Mailing, pk=self.kwargs['pk'], owner=self.request.user)
+        return self.filter_logs(MailingLog.objects.filter(mailing=self.mailing))
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['mailing'] = get_object_or_404(Mailing, pk=self.kwargs['pk'], owner=self.request.user)
+        context['mailing'] = self.mailing
         return context
 
 
-class ManagerMailingListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
+@login_required
+def export_mailing_logs(request, pk):
+    mailing = get_object_or_404(Mailing, pk=pk)
+    if mailing.owner != request.user and not request.user.is_staff:
+        raise Http404('Рассылка не найдена')
+    return csv_response(
+        f'mailing_{mailing.id}_logs.csv',
+        ['attempt_time', 'status', 'email', 'smtp_code', 'server_response'],
+        mailing_log_rows(mailing)
+    )
+
+
+class ManagerMailingListView(QueryBudgetMixin, LoginRequiredMixin, UserPassesTestMixin, ListView):
     model = Mailing
     template_name = 'mailing/manager_mailing_list.html'
     context_object_name = 'mailings'
+    # Сессия, пользователь и рассылки с сообщениями и владельцами одним JOIN
+    query_budget = 3
 
     def test_func(self):
         # Проверяем, что пользователь является менеджером (staff)
@@ -183,7 +252,7 @@ class ManagerMailingListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
 
     def get_queryset(self):
         # Менеджер видит все рассылки
-        return Mailing.objects.all()
+        return Mailing.objects.select_related('message', 'owner')
 
 
 @login_required
@@ -206,106 +275,97 @@ def toggle_mailing_status(request, pk):
         mailing.status = Mailing.COMPLETED
 
     mailing.save()
+    if mailing.is_active() and settings.MAILING_JOB_BACKEND != jobs.INLINE:
+        # Отправка начнется сразу, не дожидаясь планировщика. С бэкендом inline
+        # рассылка отправлялась бы внутри запроса, поэтому ее запустит планировщик,
+        # которого уже уведомил сигнал post_save
+        jobs.enqueue('start_mailing', mailing.id)
     return redirect('mailing:mailing_list')
 
 @login_required
 def statistics(request):
-    # Общая статистика
-    total_mailings = Mailing.objects.count()
-    active_mailings = Mailing.objects.filter(status=Mailing.STARTED).count()
-    unique_clients = Client.objects.values('email').distinct().count()
-
-    # Статистика по пользователю
-    user_mailings = Mailing.objects.filter(owner=request.user).count()
-
-    # Статистика по логам
-    mailing_logs = MailingLog.objects.filter(mailing__owner=request.user)
-    success_logs = mailing_logs.filter(status=MailingLog.SUCCESS).count()
-    failure_logs = mailing_logs.filter(status=MailingLog.FAILURE).count()
+    # Общая статистика и статистика пользователя предрасчитаны и кешируются
+    counters = site_counters()
+    own = owner_counters(request.user)
 
-    # Популярные сообщения
-    popular_messages = Message.objects.filter(owner=request.user).annotate(
-        mailing_count=Count('mailing')
-    ).order_by('-mailing_count')[:5]
+    success_logs = own['success_attempts']
+    failure_logs = own['failure_attempts']
+    total_logs = success_logs + failure_logs
 
     context = {
-        'total_mailings': total_mailings,
-        'active_mailings': active_mailings,
-        'unique_clients': unique_clients,
-        'user_mailings': user_mailings,
+        'total_mailings': counters['total_mailings'],
+        'active_mailings': counters['active_mailings'],
+        'unique_clients': counters['unique_clients'],
+        'user_mailings': own['total_mailings'],
         'success_logs': success_logs,
         'failure_logs': failure_logs,
-        'popular_messages': popular_messages,
+        'success_percentage': round(success_logs * 100 / total_logs) if total_logs else 0,
+        'failure_percentage': round(failure_logs * 100 / total_logs) if total_logs else 0,
+        'popular_messages': popular_messages(request.user),
     }
 
     return render(request, 'mailing/statistics.html', context)
 
 
-@cache_page(60 * 15)  # Кешируем на 15 минут
-def home(request):
-    total_mailings = cache.get('total_mailings')
-    if not total_mailings:
-        total_mailings = Mailing.objects.count()
-        cache.set('total_mailings', total_mailings, 60 * 15)
-
-    active_mailings = cache.get('active_mailings')
-    if not active_mailings:
-        active_mailings = Mailing.objects.filter(status=Mailing.STARTED).count()
-        cache.set('active_mailings', active_mailings, 60 * 5)  # 5 минут для активных
+def metrics(request):
+    """
+    Метрики доставки в формате Prometheus, суммарно по всем процессам.
+    Доступ по METRICS_TOKEN (Authorization: Bearer) или сотрудникам.
+    """
+    token = settings.METRICS_TOKEN
+    authorized = bool(token) and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not authorized and not request.user.is_staff:
+        raise Http404
+    return HttpResponse(delivery_metrics.REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
-    unique_clients = cache.get('unique_clients')
-    if not unique_clients:
-        unique_clients = Client.objects.values('email').distinct().count()
-        cache.set('unique_clients', unique_clients, 60 * 60)  # 1 час для клиентов
 
-    context = {
-        'total_mailings': total_mailings,
-        'active_mailings': active_mailings,
-        'unique_clients': unique_clients,
-    }
-    return render(request, 'mailing/home.html', context)
+@login_required
+@user_passes_test(lambda u: u.is_staff)
+def traces(request):
+    # Буфер трасс свой у каждого процесса, страница показывает процесс, который ее отдал
+    return render(request, 'mailing/traces.html', {
+        'traces': recent_traces(),
+        'sample_rate': settings.TRACING_SAMPLE_RATE,
+    })
 
 
 # Для класс-базированных представлений
-class MailingListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
+class MailingListView(QueryBudgetMixin, LoginRequiredMixin, UserPassesTestMixin, ListView):
     model = Mailing
     template_name = 'mailing/mailing_list.html'
-
-    def get_queryset(self):
-        return Mailing.objects.filter(owner=self.request.user)
+    # Сессия, пользователь и рассылки (при промахе кеша) с сообщениями и числом клиентов
+    query_budget = 3
 
     def test_func(self):
         return self.request.user.is_authenticated
 
-    @method_decorator(cache_page(60 * 5))
-    def dispatch(self, *args, **kwargs):
-        return super().dispatch(*args, **kwargs)
-
     def get_queryset(self):
-        queryset = cache.get(f'mailings_{self.request.user.id}')
-        if not queryset:
+        # Список живет в кеше до изменения рассылок, клиентов или сообщений владельца (см. mailing.signals)
+        user = self.request.user
+        if user.is_staff:
+            key = global_key('mailing_list')
             queryset = Mailing.objects.all()
-            if not self.request.user.is_staff:
-                queryset = queryset.filter(owner=self.request.user)
-            cache.set(f'mailings_{self.request.user.id}', queryset, 60 * 5)
-        return queryset
+        else:
+            key = owner_key('mailing_list', user.id)
+            queryset = Mailing.objects.filter(owner=user)
+        queryset = queryset.select_related('message').annotate(clients_count=Count('clients'))
+        return get_or_compute(key, lambda: list(queryset), timeout=settings.CACHE_VERSIONED_TTL)
 
 
-class MailingLogView(LoginRequiredMixin, UserPassesTestMixin, ListView):
-    model = MailingLog
-    template_name = 'mailing/mailing_logs.html'
+class MailingLogView(MailingLogPageMixin, LoginRequiredMixin, UserPassesTestMixin, ListView):
 
     def test_func(self):
-        mailing = Mailing.objects.get(pk=self.kwargs['pk'])
-        return self.request.user == mailing.owner or self.request.user.is_staff
+        self.mailing = get_object_or_404(Mailing, pk=self.kwargs['pk'])
+        # Сравнение по id, без запроса владельца
+        return self.mailing.owner_id == self.request.user.id or self.request.user.is_staff
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['mailing'] = Mailing.objects.get(pk=self.kwargs['pk'])
+        context['mailing'] = self.mailing
         return context
 
     def get_queryset(self):
-        return MailingLog.objects.filter(mailing_id=self.kwargs['pk'])
+        return self.filter_logs(MailingLog.objects.filter(mailing=self.mailing))
 
 
 class UserListView(UserPassesTestMixin, ListView):
@@ -331,7 +391,5 @@ class HomeView(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['total_mailings'] = Mailing.objects.count()
-        context['active_mailings'] = Mailing.objects.filter(status='started').count()
-        context['unique_clients'] = Client.objects.values('email').distinct().count()
+        context.update(site_counters())
         return context
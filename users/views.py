@@ -5,7 +5,7 @@ from django.views.generic import CreateView, UpdateView, DetailView
 from .forms import UserRegisterForm, UserProfileForm
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from .models import User
-from mailing.models import Mailing, MailingLog
+from mailing.statistics import owner_counters
 
 
 class UserLoginView(LoginView):
@@ -42,17 +42,14 @@ class UserProfileView(LoginRequiredMixin, DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        user = self.request.user
-
-        # Статистика по рассылкам пользователя
-        mailings = Mailing.objects.filter(owner=user)
-        attempts = MailingLog.objects.filter(mailing__in=mailings)
 
+        # Статистика по рассылкам пользователя (предрасчитана и кешируется)
+        counters = owner_counters(self.request.user)
         context['user_mailing_stats'] = {
-            'total_mailings': mailings.count(),
-            'active_mailings': mailings.filter(status='Запущена').count(),
-            'successful_attempts': attempts.filter(status='Успешно').count(),
-            'failed_attempts': attempts.filter(status='Не успешно').count(),
+            'total_mailings': counters['total_mailings'],
+            'active_mailings': counters['active_mailings'],
+            'successful_attempts': counters['success_attempts'],
+            'failed_attempts': counters['failure_attempts'],
         }
         return context
 